@@ -0,0 +1,118 @@
+"""Compare the wall time and peak memory of the image processing with
+different settings.
+
+Usage::
+
+    python benchmarks/bench_images.py [SOURCE_DIR] [--img-size 1600 1067]
+
+Each variant is run in a new process, so that the peak memory (max RSS) is
+measured independently. By default the images from the test gallery are
+used, which are small: use a directory with large camera images to get
+meaningful results.
+
+The ``vips`` variants use the libvips backend (``img_backend = "vips"``), they
+are skipped if pyvips is not installed.
+
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from importlib.util import find_spec
+
+from sigal.image import get_img_backend
+from sigal.settings import create_settings, get_img_profile
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.normpath(
+    os.path.join(CURRENT_DIR, "..", "tests", "sample", "pictures")
+)
+
+#: Settings for each variant, compared with the default settings.
+VARIANTS = {
+    "default": {},
+    "jpg_draft=2": {"jpg_draft": 2},
+    "jpg_draft=1": {"jpg_draft": 1},
+    "profile=best": {"img_profile": "best"},
+    "profile=balanced": {"img_profile": "balanced"},
+    "profile=fast": {"img_profile": "fast"},
+    "backend=vips": {"img_backend": "vips"},
+    "vips,profile=fast": {"img_backend": "vips", "img_profile": "fast"},
+}
+
+
+def list_images(source, extensions):
+    for path, dirs, files in os.walk(source):
+        # skip hidden directories
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for f in sorted(files):
+            if os.path.splitext(f)[1].lower() in extensions:
+                yield os.path.join(path, f)
+
+
+def run(files, settings, queue):
+    backend = get_img_backend(settings)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        start = time.perf_counter()
+        for i, src in enumerate(files):
+            dst = os.path.join(tmpdir, f"{i}{os.path.splitext(src)[1]}")
+            try:
+                backend.generate_image(
+                    src, dst, settings, options=settings["jpg_options"]
+                )
+                backend.generate_thumbnail(
+                    src,
+                    os.path.join(tmpdir, f"{i}.tn.jpg"),
+                    settings["thumb_size"],
+                    fit=settings["thumb_fit"],
+                    profile=get_img_profile(settings),
+                )
+            except Exception as e:
+                print(f"Skipping {src}: {e}", file=sys.stderr)
+        elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        maxrss //= 1024
+    queue.put((elapsed, maxrss / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", nargs="?", default=SAMPLE_DIR)
+    parser.add_argument("--img-size", nargs=2, type=int, default=(1600, 1067))
+    parser.add_argument("--thumb-size", nargs=2, type=int, default=(280, 210))
+    parser.add_argument("--variant", action="append", choices=list(VARIANTS))
+    args = parser.parse_args()
+
+    settings = create_settings(
+        img_size=tuple(args.img_size), thumb_size=tuple(args.thumb_size)
+    )
+    files = list(list_images(args.source, settings["img_extensions"]))
+    # GIF files are copied
+    files = [f for f in files if not f.endswith(".gif")]
+    print(f"{len(files)} images from {args.source}\n")
+    print(f"{'variant':<20s} {'time (s)':>10s} {'max RSS (MB)':>14s}")
+
+    ctx = multiprocessing.get_context("spawn")
+    for name in args.variant or VARIANTS:
+        if VARIANTS[name].get("img_backend") == "vips" and not find_spec("pyvips"):
+            print(f"{name:<20s} skipped, pyvips is not installed")
+            continue
+        queue = ctx.Queue()
+        proc = ctx.Process(
+            target=run, args=(files, {**settings, **VARIANTS[name]}, queue)
+        )
+        proc.start()
+        elapsed, maxrss = queue.get()
+        proc.join()
+        print(f"{name:<20s} {elapsed:>10.2f} {maxrss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
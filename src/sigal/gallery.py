@@ -24,18 +24,24 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import bisect
 import fnmatch
 import io
 import logging
 import multiprocessing
 import os
 import pickle
+import queue
 import random
 import sys
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from functools import cached_property
+from functools import cached_property, partial
 from itertools import cycle
+from multiprocessing.util import Finalize
+from operator import attrgetter
 from os.path import isfile, join, splitext
 from shutil import get_terminal_size
 from urllib.parse import quote as url_quote
@@ -44,15 +50,27 @@ from click import progressbar
 from natsort import natsort_keygen, ns
 from PIL import Image as PILImage
 
-from . import image, signals, video
+from . import signals, video
 from .image import (
     EXIF_EXTENSIONS,
     get_exif_tags,
-    get_image_metadata,
-    get_size,
+    get_img_backend,
+    is_animated,
     process_image,
 )
-from .settings import IMG_EXTENSIONS, Status, get_thumb
+from .settings import (
+    _DEFAULT_CONFIG,
+    IMG_EXTENSIONS,
+    IMG_PROFILES,
+    Status,
+    get_hls,
+    get_img_profile,
+    get_poster,
+    get_rendition,
+    get_thumb,
+    get_tiles,
+    get_variant,
+)
 from .utils import (
     Devnull,
     check_or_create_dir,
@@ -61,10 +79,11 @@ from .utils import (
     get_mod_date,
     is_valid_html5_video,
     read_markdown,
+    resource_cache,
     should_reprocess_album,
     url_from_path,
 )
-from .video import process_video
+from .video import probe_video, process_video
 from .writer import AlbumListPageWriter, AlbumPageWriter
 
 
@@ -84,6 +103,10 @@ class Media:
     type = ""
     """Type of media, e.g. ``"image"`` or ``"video"``."""
 
+    animated = False
+    """True for an animated GIF converted with ``animated_gif_format``, which
+    themes can play in a loop."""
+
     def __init__(self, filename, path, settings):
         self.path = path
         self.settings = settings
@@ -103,9 +126,16 @@ class Media:
 
         self.thumb_name = get_thumb(self.settings, self.dst_filename)
 
+        self.build_info = {}
+        """Data computed when the media is processed (e.g. the placeholder),
+        which is stored in the build manifest."""
+
         self.logger = logging.getLogger(__name__)
 
-        signals.media_initialized.send(self)
+        # Sending a signal has a cost even without receivers, which adds up
+        # for large galleries, so skip it when no plugin is connected.
+        if signals.media_initialized.receivers:
+            signals.media_initialized.send(self)
 
     def __repr__(self):
         return f"<{self.__class__.__name__}>({str(self)!r})"
@@ -132,6 +162,30 @@ class Media:
     def thumb_path(self):
         return join(self.settings["destination"], self.path, self.thumb_name)
 
+    @property
+    def output_paths(self):
+        """Paths of the existing files created when the media is processed:
+        the resized media and its renditions, the thumbnails, and their
+        variants in other formats."""
+        s = self.settings
+        names = [self.dst_filename, self.thumb_name]
+        if self.type == "image":
+            names += [
+                get_rendition(s, self.dst_filename, size)
+                for size in s["img_renditions"]
+            ]
+        names += [
+            get_thumb(s, self.dst_filename, density) for density in s["thumb_densities"]
+        ]
+        if self.type == "video":
+            names.append(get_poster(s, self.dst_filename))
+        if self.type == "image":
+            names += [
+                get_variant(name, fmt) for name in names for fmt in s["img_variants"]
+            ]
+        paths = [join(s["destination"], self.path, name) for name in names]
+        return [path for path in paths if isfile(path)]
+
     @property
     def url(self):
         """URL of the media."""
@@ -176,8 +230,12 @@ class Media:
                 # if thumbnail is missing (if settings['make_thumbs'] is False)
                 s = self.settings
                 if self.type == "image":
-                    image.generate_thumbnail(
-                        path, self.thumb_path, s["thumb_size"], fit=s["thumb_fit"]
+                    get_img_backend(s).generate_thumbnail(
+                        path,
+                        self.thumb_path,
+                        s["thumb_size"],
+                        fit=s["thumb_fit"],
+                        profile=get_img_profile(s),
                     )
                 elif self.type == "video":
                     video.generate_thumbnail(
@@ -196,6 +254,145 @@ class Media:
                 return
         return url_from_path(self.thumb_name)
 
+    @property
+    def srcset(self):
+        """Value of the ``srcset`` attribute for the renditions of the resized
+        image (empty if there are no renditions)."""
+        if len(self.renditions) < 2:
+            return ""
+        return ", ".join(f"{r['url']} {r['width']}w" for r in self.renditions)
+
+    @cached_property
+    def renditions(self):
+        """List of the sizes available for the resized image."""
+        return []
+
+    @cached_property
+    def variants(self):
+        """List of the other formats of the resized image."""
+        return []
+
+    @property
+    def tiles(self):
+        """DeepZoom tiles created with ``img_tiles`` for the large images, as a
+        dict with the ``url`` of the ``.dzi`` file and the ``width`` and
+        ``height`` of the full image, or None. This can be used by themes with
+        a tile viewer like OpenSeadragon."""
+        size = self.build_info.get("tiles")
+        if not size:
+            return None
+        name = get_tiles(self.settings, self.dst_filename)
+        return {"url": url_from_path(name), **size}
+
+    @property
+    def hls(self):
+        """HLS renditions created with ``video_hls`` for the videos, as a
+        dict with the ``url`` of the master playlist and the names of the
+        ``renditions``, or None. The converted video can be used as a fallback
+        for the browsers which do not support HLS."""
+        renditions = self.build_info.get("hls")
+        if not renditions:
+            return None
+        name = get_hls(self.settings, self.dst_filename)
+        return {"url": url_from_path(name), "renditions": renditions}
+
+    @property
+    def placeholder(self):
+        """Placeholder computed with the ``img_placeholder`` setting: a color,
+        an image as a data URI, or a BlurHash string."""
+        return self.build_info.get("placeholder")
+
+    @property
+    def placeholder_style(self):
+        """CSS style to display the placeholder as the background of the
+        thumbnail (empty for BlurHash, which must be decoded in JavaScript)."""
+        placeholder = self.placeholder
+        if not placeholder:
+            return ""
+        if placeholder.startswith("#"):
+            return f"background-color: {placeholder}"
+        if placeholder.startswith("data:"):
+            return f"background: url({placeholder}) center / cover"
+        return ""
+
+    @cached_property
+    def thumb_size(self):
+        """The dimensions of the thumbnail image."""
+        return get_img_backend(self.settings).get_size(self.thumb_path)
+
+    @cached_property
+    def thumb_srcset(self):
+        """Value of the ``srcset`` attribute for the thumbnail with the HiDPI
+        thumbnails set with ``thumb_densities`` (empty if there are none)."""
+        return self._thumb_srcset()
+
+    @cached_property
+    def thumb_variants(self):
+        """List of the other formats of the thumbnail, set with
+        ``img_variants``, as dicts with the ``format``, the MIME ``type``, the
+        ``url``, and the ``srcset`` with the HiDPI thumbnails."""
+        variants = []
+        if self.type != "image":
+            return variants
+        for fmt in self.settings["img_variants"]:
+            name = get_variant(self.thumb_name, fmt)
+            if self._output_exists(name):
+                url = url_from_path(name)
+                variants.append(
+                    {
+                        "format": fmt.upper(),
+                        "type": PILImage.MIME[fmt.upper()],
+                        "url": url,
+                        "srcset": self._thumb_srcset(fmt) or url,
+                    }
+                )
+        return variants
+
+    def _output_exists(self, name):
+        return isfile(join(self.settings["destination"], self.path, name))
+
+    def _thumb_srcset(self, fmt=None):
+        thumbs = [(1, self.thumb_name)] + [
+            (density, get_thumb(self.settings, self.dst_filename, density))
+            for density in sorted(self.settings["thumb_densities"])
+        ]
+        if fmt:
+            thumbs = [(density, get_variant(name, fmt)) for density, name in thumbs]
+        srcset = [
+            f"{url_from_path(name)} {density}x"
+            for density, name in thumbs
+            if density == 1 or self._output_exists(name)
+        ]
+        return ", ".join(srcset) if len(srcset) > 1 else ""
+
+    @property
+    def cost(self):
+        """Estimation of the processing time, relative to the processing of
+        an image, used to process the longest medias first."""
+        return 1
+
+    @property
+    def memory(self):
+        """Estimation of the memory used by a worker to process the media, in
+        bytes, used with ``memory_budget``. The medias which are not decoded
+        by the workers, like the videos converted by ffmpeg, are not
+        counted."""
+        return 0
+
+    @property
+    def fingerprint(self):
+        """Settings used to process the media. If they change, the media is
+        processed again even if the output file exists."""
+        return {}
+
+    @property
+    def default_fingerprint(self):
+        """True if the media is processed with the default settings of the
+        fingerprint."""
+        return all(
+            _DEFAULT_CONFIG.get(key) == value for key, value in self.fingerprint.items()
+        )
+
     @cached_property
     def description(self):
         """Description extracted from the Markdown <imagename>.md file."""
@@ -237,6 +434,10 @@ class Media:
         return datetime.fromtimestamp(get_mod_date(self.src_path))
 
 
+# Memory used to process an image, in bytes per pixel of the source image
+IMAGE_MEMORY_PER_PIXEL = 8
+
+
 class Image(Media):
     """Gather all informations on an image file."""
 
@@ -251,6 +452,42 @@ class Image(Media):
             ext = IMG_EXTENSIONS.format2ext[imgformat.upper()]
             self.dst_filename = self.basename + ext
 
+        if (
+            self.src_ext == ".gif"
+            and settings["animated_gif_format"] == "webp"
+            and not settings["use_orig"]
+            and is_animated(self.src_path)
+        ):
+            self.animated = True
+            self.dst_filename = self.basename + ".webp"
+
+    @property
+    def memory(self):
+        """Estimation from the size of the image, read in the header of the
+        file: the decoded image and the resized copies, with up to 4 bytes
+        per pixel."""
+        size = self.file_metadata["size"]
+        if not size:
+            return 0
+        return size["width"] * size["height"] * IMAGE_MEMORY_PER_PIXEL
+
+    @property
+    def fingerprint(self):
+        fingerprint = {"img_profile": self.settings["img_profile"]}
+        # only when set, to not process again the images of older builds
+        for key in (
+            "img_placeholder",
+            "img_quality_search",
+            "img_renditions",
+            "img_tiles",
+            "img_variants",
+            "thumb_densities",
+            "thumb_exif_preview",
+        ):
+            if self.settings[key]:
+                fingerprint[key] = self.settings[key]
+        return fingerprint
+
     @cached_property
     def date(self):
         """The date from the EXIF DateTimeOriginal metadata if available, or
@@ -272,7 +509,7 @@ class Image(Media):
     @cached_property
     def file_metadata(self):
         """Image file metadata (Exif and IPTC)"""
-        return get_image_metadata(self.src_path)
+        return get_img_backend(self.settings).get_image_metadata(self.src_path)
 
     def _get_markdown_metadata(self):
         """Get metadata from filename.md."""
@@ -296,17 +533,57 @@ class Image(Media):
     @cached_property
     def size(self):
         """The dimensions of the resized image."""
-        return get_size(self.dst_path)
+        return get_img_backend(self.settings).get_size(self.dst_path)
 
     @cached_property
-    def input_size(self):
-        """The dimensions of the input image."""
-        return get_size(self.src_path)
+    def renditions(self):
+        """List of the sizes available for the resized image, from the
+        smallest to the largest: the resized image and its renditions set with
+        ``img_renditions``, as dicts with the ``name`` (path relative to the
+        album directory), ``url``, ``width`` and ``height`` of each file."""
+        backend = get_img_backend(self.settings)
+        renditions = []
+        if self.size:
+            renditions.append({"name": self.dst_filename, "url": self.url, **self.size})
+        for size in self.settings["img_renditions"]:
+            name = get_rendition(self.settings, self.dst_filename, size)
+            path = join(self.settings["destination"], self.path, name)
+            if isfile(path) and (size := backend.get_size(path)):
+                renditions.append({"name": name, "url": url_from_path(name), **size})
+        return sorted(renditions, key=lambda r: r["width"])
 
     @cached_property
-    def thumb_size(self):
-        """The dimensions of the thumbnail image."""
-        return get_size(self.thumb_path)
+    def variants(self):
+        """List of the other formats of the resized image, set with
+        ``img_variants``, as dicts with the ``format``, the MIME ``type``, the
+        ``url``, and the ``srcset`` with the renditions."""
+        variants = []
+        for fmt in self.settings["img_variants"]:
+            name = get_variant(self.dst_filename, fmt)
+            if not self._output_exists(name):
+                continue
+            renditions = [
+                (url_from_path(get_variant(r["name"], fmt)), r["width"])
+                for r in self.renditions
+                if self._output_exists(get_variant(r["name"], fmt))
+            ]
+            url = url_from_path(name)
+            variants.append(
+                {
+                    "format": fmt.upper(),
+                    "type": PILImage.MIME[fmt.upper()],
+                    "url": url,
+                    "srcset": ", ".join(f"{u} {w}w" for u, w in renditions)
+                    if len(renditions) > 1
+                    else url,
+                }
+            )
+        return variants
+
+    @cached_property
+    def input_size(self):
+        """The dimensions of the input image."""
+        return get_img_backend(self.settings).get_size(self.src_path)
 
     def has_location(self):
         """True if location information is available for EXIF GPSInfo."""
@@ -322,8 +599,7 @@ class Video(Media):
         super().__init__(filename, path, settings)
 
         if not settings["use_orig"] or not is_valid_html5_video(self.src_ext):
-            video_format = settings["video_format"]
-            ext = "." + video_format
+            ext = "." + self.video_format
             self.dst_filename = self.basename + ext
             self.mime = get_mime(ext)
         else:
@@ -331,7 +607,8 @@ class Video(Media):
 
     @cached_property
     def date(self):
-        """The date from the Date metadata if available, or from the file date."""
+        """The date from the Date metadata if available, or from
+        the creation time of the video, or from the file date."""
         if "date" in self.meta:
             try:
                 self.logger.debug(
@@ -342,9 +619,99 @@ class Video(Media):
                 self.logger.debug(
                     "Reading date from image metadata failed : %s", self.src_filename
                 )
+        creation_time = self.file_metadata.get("creation_time")
+        if creation_time:
+            try:
+                date = datetime.fromisoformat(creation_time)
+            except ValueError:
+                self.logger.debug(
+                    "Invalid creation time %r : %s", creation_time, self.src_filename
+                )
+            else:
+                # the creation time is in UTC, convert it to the local time
+                # like the other dates
+                if date.tzinfo is not None:
+                    date = date.astimezone().replace(tzinfo=None)
+                return date
         # If no date is found in the metadata, return the file date.
         return self._get_file_date()
 
+    @property
+    def fingerprint(self):
+        fingerprint = {}
+        for key in ("video_hls", "video_poster"):
+            if self.settings[key] and not self.animated:
+                fingerprint[key] = self.settings[key]
+        return fingerprint
+
+    @property
+    def poster_path(self):
+        return join(
+            self.settings["destination"],
+            self.path,
+            get_poster(self.settings, self.dst_filename),
+        )
+
+    @property
+    def poster(self):
+        """Full size image of the frame used for the thumbnail, created with
+        ``video_poster``, as a dict with the ``url``, ``width`` and ``height``
+        of the image, or None. This can be used for the ``poster`` attribute
+        of the ``<video>`` element."""
+        size = self.build_info.get("poster")
+        if not size:
+            return None
+        name = get_poster(self.settings, self.dst_filename)
+        return {"url": url_from_path(name), **size}
+
+    @cached_property
+    def file_metadata(self):
+        """The information read with ffprobe, see
+        :func:`sigal.video.probe_video`."""
+        return probe_video(
+            self.src_path,
+            converter=self.settings["video_converter"],
+            prober=self.settings["video_prober"],
+        )
+
+    @property
+    def duration(self):
+        """Duration of the video in seconds, or None if it is unknown."""
+        return self.file_metadata.get("duration")
+
+    @property
+    def cost(self):
+        """The processing time of a video depends on its duration, and is
+        shared by several processes for the long videos with
+        ``video_chunks``."""
+        duration = self.duration or 1
+        chunks = self.settings["video_chunks"]
+        if chunks:
+            chunks = {**video.CHUNKS_DEFAULTS, **chunks}
+            if duration >= chunks["min_duration"]:
+                duration /= video.get_chunks_jobs(chunks)
+        return max(duration, 1)
+
+    @property
+    def video_format(self):
+        """Format of the converted video."""
+        return self.settings["video_format"]
+
+
+class AnimatedGif(Video):
+    """An animated GIF converted to a video, with the ``animated_gif_format``
+    setting. Static GIFs are still handled as images."""
+
+    animated = True
+
+    def __init__(self, filename, path, settings):
+        super().__init__(filename, path, settings)
+        self.thumb_name = get_thumb(self.settings, self.dst_filename)
+
+    @property
+    def video_format(self):
+        return self.settings["animated_gif_format"]
+
 
 class Album:
     """Gather all informations on an album.
@@ -383,6 +750,14 @@ class Album:
 
         self.logger = logging.getLogger(__name__)
 
+        # The image processing profile can be set for an album in index.md
+        profile = self.meta.get("profile", [None])[0]
+        if profile and profile != settings["img_profile"]:
+            if profile in IMG_PROFILES:
+                self.settings = settings = {**settings, "img_profile": profile}
+            else:
+                self.logger.error("Unknown profile %r for %r", profile, self.path)
+
         # optionally add index.html to the URLs
         self.url_ext = self.output_file if settings["index_in_url"] else ""
 
@@ -397,25 +772,50 @@ class Album:
         self.medias = medias = []
         self.medias_count = defaultdict(int)
 
+        send_album_file = bool(signals.album_file.receivers)
+        files = {}
+
         for f in filenames:
             ext = splitext(f)[1]
             media = None
-            if ext.lower() in settings["img_extensions"]:
+            if (
+                ext.lower() == ".gif"
+                and settings["animated_gif_format"] in ("mp4", "webm")
+                and is_animated(join(settings["source"], self.path, f))
+            ):
+                media = AnimatedGif(f, self.path, settings)
+            elif ext.lower() in settings["img_extensions"]:
                 media = Image(f, self.path, settings)
             elif ext.lower() in settings["video_extensions"]:
                 media = Video(f, self.path, settings)
 
             # Allow modification of the media, including overriding the class
             # type for the media.
-            result = signals.album_file.send(self, filename=f, media=media)
+            if send_album_file:
+                result = signals.album_file.send(self, filename=f, media=media)
+                for recv, ret in result:
+                    if ret is not None:
+                        media = ret
+
+            files[f] = media
+
+        # Batched variant of album_file, called once with all the files of
+        # the directory. Receivers can return a dict {filename: media} to
+        # replace some of the medias.
+        if signals.album_files.receivers:
+            result = signals.album_files.send(self, files=files)
             for recv, ret in result:
-                if ret is not None:
-                    media = ret
+                if ret:
+                    files.update(ret)
 
+        for media in files.values():
             if media:
                 self.medias_count[media.type] += 1
                 medias.append(media)
 
+        if medias and signals.media_initialized_batch.receivers:
+            signals.media_initialized_batch.send(self, medias=medias)
+
         signals.album_initialized.send(self)
 
     def __repr__(self):
@@ -476,6 +876,9 @@ class Album:
         if self.medias:
             check_or_create_dir(join(self.dst_path, self.settings["thumb_dir"]))
 
+        if self.medias and self.settings["img_renditions"]:
+            check_or_create_dir(join(self.dst_path, self.settings["renditions_dir"]))
+
         if self.medias and self.settings["keep_orig"]:
             self.orig_path = join(self.dst_path, self.settings["orig_dir"])
             check_or_create_dir(self.orig_path)
@@ -817,11 +1220,16 @@ class Gallery:
                 ncpu = cpu_count
 
         self.logger.info("Using %s cores", ncpu)
+        self.ncpu = ncpu
+        # the CPUs are shared by the workers for the segments of the videos
+        video.processes = ncpu
         if ncpu > 1:
+            # progress of the videos sent by the workers
+            self.progress_queue = multiprocessing.Queue()
             self.pool = multiprocessing.Pool(
                 processes=ncpu,
                 initializer=pool_init,
-                initargs=(self.settings["max_img_pixels"],),
+                initargs=(self.settings, self.progress_queue, ncpu),
             )
         else:
             self.pool = None
@@ -850,6 +1258,8 @@ class Gallery:
             else:
                 return ""
 
+        self.load_manifest()
+
         try:
             with progressbar(
                 self.albums.values(),
@@ -864,36 +1274,111 @@ class Gallery:
         except KeyboardInterrupt:
             sys.exit("Interrupted")
 
+        def show_video_progress(item):
+            # only the progress of the videos is shown, not the medias
+            return item if isinstance(item, str) else None
+
         bar_opt = {
             "label": "Processing files",
             "show_pos": True,
+            "item_show_func": show_video_progress,
             "file": self.progressbar_target,
         }
 
-        if self.pool:
-            result = []
-            try:
-                with progressbar(length=len(media_list), **bar_opt) as bar:
-                    for status in self.pool.imap_unordered(worker, media_list):
-                        result.append(status)
-                        bar.update(1)
-            except KeyboardInterrupt:
-                self.pool.terminate()
-                sys.exit("Interrupted")
-            except pickle.PicklingError:
-                self.logger.critical(
-                    "Failed to process files with the multiprocessing feature."
-                    " This can be caused by some module import or object "
-                    "defined in the settings file, which can't be serialized.",
-                    exc_info=True,
-                )
-                sys.exit("Abort")
-            finally:
-                self.pool.close()
-                self.pool.join()
-        else:
-            with progressbar(media_list, **bar_opt) as medias:
-                result = [process_file(media_item) for media_item in medias]
+        videos = []
+        if self.settings["video_jobs"]:
+            # the videos are processed by threads of the main process, while
+            # the pool processes the other medias
+            videos = [media for media in media_list if media.type == "video"]
+            media_list = [media for media in media_list if media.type != "video"]
+
+        main_worker = not self.pool or videos
+        if main_worker:
+            signals.worker_initialized.send(self.settings)
+        video_processor = None
+        try:
+            if videos:
+                video_processor = VideoProcessor(videos, self.settings["video_jobs"])
+            if self.pool:
+                # the longest medias are processed first, so that they do not
+                # finish alone at the end of the build
+                media_list.sort(key=attrgetter("cost"), reverse=True)
+                result = []
+                try:
+                    with progressbar(length=len(media_list), **bar_opt) as bar:
+                        handler = progress_handler(bar)
+
+                        def monitor_progress():
+                            for name, percent in iter(self.progress_queue.get, None):
+                                handler(name, percent)
+
+                        monitor = threading.Thread(target=monitor_progress, daemon=True)
+                        monitor.start()
+                        try:
+                            if self.settings["memory_budget"]:
+                                scheduler = MemoryScheduler(
+                                    self.pool,
+                                    self.ncpu,
+                                    self.settings["memory_budget"] * 2**20,
+                                )
+                                results = scheduler.imap(worker, media_list)
+                            else:
+                                results = zip(
+                                    media_list, self.pool.imap(worker, media_list)
+                                )
+                            # the medias are kept in the order of the results
+                            processed = []
+                            for media, (status, build_info) in results:
+                                media.build_info = build_info
+                                processed.append(media)
+                                result.append(status)
+                                bar.update(1)
+                            media_list = processed
+                        finally:
+                            self.progress_queue.put(None)
+                            monitor.join()
+                except KeyboardInterrupt:
+                    self.pool.terminate()
+                    sys.exit("Interrupted")
+                except pickle.PicklingError:
+                    self.logger.critical(
+                        "Failed to process files with the multiprocessing feature."
+                        " This can be caused by some module import or object "
+                        "defined in the settings file, which can't be serialized.",
+                        exc_info=True,
+                    )
+                    sys.exit("Abort")
+                finally:
+                    self.pool.close()
+                    self.pool.join()
+            else:
+                # Without pool, the main process is the worker
+                try:
+                    with progressbar(media_list, **bar_opt) as medias:
+                        video.progress_handler = progress_handler(medias)
+                        result = [process_file(media_item) for media_item in medias]
+                finally:
+                    video.progress_handler = None
+
+            if video_processor:
+                result += video_processor.wait(bar_opt)
+                media_list += videos
+        finally:
+            if video_processor:
+                video_processor.close()
+            if main_worker:
+                worker_shutdown(self.settings)
+
+        for status, media in zip(result, media_list):
+            key = join(media.path, media.dst_filename)
+            if status == 0:
+                self.manifest[key] = {
+                    "fingerprint": media.fingerprint,
+                    "build_info": media.build_info,
+                }
+            else:
+                self.manifest.pop(key, None)
+        self.save_manifest()
 
         if any(result):
             failed_files = [
@@ -938,22 +1423,215 @@ class Gallery:
             " debug (--debug) mode to get more details."
         )
 
+    @property
+    def manifest_path(self):
+        return join(self.settings["destination"], ".build_manifest")
+
+    def load_manifest(self):
+        """Load the build manifest, which stores the fingerprint of the
+        processed medias."""
+        self.manifest = {}
+        try:
+            with open(self.manifest_path, "rb") as f:
+                self.manifest = pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.warning("Could not load the build manifest: %s", e)
+
+    def save_manifest(self):
+        try:
+            with open(self.manifest_path, "wb") as f:
+                pickle.dump(self.manifest, f)
+        except Exception as e:
+            self.logger.warning("Could not save the build manifest: %s", e)
+
     def process_dir(self, album, force=False):
         """Process a list of images in a directory."""
         for f in album:
+            entry = self.manifest.get(join(f.path, f.dst_filename))
             if isfile(f.dst_path) and not should_reprocess_album(
                 album.path, album.name, force
             ):
-                self.logger.info("%s exists - skipping", f.dst_filename)
-                self.stats[f.type + "_skipped"] += 1
-            else:
-                self.stats[f.type] += 1
-                yield f
+                # without an entry (e.g. built before the manifest), the
+                # media was processed with the default settings
+                fingerprint = entry["fingerprint"] if entry else None
+                if fingerprint == f.fingerprint or (
+                    entry is None and f.default_fingerprint
+                ):
+                    self.logger.info("%s exists - skipping", f.dst_filename)
+                    self.stats[f.type + "_skipped"] += 1
+                    if entry is None:
+                        self.manifest[join(f.path, f.dst_filename)] = {
+                            "fingerprint": f.fingerprint,
+                            "build_info": f.build_info,
+                        }
+                    else:
+                        f.build_info = entry.get("build_info", {})
+                    continue
+                self.logger.info(
+                    "%s processing settings changed - reprocessing", f.dst_filename
+                )
+
+            if entry is not None and "quality_search" in entry.get("build_info", {}):
+                # the qualities found with img_quality_search are reused if the
+                # source image did not change
+                f.build_info["quality_search"] = entry["build_info"]["quality_search"]
+
+            self.stats[f.type] += 1
+            yield f
+
+
+class MemoryScheduler:
+    """Submit the medias to the process pool while the memory needed to
+    process them, estimated with :attr:`Media.memory`, stays within a budget.
+
+    The medias which do not use memory in the workers, like the videos, are
+    submitted first, the longest ones first. For the other medias, when a
+    media is finished, the largest pending media which fits in the remaining
+    memory is submitted, so the small images keep the workers busy while a
+    large one waits for the memory. A media larger than the budget is
+    processed alone.
+    """
+
+    def __init__(self, pool, processes, budget):
+        self.pool = pool
+        self.processes = processes
+        self.budget = budget
+
+    def imap(self, func, medias):
+        """Process the medias with ``func``, and yield each media with its
+        result, in the order in which they are finished."""
+        logger = logging.getLogger(__name__)
+        # the memory is read from the header of the images, in the main
+        # process, before the processing
+        pending = sorted(
+            (media for media in medias if media.memory),
+            key=attrgetter("memory", "cost"),
+        )
+        # the last one is the longest
+        no_memory = sorted(
+            (media for media in medias if not media.memory), key=attrgetter("cost")
+        )
+        finished = queue.SimpleQueue()
+        running = {}
+        used = 0
+
+        while pending or no_memory or running:
+            while (pending or no_memory) and len(running) < self.processes:
+                if no_memory:
+                    media = no_memory.pop()
+                else:
+                    free = self.budget - used
+                    index = bisect.bisect_right(pending, free, key=attrgetter("memory"))
+                    if index == 0:
+                        if used:
+                            break
+                        # no other image is processed, the media is processed
+                        # alone
+                        logger.info(
+                            "%s needs more than the memory budget (%d MB)",
+                            pending[0].src_filename,
+                            pending[0].memory // 2**20,
+                        )
+                        index = 1
+                    media = pending.pop(index - 1)
+                running[id(media)] = media
+                used += media.memory
+                self.pool.apply_async(
+                    func,
+                    (media,),
+                    callback=partial(self._put, finished, media),
+                    error_callback=partial(self._put_error, finished, media),
+                )
+
+            media, result, error = finished.get()
+            del running[id(media)]
+            used -= media.memory
+            if error is not None:
+                raise error
+            yield media, result
+
+    @staticmethod
+    def _put(finished, media, result):
+        finished.put((media, result, None))
+
+    @staticmethod
+    def _put_error(finished, media, error):
+        finished.put((media, None, error))
+
+
+class VideoProcessor:
+    """Process the videos with threads of the main process.
+
+    The ffmpeg processes are run with asyncio, with at most ``max_jobs``
+    processes at the same time, so the videos, which mostly wait for ffmpeg,
+    do not use the workers of the process pool. The steps of the videos
+    (probe, thumbnail and conversion) can run at the same time.
+    """
+
+    def __init__(self, videos, max_jobs):
+        self.runner = video.runner = video.SubprocessRunner(max_jobs)
+        # more threads than ffmpeg processes, so that the Python steps of the
+        # processing do not leave the ffmpeg slots unused
+        self.executor = ThreadPoolExecutor(2 * max_jobs)
+        self.futures = [self.executor.submit(process_file, media) for media in videos]
+
+    def wait(self, bar_opt):
+        """Wait for the videos, and return their status."""
+        bar_opt = {**bar_opt, "label": "Processing videos"}
+        try:
+            with progressbar(length=len(self.futures), **bar_opt) as bar:
+                video.progress_handler = progress_handler(bar)
+                for _ in as_completed(self.futures):
+                    bar.update(1)
+        except KeyboardInterrupt:
+            sys.exit("Interrupted")
+        return [future.result() for future in self.futures]
+
+    def close(self):
+        """Stop the processing, and kill the running ffmpeg processes."""
+        for future in self.futures:
+            future.cancel()
+        # the threads are finished before the event loop is stopped, as the
+        # subprocesses which they run are cancelled
+        self.runner.cancel()
+        self.executor.shutdown()
+        self.runner.close()
+        video.runner = None
+        video.progress_handler = None
+
+
+def progress_handler(bar):
+    """Return a function which shows the progress of a video in the progress
+    bar."""
+
+    def handler(name, percent):
+        bar.current_item = f"{name} {percent}%"
+        bar.render_progress()
+
+    return handler
+
+
+def pool_init(settings, progress_queue=None, processes=1):
+    if settings["max_img_pixels"]:
+        PILImage.MAX_IMAGE_PIXELS = settings["max_img_pixels"]
+
+    video.processes = processes
+
+    if progress_queue is not None:
+        video.progress_handler = lambda name, percent: progress_queue.put(
+            (name, percent)
+        )
+
+    signals.worker_initialized.send(settings)
+    # Finalizers are called by multiprocessing when the worker exits
+    Finalize(None, worker_shutdown, args=(settings,), exitpriority=10)
 
 
-def pool_init(max_img_pixels):
-    if max_img_pixels:
-        PILImage.MAX_IMAGE_PIXELS = max_img_pixels
+def worker_shutdown(settings):
+    signals.worker_shutdown.send(settings)
+    resource_cache.clear()
 
 
 def process_file(media):
@@ -964,10 +1642,11 @@ def process_file(media):
         processor = process_video
 
     # Allow overriding of the processor
-    result = signals.process_file.send(media, processor=processor)
-    for recv, ret in result:
-        if ret is not None:
-            processor = ret
+    if signals.process_file.receivers:
+        result = signals.process_file.send(media, processor=processor)
+        for recv, ret in result:
+            if ret is not None:
+                processor = ret
 
     if processor:
         return processor(media)
@@ -976,8 +1655,11 @@ def process_file(media):
         return Status.FAILURE
 
 
-def worker(args):
+def worker(media):
     try:
-        return process_file(args)
+        status = process_file(media)
     except KeyboardInterrupt:
-        pass
+        status = Status.FAILURE
+    # the media is a copy in the worker process, so the data computed during
+    # the processing is sent back with the status
+    return status, media.build_info
@@ -29,20 +29,34 @@
 #
 # and partially modified. The code in question is licensed under MIT license.
 
+import base64
+import importlib
+import io
+import json
 import logging
+import math
 import os
+import shutil
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
 from datetime import datetime
 
 import pilkit.processors
 from PIL import Image as PILImage
-from PIL import ImageFile, ImageOps, IptcImagePlugin
-from PIL.ExifTags import GPSTAGS, TAGS
+from PIL import ImageFile, ImageOps, ImageSequence, IptcImagePlugin
+from PIL.ExifTags import GPSTAGS, IFD, TAGS
 from PIL.TiffImagePlugin import IFDRational
 from pilkit.processors import Transpose
-from pilkit.utils import save_image
+from pilkit.utils import prepare_image, save_image
+
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
 
 try:
     from pillow_heif import HeifImagePlugin  # noqa: F401
@@ -52,7 +66,16 @@ except ImportError:
     HAS_HEIF = False
 
 from . import signals, utils
-from .settings import Status
+from .settings import (
+    IMG_EXTENSIONS,
+    Status,
+    get_img_profile,
+    get_img_variants,
+    get_rendition,
+    get_thumb,
+    get_tiles,
+    get_variant,
+)
 
 # Force loading of truncated files
 ImageFile.LOAD_TRUNCATED_IMAGES = True
@@ -81,26 +104,301 @@ def _read_image(file_path):
     return im
 
 
-def generate_image(source, outname, settings, options=None):
+def _exif_orientation(img):
+    """Return the EXIF orientation of the image, 1 if it is not set."""
+    try:
+        return img.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+
+def _oriented_size(img):
+    """Return the size of the image once rotated with its EXIF orientation."""
+    if _exif_orientation(img) in (5, 6, 7, 8):
+        return img.size[1], img.size[0]
+    return img.size
+
+
+# transposition which rotates an image with its EXIF orientation
+ORIENTATION_TRANSPOSE = {
+    2: PILImage.Transpose.FLIP_LEFT_RIGHT,
+    3: PILImage.Transpose.ROTATE_180,
+    4: PILImage.Transpose.FLIP_TOP_BOTTOM,
+    5: PILImage.Transpose.TRANSPOSE,
+    6: PILImage.Transpose.ROTATE_270,
+    7: PILImage.Transpose.TRANSVERSE,
+    8: PILImage.Transpose.ROTATE_90,
+}
+
+
+def _ratio(size, box, cover=False):
+    """Return the scale ratio to fit the image in ``box``, or to cover it."""
+    func = max if cover else min
+    return func(box[0] / size[0], box[1] / size[1])
+
+
+def _draft(img, box, cover=False, gap=2):
+    """Use the JPEG DCT scaling to decode the image at a reduced size.
+
+    The image is decoded at the smallest scale (1/2, 1/4 or 1/8) which is
+    still at least ``gap`` times larger than the size needed to fit in ``box``
+    (or to cover it, if ``cover`` is True). ``box`` is given for the image
+    rotated with its EXIF orientation. This must be called before the image is
+    loaded, and does nothing for other formats than JPEG.
+
+    """
+    if not gap or img.format != "JPEG":
+        return img
+
+    ratio = _ratio(_oriented_size(img), box, cover=cover) * gap
+    if ratio < 0.5:
+        size = (math.ceil(img.size[0] * ratio), math.ceil(img.size[1] * ratio))
+        img.draft(None, size)
+        logging.getLogger(__name__).debug("Draft mode: decoded at %dx%d", *img.size)
+    return img
+
+
+def _reduce(img, box, cover=False, gap=2):
+    """Reduce the image by an integer factor, with a fast box filter, while
+    keeping it at least ``gap`` times larger than the size needed to fit in
+    ``box`` (or to cover it). This is the two-stage reduction done by Pillow
+    with ``reducing_gap``, and it can be used before any resize processor.
+
+    """
+    if not gap or img.mode not in ("L", "LA", "RGB", "RGBA"):
+        return img
+
+    factor = int(1 / (_ratio(img.size, box, cover=cover) * gap))
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+
+def _save_variants(img, outname, outformat, variants, profile, exif=None):
+    """Save the image in the other formats given by ``variants``, a dict of
+    formats and encoder options, next to ``outname``."""
+    logger = logging.getLogger(__name__)
+    for fmt, options in variants.items():
+        if fmt == outformat.upper():
+            continue
+        options = {**profile.get("encoder", {}).get(fmt, {}), **options}
+        if exif:
+            options["exif"] = exif
+        name = get_variant(outname, fmt)
+        logger.debug("Save variant: %s, %dx%d (%s)", name, *img.size, fmt)
+        save_image(img, name, fmt, options=options, autoconvert=True)
+
+
+# formats for which the quality can be searched with img_quality_search
+QUALITY_SEARCH_FORMATS = ("JPEG", "WEBP")
+
+
+def _luma_blocks(img, size=256):
+    """Return the luminance of a copy of the image downscaled to ``size``
+    pixels, as an array of 8x8 pixels blocks."""
+    img = img.convert("L")
+    img.thumbnail((size, size), PILImage.Resampling.BOX)
+    arr = np.asarray(img, dtype=np.float64)
+    h, w = arr.shape[0] // 8 * 8, arr.shape[1] // 8 * 8
+    return arr[:h, :w].reshape(h // 8, 8, w // 8, 8)
+
+
+def similarity(reference, img):
+    """Structural similarity (SSIM) of two images of the same size, computed
+    on their luminance, by blocks of 8x8 pixels of downscaled copies. Return
+    a value between 0 and 1 for identical images."""
+    x, y = _luma_blocks(reference), _luma_blocks(img)
+    if not x.size:
+        return 1.0
+    mx, my = x.mean(axis=(1, 3)), y.mean(axis=(1, 3))
+    vx, vy = x.var(axis=(1, 3)), y.var(axis=(1, 3))
+    cov = (x * y).mean(axis=(1, 3)) - mx * my
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    ssim = ((2 * mx * my + c1) * (2 * cov + c2)) / (
+        (mx**2 + my**2 + c1) * (vx + vy + c2)
+    )
+    return float(ssim.mean())
+
+
+def search_quality(
+    img,
+    outformat,
+    options,
+    target_size=None,
+    min_similarity=None,
+    min_quality=40,
+    max_quality=95,
+):
+    """Search the quality to encode the image, with a binary search between
+    ``min_quality`` and ``max_quality``: the highest quality for which the
+    encoded image is smaller than ``target_size`` bytes, or the lowest quality
+    for which its similarity with the image is at least ``min_similarity``.
+
+    :return: the quality and the encoded image
+    """
+    # the image is converted once for all the trial encodes
+    img, save_kwargs = prepare_image(img, outformat)
+    options = {**save_kwargs, **options}
+    encoded = {}
+
+    def encode(quality):
+        buf = io.BytesIO()
+        save_image(img, buf, outformat, {**options, "quality": quality}, False)
+        encoded[quality] = buf.getvalue()
+        return encoded[quality]
+
+    if target_size is not None:
+        # the quality is decreased until the image fits in the budget
+        fits = lambda quality: len(encode(quality)) <= target_size
+        low, high = min_quality, max_quality
+        best = min_quality
+        while low <= high:
+            quality = (low + high) // 2
+            if fits(quality):
+                best, low = quality, quality + 1
+            else:
+                high = quality - 1
+    else:
+        reference = img.convert("RGB")
+
+        def similar(quality):
+            with PILImage.open(io.BytesIO(encode(quality))) as trial:
+                return similarity(reference, trial) >= min_similarity
+
+        low, high = min_quality, max_quality
+        best = max_quality
+        while low <= high:
+            quality = (low + high) // 2
+            if similar(quality):
+                best, high = quality, quality - 1
+            else:
+                low = quality + 1
+
+    if best not in encoded:
+        encode(best)
+    return best, encoded[best]
+
+
+def _resize_box(size, img_size):
+    """Return the box used to resize an image of the given size in
+    ``img_size``, which is swapped if the image is in portrait mode."""
+    width, height = img_size
+    if size[0] < size[1]:
+        height, width = width, height
+    return width, height
+
+
+def _save_with_quality_search(img, outname, outformat, options, settings, qualities):
+    """Save the image with the quality found by :func:`search_quality` for the
+    ``img_quality_search`` setting, or with the quality from ``qualities`` if
+    it was already found for this format and size."""
+    logger = logging.getLogger(__name__)
+    search = settings["img_quality_search"]
+    key = "{} {}x{}".format(outformat.upper(), *img.size)
+    quality = qualities.get(key)
+    if quality is not None:
+        logger.debug("Use quality %d for %s", quality, outname)
+        save_image(
+            img, outname, outformat, {**options, "quality": quality}, autoconvert=True
+        )
+        return
+
+    target_size = search.get("target_size")
+    if target_size is not None:
+        # the budget is given for an image of img_size, and scaled with the
+        # number of pixels for the other sizes
+        width, height = settings["img_size"]
+        target_size = target_size * img.size[0] * img.size[1] / (width * height)
+    quality, data = search_quality(
+        img,
+        outformat,
+        options,
+        target_size=target_size,
+        min_similarity=search.get("min_similarity"),
+        min_quality=search.get("min_quality", 40),
+        max_quality=search.get("max_quality", 95),
+    )
+    logger.debug("Found quality %d for %s (%d bytes)", quality, outname, len(data))
+    qualities[key] = quality
+    with open(outname, "wb") as f:
+        f.write(data)
+
+
+# modules which implement the image processing for the img_backend setting
+IMG_BACKENDS = {"pillow": "sigal.image", "vips": "sigal.vips"}
+
+
+def get_img_backend(settings):
+    """Return the module which processes the images, for the ``img_backend``
+    setting. A backend implements the ``generate_image``,
+    ``generate_thumbnail``, ``get_size`` and ``get_image_metadata`` functions
+    of this module, which is the default backend using Pillow. The setting can
+    also be the name of a module which implements them."""
+    name = settings.get("img_backend") or "pillow"
+    return importlib.import_module(IMG_BACKENDS.get(name, name))
+
+
+def generate_image(
+    source, outname, settings, options=None, renditions=None, qualities=None
+):
     """Image processor, rotate and resize the image.
 
     :param source: path to an image
-    :param outname: output filename
+    :param outname: output filename, or None to generate only the renditions
     :param settings: settings dict
     :param options: dict with PIL options (quality, optimize, progressive)
+    :param renditions: list of ``(size, outname)`` for other sizes of the
+        resized image, which are generated from the same decoded image. Sizes
+        which are not smaller than the original image are skipped.
+    :param qualities: dict of the qualities found with ``img_quality_search``,
+        indexed by format and size, which is used instead of searching the
+        quality again and is updated with the new ones.
+    :return: the resized image saved in ``outname``, if any
 
     """
 
     logger = logging.getLogger(__name__)
 
+    if source.endswith(".gif") and outname and outname.endswith(".webp"):
+        # animated GIF, converted with the animated_gif_format setting
+        generate_animated_webp(source, outname, settings)
+        return
+
     if settings["use_orig"] or source.endswith(".gif"):
-        utils.copy(source, outname, symlink=settings["orig_link"])
+        if outname:
+            utils.copy(source, outname, symlink=settings["orig_link"])
         return
 
+    processor_name = settings["img_processor"]
+    targets = [(settings["img_size"], outname)] if outname else []
+    if processor_name:
+        targets += renditions or []
+    if not targets:
+        return
+
+    profile = get_img_profile(settings)
+    variants = get_img_variants(settings)
+    search = settings["img_quality_search"]
+    if qualities is None:
+        qualities = {}
     img = _read_image(source)
     original_format = img.format
     logger.debug("Read %s: %dx%d (%s)", source, *img.size, original_format)
 
+    if processor_name:
+        if settings["autorotate_images"]:
+            img_size = _oriented_size(img)
+        else:
+            img_size = img.size
+        cover = processor_name != "ResizeToFit"
+        # the largest box first, and the image is decoded for this box
+        targets = sorted(
+            ((_resize_box(img_size, size), name) for size, name in targets),
+            key=lambda target: _ratio(img_size, target[0], cover=cover),
+            reverse=True,
+        )
+        img = _draft(img, targets[0][0], cover=cover, gap=profile["jpg_draft"])
+
     if settings["copy_exif_data"] and settings["autorotate_images"]:
         logger.warning(
             "The 'autorotate_images' and 'copy_exif_data' settings "
@@ -123,62 +421,500 @@ def generate_image(source, outname, settings, options=None):
         except (OSError, IndexError):
             pass
 
-    # Resize the image
-    if settings["img_processor"]:
+    if processor_name:
         try:
-            logger.debug("Processor: %s", settings["img_processor"])
-            processor_cls = getattr(pilkit.processors, settings["img_processor"])
+            logger.debug("Processor: %s", processor_name)
+            processor_cls = getattr(pilkit.processors, processor_name)
         except AttributeError:
-            logger.error("Wrong processor name: %s", settings["img_processor"])
+            logger.error("Wrong processor name: %s", processor_name)
             sys.exit()
 
-        width, height = settings["img_size"]
-
-        if img.size[0] < img.size[1]:
-            # swap target size if image is in portrait mode
-            height, width = width, height
-
-        processor = processor_cls(width, height, upscale=False)
-        img = processor.process(img)
+    resized_img = None
+    done = set()
+    for box, name in targets:
+        if name != outname and (_ratio(img_size, box, cover=cover) >= 1 or box in done):
+            logger.debug("Skip rendition %s", name)
+            continue
+
+        # Resize the image
+        out = img
+        if processor_name:
+            out = _reduce(out, box, cover=cover, gap=profile["reducing_gap"])
+            out = processor_cls(*box, upscale=False).process(out)
+            if processor_name == "ResizeToFit":
+                # the next (smaller) sizes are resized from this image
+                img = out
+                if signals.img_resized.receivers:
+                    out = out.copy()
+        done.add(box)
+
+        # signal.send() does not work here as plugins can modify the image, so
+        # we iterate other the receivers to call them with the image.
+        if signals.img_resized.receivers:
+            for receiver in signals.img_resized.receivers_for(out):
+                out = receiver(out, settings=settings)
+
+        # first, use hard-coded output format, or PIL format, or original
+        # image format, or fall back to JPEG
+        outformat = (
+            settings.get("img_format") or out.format or original_format or "JPEG"
+        )
+        save_options = {
+            **profile["encoder"].get(outformat.upper(), {}),
+            **(options or {}),
+        }
+
+        logger.debug("Save resized image: %s, %dx%d (%s)", name, *out.size, outformat)
+        utils.remove_if_shared(name)
+        if search and outformat.upper() in QUALITY_SEARCH_FORMATS:
+            _save_with_quality_search(
+                out, name, outformat, save_options, settings, qualities
+            )
+        else:
+            save_image(out, name, outformat, options=save_options, autoconvert=True)
+        # the other formats are encoded from the same image
+        _save_variants(
+            out, name, outformat, variants, profile, exif=save_options.get("exif")
+        )
+        if name == outname:
+            resized_img = out
 
-    # signal.send() does not work here as plugins can modify the image, so we
-    # iterate other the receivers to call them with the image.
-    for receiver in signals.img_resized.receivers_for(img):
-        img = receiver(img, settings=settings)
+    return resized_img
 
-    # first, use hard-coded output format, or PIL format, or original image
-    # format, or fall back to JPEG
-    outformat = settings.get("img_format") or img.format or original_format or "JPEG"
 
-    logger.debug("Save resized image: %s, %dx%d (%s)", outname, *img.size, outformat)
-    save_image(img, outname, outformat, options=options, autoconvert=True)
+def generate_animated_webp(source, outname, settings):
+    """Convert an animated image (GIF) to an animated WebP, with the frames
+    resized to ``img_size``."""
+    logger = logging.getLogger(__name__)
+    profile = get_img_profile(settings)
+    method = PILImage.Resampling[profile["resample"]]
+    frames = []
+    durations = []
+    with PILImage.open(source) as img:
+        box = None
+        if settings["img_processor"]:
+            box = _resize_box(img.size, settings["img_size"])
+        loop = img.info.get("loop", 0)
+        for frame in ImageSequence.Iterator(img):
+            durations.append(frame.info.get("duration", 100))
+            frame = frame.convert("RGBA")
+            if box:
+                frame.thumbnail(box, method)
+            frames.append(frame)
+
+    options = {
+        **profile["encoder"].get("WEBP", {}),
+        **settings["img_variant_options"].get("WEBP", {}),
+    }
+    logger.debug(
+        "Save animated image: %s, %dx%d, %d frames",
+        outname,
+        *frames[0].size,
+        len(frames),
+    )
+    utils.remove_if_shared(outname)
+    frames[0].save(
+        outname,
+        "WEBP",
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=loop,
+        **options,
+    )
 
 
 def generate_thumbnail(
-    source, outname, box, fit=True, options=None, thumb_fit_centering=(0.5, 0.5)
+    source,
+    outname,
+    box,
+    fit=True,
+    options=None,
+    thumb_fit_centering=(0.5, 0.5),
+    profile=None,
+    variants=None,
 ):
-    """Create a thumbnail image."""
+    """Create a thumbnail image.
+
+    :param source: path to an image, or an image already opened
+    :param profile: processing profile, as returned by
+        :func:`~sigal.settings.get_img_profile`. The default is to use the
+        LANCZOS filter on the full image.
+    :param variants: dict with other formats to save the thumbnail, and their
+        encoder options, as returned by :func:`~sigal.settings.get_img_variants`.
+
+    """
 
     logger = logging.getLogger(__name__)
+    profile = profile or {}
     img = _read_image(source)
+    img = _draft(img, box, cover=fit, gap=profile.get("jpg_draft"))
     img = Transpose().process(img)
     original_format = img.format
     logger.debug("Read %s: %dx%d (%s)", source, *img.size, original_format)
 
-    try:
-        method = PILImage.Resampling.LANCZOS
-    except AttributeError:
-        # Deprecated since version 9.1.0
-        method = PILImage.ANTIALIAS
+    img = _reduce(img, box, cover=fit, gap=profile.get("reducing_gap"))
+    method = PILImage.Resampling[profile.get("resample", "LANCZOS")]
 
     if fit:
         img = ImageOps.fit(img, box, method, centering=thumb_fit_centering)
     else:
+        if img is source:
+            # do not modify the image given by the caller
+            img = img.copy()
         img.thumbnail(box, method)
 
-    outformat = img.format or original_format or "JPEG"
+    # an image in memory has no format, use the one of the output file
+    outformat = (
+        img.format
+        or original_format
+        or PILImage.registered_extensions().get(os.path.splitext(outname)[1].lower())
+        or "JPEG"
+    )
+    if profile.get("encoder"):
+        options = {**profile["encoder"].get(outformat.upper(), {}), **(options or {})}
     logger.debug("Save thumbnail image: %s, %dx%d (%s)", outname, *img.size, outformat)
     save_image(img, outname, outformat, options=options, autoconvert=True)
+    if variants:
+        _save_variants(img, outname, outformat, variants, profile)
+
+
+def get_exif_preview(img, tolerance=0.02):
+    """Return the preview embedded in the EXIF data of the image (the
+    thumbnail of the IFD1), rotated with the EXIF orientation of the image, or
+    None if there is no preview or if its aspect ratio differs from the one of
+    the image by more than ``tolerance`` (e.g. with black borders)."""
+    if not _has_exif_tags(img):
+        return None
+    try:
+        ifd1 = img.getexif().get_ifd(IFD.IFD1)
+        offset, length = ifd1[0x0201], ifd1[0x0202]
+    except Exception:
+        return None
+
+    # the offset is relative to the TIFF header, after the APP1 prefix
+    data = img.info["exif"]
+    if data.startswith(b"Exif\x00\x00"):
+        data = data[6:]
+    try:
+        preview = PILImage.open(io.BytesIO(data[offset : offset + length]))
+        preview.load()
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    orientation = _exif_orientation(img)
+    if orientation in ORIENTATION_TRANSPOSE:
+        preview = preview.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+    width, height = _oriented_size(img)
+    if abs(preview.width * height / (preview.height * width) - 1) > tolerance:
+        return None
+    return preview
+
+
+def can_copy_source(img, settings):
+    """Check if the image can be used as is for the resized image: it fits in
+    ``img_size``, it does not need to be rotated or converted to another
+    format, and no plugin modifies the resized images.
+
+    Only the image header is read.
+    """
+    if signals.img_resized.receivers or img.format == "GIF":
+        return False
+
+    # the variants in other formats are encoded from the decoded image
+    if settings["img_variants"]:
+        return False
+
+    if settings.get("img_format") and settings["img_format"].upper() != img.format:
+        return False
+
+    # EXIF data is not kept in the resized images, unless copy_exif_data is set
+    if not settings["copy_exif_data"] and _has_exif_tags(img):
+        return False
+
+    if settings["autorotate_images"] and _exif_orientation(img) != 1:
+        return False
+
+    processor = settings["img_processor"]
+    if not processor:
+        return True
+
+    width, height = settings["img_size"]
+    if img.size[0] < img.size[1]:
+        height, width = width, height
+    if processor == "ResizeToFit":
+        return img.size[0] <= width and img.size[1] <= height
+    return img.size == (width, height)
+
+
+BASE83 = (
+    "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    "abcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+)
+
+
+def _base83(value, length):
+    return "".join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value):
+    value /= 255
+    if value <= 0.04045:
+        return value / 12.92
+    return ((value + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    value = min(max(value, 0), 1)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+SRGB_TO_LINEAR = [_srgb_to_linear(v) for v in range(256)]
+
+
+def blurhash(img, components=(4, 3)):
+    """Compute the `BlurHash <https://blurha.sh/>`_ of a small RGB image.
+
+    The cosine basis is separable, so the pixels are first projected on the
+    horizontal components for each row, and then on the vertical components.
+    """
+    width, height = img.size
+    nx, ny = components
+    pixels = [SRGB_TO_LINEAR[v] for v in img.tobytes()]
+    cos_x = [
+        [math.cos(math.pi * i * x / width) for x in range(width)] for i in range(nx)
+    ]
+    cos_y = [
+        [math.cos(math.pi * j * y / height) for y in range(height)] for j in range(ny)
+    ]
+
+    # rows[y][i] = (r, g, b) projection of row y on the horizontal component i
+    rows = []
+    for y in range(height):
+        row = pixels[y * width * 3 : (y + 1) * width * 3]
+        rows.append(
+            [
+                tuple(
+                    sum(c * v for c, v in zip(cos_x[i], row[ch::3], strict=True))
+                    for ch in range(3)
+                )
+                for i in range(nx)
+            ]
+        )
+
+    factors = []
+    for j in range(ny):
+        for i in range(nx):
+            norm = (1 if i == j == 0 else 2) / (width * height)
+            factors.append(
+                tuple(
+                    norm * sum(cos_y[j][y] * rows[y][i][ch] for y in range(height))
+                    for ch in range(3)
+                )
+            )
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((nx - 1) + (ny - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(v) for factor in ac for v in factor)
+        quantised_max = int(max(0, min(82, math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        max_value = 1
+        result += _base83(0, 1)
+
+    r, g, b = (_linear_to_srgb(v) for v in dc)
+    result += _base83((r << 16) + (g << 8) + b, 4)
+
+    def quantise(value):
+        value = math.copysign(abs(value / max_value) ** 0.5, value)
+        return int(max(0, min(18, math.floor(value * 9 + 9.5))))
+
+    for r, g, b in ac:
+        result += _base83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+
+def get_placeholder(source, kind):
+    """Compute a tiny placeholder for the image, displayed while the
+    thumbnail is loading.
+
+    :param source: path to an image, or an image already opened
+    :param kind: ``"color"`` for the dominant color (``"#rrggbb"``),
+        ``"image"`` for a 16x16 WebP image as a data URI, or ``"blurhash"``
+        for a BlurHash string.
+
+    """
+    img = _read_image(source)
+    size = 16 if kind == "image" else 32
+    img = _draft(img, (size, size), gap=2)
+    img = Transpose().process(img)
+    ratio = _ratio(img.size, (size, size))
+    box = (max(1, round(img.size[0] * ratio)), max(1, round(img.size[1] * ratio)))
+    small = img.convert("RGB").resize(box, PILImage.Resampling.BOX, reducing_gap=2)
+
+    if kind == "color":
+        quantized = small.quantize(colors=4)
+        _, index = max(quantized.getcolors())
+        r, g, b = quantized.getpalette()[index * 3 : index * 3 + 3]
+        return f"#{r:02x}{g:02x}{b:02x}"
+    elif kind == "image":
+        buf = io.BytesIO()
+        small.save(buf, "WEBP", quality=30)
+        data = base64.b64encode(buf.getvalue()).decode("ascii")
+        return f"data:image/webp;base64,{data}"
+    elif kind == "blurhash":
+        components = (4, 3) if small.size[0] >= small.size[1] else (3, 4)
+        return blurhash(small, components=components)
+    raise ValueError(f"Unknown placeholder: {kind}")
+
+
+TILES_DEFAULTS = {
+    "min_pixels": 20_000_000,
+    "tile_size": 254,
+    "overlap": 1,
+    "format": "JPEG",
+    "options": {"quality": 85},
+    "threads": 4,
+}
+
+DZI_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008"
+       Format="{format}" Overlap="{overlap}" TileSize="{tile_size}">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+
+def _tile_boxes(size, tile_size, overlap):
+    """Return the column, row and box of the tiles of an image of this size,
+    with the layout of the DeepZoom format."""
+    width, height = size
+    for col in range(math.ceil(width / tile_size)):
+        for row in range(math.ceil(height / tile_size)):
+            x, y = col * tile_size, row * tile_size
+            box = (
+                max(x - overlap, 0),
+                max(y - overlap, 0),
+                min(x + tile_size + overlap, width),
+                min(y + tile_size + overlap, height),
+            )
+            yield col, row, box
+
+
+def _save_tiles(img, level_dir, options):
+    os.makedirs(level_dir, exist_ok=True)
+    fmt = options["format"].upper()
+    ext = IMG_EXTENSIONS.format2ext[fmt]
+    boxes = _tile_boxes(img.size, options["tile_size"], options["overlap"])
+    for col, row, box in boxes:
+        save_image(
+            img.crop(box),
+            os.path.join(level_dir, f"{col}_{row}{ext}"),
+            fmt,
+            options=options["options"],
+            autoconvert=True,
+        )
+
+
+def generate_tiles(source, outname, settings):
+    """Create a DeepZoom pyramid of tiles for a large image, with the ``.dzi``
+    descriptor in ``outname`` and the tiles in a ``<name>_files`` directory,
+    which contains a subdirectory for each level.
+
+    Each level is resized from the previous one, and its tiles are saved in a
+    thread while the next levels are resized. The completed levels are
+    recorded, so if the processing is interrupted, only the missing levels are
+    created the next time, and a JPEG image is decoded only at the size of the
+    largest missing level.
+
+    :param source: path to an image
+    :param outname: path of the ``.dzi`` file
+    :param settings: settings dict, with the options of ``img_tiles``
+    :return: dict with the ``width`` and ``height`` of the image, or None if
+        the image is smaller than the ``min_pixels`` option
+    """
+    logger = logging.getLogger(__name__)
+    options = {**TILES_DEFAULTS, **settings["img_tiles"]}
+    autorotate = settings["autorotate_images"]
+
+    with _read_image(source) as img:
+        width, height = _oriented_size(img) if autorotate else img.size
+        if width * height < options["min_pixels"]:
+            return None
+
+        max_level = math.ceil(math.log2(max(width, height)))
+
+        def level_size(level):
+            scale = 2 ** (max_level - level)
+            return math.ceil(width / scale), math.ceil(height / scale)
+
+        files_dir = os.path.splitext(outname)[0] + "_files"
+        state_path = os.path.join(files_dir, "levels.json")
+        stat = os.stat(source)
+        key = json.dumps(
+            [stat.st_size, stat.st_mtime_ns, autorotate]
+            + [options[k] for k in ("tile_size", "overlap", "format", "options")],
+            sort_keys=True,
+        )
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if state.get("key") != key:
+            # the tiles are created again from scratch
+            shutil.rmtree(files_dir, ignore_errors=True)
+            state = {"key": key, "levels": []}
+        os.makedirs(files_dir, exist_ok=True)
+
+        pending = [
+            level for level in range(max_level, -1, -1) if level not in state["levels"]
+        ]
+        if pending:
+            top = pending[0]
+            box = level_size(top)
+            if not autorotate and _oriented_size(img) != img.size:
+                # the box is given for the oriented image
+                box = box[::-1]
+            img = _draft(img, box, cover=True, gap=1)
+            img.load()
+            if autorotate:
+                img = Transpose().process(img)
+            method = PILImage.Resampling[get_img_profile(settings)["resample"]]
+            logger.debug("Create tiles for %s, levels %d to 0", source, top)
+
+            with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+                futures = {}
+                for level in range(top, -1, -1):
+                    if img.size != level_size(level):
+                        img = img.resize(level_size(level), method)
+                    if level in pending:
+                        level_dir = os.path.join(files_dir, str(level))
+                        future = executor.submit(_save_tiles, img, level_dir, options)
+                        futures[future] = level
+
+                for future in as_completed(futures):
+                    future.result()
+                    state["levels"].append(futures[future])
+                    with open(state_path, "w") as f:
+                        json.dump(state, f)
+
+    with open(outname, "w") as f:
+        f.write(
+            DZI_TEMPLATE.format(
+                format=IMG_EXTENSIONS.format2ext[options["format"].upper()][1:],
+                overlap=options["overlap"],
+                tile_size=options["tile_size"],
+                width=width,
+                height=height,
+            )
+        )
+    return {"width": width, "height": height}
 
 
 def process_image(media):
@@ -190,7 +926,8 @@ def process_image(media):
     if media.src_ext in (".jpg", ".jpeg", ".JPG", ".JPEG"):
         options = media.settings["jpg_options"]
     elif media.src_ext == ".png":
-        options = {"optimize": True}
+        # the encoder effort is given by the profile if it is set
+        options = {} if media.settings["img_profile"] else {"optimize": True}
     elif media.src_ext == ".heic" and not HAS_HEIF:
         logger.warning(
             f"cannot open {media.src_path}, pillow-heif is needed to open .heic files"
@@ -199,22 +936,151 @@ def process_image(media):
     else:
         options = {}
 
-    with utils.raise_if_debug() as status:
-        generate_image(media.src_path, media.dst_path, media.settings, options=options)
+    settings = media.settings
+    backend = get_img_backend(settings)
 
-        if media.settings["make_thumbs"]:
-            generate_thumbnail(
+    with utils.raise_if_debug() as status:
+        copy_method = settings["copy_fitting_images"]
+        if copy_method and not settings["use_orig"]:
+            with _read_image(media.src_path) as img:
+                copy_source = can_copy_source(img, settings)
+        else:
+            copy_source = False
+
+        dst_dir = os.path.join(settings["destination"], media.path)
+        filename = media.dst_filename
+        renditions = []
+        if settings["img_processor"] and not settings["use_orig"]:
+            renditions = [
+                (size, os.path.join(dst_dir, get_rendition(settings, filename, size)))
+                for size in settings["img_renditions"]
+            ]
+
+        qualities = None
+        if settings["img_quality_search"]:
+            # the qualities found by a previous build are reused if the source
+            # image and the settings did not change
+            stat = os.stat(media.src_path)
+            key = [
+                stat.st_size,
+                stat.st_mtime_ns,
+                settings["img_quality_search"],
+                options,
+                settings["img_profile"],
+            ]
+            cached = media.build_info.get("quality_search", {})
+            qualities = cached["qualities"] if cached.get("key") == key else {}
+            media.build_info["quality_search"] = {"key": key, "qualities": qualities}
+
+        if copy_source:
+            logger.debug("%s fits in img_size, using it as is", media.src_path)
+            method = copy_method if isinstance(copy_method, str) else "copy"
+            utils.link_or_copy(media.src_path, media.dst_path, method=method)
+            img = None
+            if renditions:
+                backend.generate_image(
+                    media.src_path,
+                    None,
+                    settings,
+                    options=options,
+                    renditions=renditions,
+                    qualities=qualities,
+                )
+        else:
+            # the resized image is kept in memory to create the thumbnails
+            img = backend.generate_image(
+                media.src_path,
                 media.dst_path,
-                media.thumb_path,
-                media.settings["thumb_size"],
-                fit=media.settings["thumb_fit"],
+                settings,
                 options=options,
-                thumb_fit_centering=media.settings["thumb_fit_centering"],
+                renditions=renditions,
+                qualities=qualities,
             )
 
+        # the thumbnails and placeholder are created from the resized image,
+        # read again if it was not kept or if it has an EXIF orientation to
+        # apply
+        if img is None or (
+            settings["copy_exif_data"] and not settings["autorotate_images"]
+        ):
+            img = _read_image(media.dst_path)
+            # the EXIF orientation of the file is applied to the thumbnails
+            img_size = _oriented_size(img)
+        else:
+            # the image in memory is already rotated, but keeps the EXIF data
+            # of the source
+            img_size = img.size
+
+        if settings["make_thumbs"]:
+            thumb_size = settings["thumb_size"]
+            profile = get_img_profile(settings)
+            variants = get_img_variants(settings)
+            preview = None
+            if settings["thumb_exif_preview"]:
+                with _read_image(media.src_path) as src:
+                    preview = get_exif_preview(src)
+            # the largest thumbnail first, so the image is decoded for it
+            for density in sorted({1, *settings["thumb_densities"]}, reverse=True):
+                box = (thumb_size[0] * density, thumb_size[1] * density)
+                if (
+                    density != 1
+                    and _ratio(img_size, box, cover=settings["thumb_fit"]) > 1
+                ):
+                    logger.debug("Skip thumbnail %sx, larger than the image", density)
+                    continue
+                if density == 1:
+                    thumb_path = media.thumb_path
+                else:
+                    thumb_path = os.path.join(
+                        dst_dir, get_thumb(settings, filename, density)
+                    )
+                thumb_source = img
+                if preview is not None and (
+                    _ratio(preview.size, box, cover=settings["thumb_fit"]) <= 1
+                ):
+                    # the EXIF preview is large enough, the image is not
+                    # decoded for the thumbnail
+                    logger.debug("Use the EXIF preview for %s", thumb_path)
+                    thumb_source = preview
+                backend.generate_thumbnail(
+                    thumb_source,
+                    thumb_path,
+                    box,
+                    fit=settings["thumb_fit"],
+                    options=options,
+                    thumb_fit_centering=settings["thumb_fit_centering"],
+                    profile=profile,
+                    variants=variants,
+                )
+
+        if settings["img_placeholder"]:
+            media.build_info["placeholder"] = get_placeholder(
+                img, settings["img_placeholder"]
+            )
+        img.close()
+
+        if settings["img_tiles"]:
+            tiles = generate_tiles(
+                media.src_path,
+                os.path.join(dst_dir, get_tiles(settings, filename)),
+                settings,
+            )
+            media.build_info["tiles"] = tiles
+
     return status.value
 
 
+def is_animated(file_path):
+    """Return True if the image has several frames, e.g. an animated GIF."""
+    try:
+        with PILImage.open(file_path) as img:
+            return getattr(img, "is_animated", False)
+    except (OSError, ValueError) as e:
+        logger = logging.getLogger(__name__)
+        logger.warning("Could not read %s: %s", file_path, e)
+        return False
+
+
 def get_size(file_path):
     """Return image size (width and height)."""
     try:
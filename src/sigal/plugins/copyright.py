@@ -20,6 +20,7 @@ import logging
 from PIL import ImageDraw, ImageFont
 
 from sigal import signals
+from sigal.utils import resource_cache
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +37,9 @@ def add_copyright(img, settings=None):
     text_height = bottom_margin + 12  # default text height (of 15)
     if font:
         try:
-            font = ImageFont.truetype(font, font_size)
+            font = resource_cache.get(
+                ("font", font, font_size), lambda: ImageFont.truetype(font, font_size)
+            )
             text_height = font.getsize(text)[1] + bottom_margin
         except Exception:  # load default font in case of any exception
             logger.debug("Exception: Couldn't locate font %s, using default font", font)
@@ -23,7 +23,8 @@
 
 This plugin allows extended caching, which is useful for large galleries. Once
 a gallery has been built it caches all metadata for all media (markdown, exif,
-itpc) in the gallery target folder. Before the next run it restores them so
+itpc, and the information read with ffprobe for the videos) in the gallery
+target folder. Before the next run it restores them so
 that the image and metadata files do not have to be parsed again. For large
 galleries this can speed up the creation of index files dramatically.
 """
@@ -34,6 +35,7 @@ import pickle
 
 from .. import signals
 from ..utils import get_mod_date
+from ..video import EMPTY_PROBE
 
 logger = logging.getLogger(__name__)
 
@@ -69,13 +71,20 @@ def load_metadata(album):
             # check if files have changed
             try:
                 mod_date = int(get_mod_date(media.src_path))
+                size = os.path.getsize(media.src_path)
             except FileNotFoundError:
                 continue
-            if data.get("mod_date", -1) < mod_date:
+            # the video entries of older versions, without the size, do not
+            # contain the information read with ffprobe
+            cached_size = data.get("size", None if media.type == "video" else size)
+            if data.get("mod_date", -1) < mod_date or cached_size != size:
                 continue  # file_metadata needs updating
 
             if "file_metadata" in data:
-                media.file_metadata = data["file_metadata"]
+                file_metadata = data["file_metadata"]
+                if media.type == "video":
+                    file_metadata = {**EMPTY_PROBE, **file_metadata}
+                media.file_metadata = file_metadata
             if "exif" in data:
                 media.exif = data["exif"]
             if "input_size" in data:
@@ -129,10 +138,12 @@ def save_cache(gallery):
             data = {}
             try:
                 mod_date = int(get_mod_date(media.src_path))
+                size = os.path.getsize(media.src_path)
             except FileNotFoundError:
                 continue
             else:
                 data["mod_date"] = mod_date
+                data["size"] = size
                 data["file_metadata"] = media.file_metadata
                 if hasattr(media, "exif"):
                     data["exif"] = media.exif
@@ -98,7 +98,9 @@ def generate_thumbnail(
 
     kwargs = {}
     if font:
-        kwargs["font"] = ImageFont.truetype(font, font_size)
+        kwargs["font"] = utils.resource_cache.get(
+            ("font", font, font_size), lambda: ImageFont.truetype(font, font_size)
+        )
     if font_color:
         kwargs["fill"] = font_color
 
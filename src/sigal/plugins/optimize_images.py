@@ -0,0 +1,274 @@
+"""Plugin which runs lossless optimizers on the resized images and thumbnails.
+
+The files created for each media (resized image, renditions, thumbnails and
+variants in other formats) are optimized with command-line tools, in the
+worker processes, just after the media has been processed. An optimized file
+is kept only if it is smaller than the original one.
+
+The results are cached with the hash of the files, in a directory outside
+of the destination, so that the cache is not published with the gallery. The
+cache contains a copy of each optimized file, and an index which gives the
+optimized file for the hash of a file before or after its optimization. A
+file which was already optimized, or which is identical to a file already
+optimized (e.g. when an image is processed again with the same settings), is
+not optimized again. The savings for each format are reported at the end of
+the build.
+
+Settings available as dictionary in ``optimize_images_options``:
+
+- ``tools``: dict with the command to run for each format, where
+  ``{input}`` and ``{output}`` are replaced by the paths of the files. The
+  default is::
+
+      {
+          "JPEG": ["jpegtran", "-copy", "all", "-optimize", "-progressive",
+                   "-outfile", "{output}", "{input}"],
+          "PNG": ["oxipng", "-o", "2", "--strip", "safe", "--out", "{output}",
+                  "{input}"],
+          "GIF": ["gifsicle", "-O3", "-o", "{output}", "{input}"],
+      }
+
+  Lossy WebP images cannot be recompressed without loss, so there is no
+  default command for WebP. For lossless WebP images, ``cwebp`` can be used:
+  ``["cwebp", "-quiet", "-lossless", "-z", "9", "{input}", "-o", "{output}"]``.
+  mozjpeg's ``jpegtran`` can be used instead of the one from libjpeg, it uses
+  the same options.
+- ``cache``: use the cache (default: True).
+- ``cache_dir``: directory of the cache (default: ``.sigal-optimize-cache``
+  in the parent directory of the destination). It can be shared by several
+  galleries.
+
+A format is skipped, with a warning, if its command is not installed.
+
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import defaultdict
+from functools import cache, partial
+from os.path import join, splitext
+
+from sigal import signals
+from sigal.settings import IMG_EXTENSIONS, Status
+
+logger = logging.getLogger(__name__)
+
+# name of the cache directory, in the parent directory of the destination
+CACHE_DIR = ".sigal-optimize-cache"
+
+DEFAULT_TOOLS = {
+    "JPEG": [
+        "jpegtran",
+        "-copy",
+        "all",
+        "-optimize",
+        "-progressive",
+        "-outfile",
+        "{output}",
+        "{input}",
+    ],
+    "PNG": ["oxipng", "-o", "2", "--strip", "safe", "--out", "{output}", "{input}"],
+    "GIF": ["gifsicle", "-O3", "-o", "{output}", "{input}"],
+}
+
+
+@cache
+def find_tool(name):
+    """Return the path of the tool, and warn once (per process) if it is not
+    installed."""
+    path = shutil.which(name)
+    if path is None:
+        logger.warning("%s is not installed, the images are not optimized", name)
+    return path
+
+
+def _write_text(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def file_hash(path, cmd):
+    """Hash of the file content and of the optimization command."""
+    digest = hashlib.sha256(" ".join(cmd).encode())
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Optimizer:
+    """Run the optimization tools on the files, with a cache of the
+    optimized files indexed by the hash of the file."""
+
+    def __init__(self, settings):
+        options = settings.get("optimize_images_options", {})
+        self.tools = options.get("tools", DEFAULT_TOOLS)
+        self.cache_dir = None
+        if options.get("cache", True):
+            self.cache_dir = os.path.abspath(
+                options.get("cache_dir")
+                or join(
+                    os.path.dirname(os.path.abspath(settings["destination"])),
+                    CACHE_DIR,
+                )
+            )
+
+    def _cache_path(self, kind, digest):
+        return join(self.cache_dir, kind, digest[:2], digest)
+
+    def _write(self, path, write):
+        """Write a file of the cache, with an atomic rename as several workers
+        can write in the cache."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _lookup(self, digest):
+        """Return the path of the optimized file for the hash of a file, or
+        None if it is not in the cache."""
+        try:
+            with open(self._cache_path("index", digest)) as f:
+                optimized = f.read().strip()
+        except FileNotFoundError:
+            return None
+        path = self._cache_path("files", optimized)
+        return path if os.path.exists(path) else None
+
+    def _store(self, digests, path):
+        """Store the optimized file once, with its hash, and index it for the
+        hashes of the file before and after the optimization."""
+        optimized = digests[-1]
+        file_path = self._cache_path("files", optimized)
+        if not os.path.exists(file_path):
+            self._write(file_path, partial(shutil.copyfile, path))
+        for digest in digests:
+            index_path = self._cache_path("index", digest)
+            if not os.path.exists(index_path):
+                self._write(index_path, partial(_write_text, text=optimized))
+
+    def run(self, path, fmt):
+        """Optimize the file with the tool for its format. Return the path of
+        the optimized file, or None if the tool failed."""
+        cmd = self.tools[fmt]
+        if not find_tool(cmd[0]):
+            return None
+
+        fd, output = tempfile.mkstemp(
+            suffix=splitext(path)[1], dir=os.path.dirname(path)
+        )
+        os.close(fd)
+        # some tools do not overwrite an existing file
+        os.remove(output)
+        args = [arg.format(input=path, output=output) for arg in cmd]
+        logger.debug("Optimize %s: %s", path, " ".join(args))
+        try:
+            subprocess.run(args, capture_output=True, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, "stderr", b"") or b""
+            logger.warning(
+                "Failed to optimize %s: %s %s",
+                path,
+                e,
+                stderr.decode("utf8", errors="replace")[-500:],
+            )
+            if os.path.exists(output):
+                os.remove(output)
+            return None
+        return output
+
+    def optimize(self, path):
+        """Optimize a file, and return its format and its size before and
+        after the optimization, or None if the file was not optimized."""
+        fmt = IMG_EXTENSIONS.ext2format.get(splitext(path)[1].lower())
+        if fmt not in self.tools:
+            return None
+        # do not modify the source images used with use_orig or
+        # copy_fitting_images="hardlink"
+        if os.path.islink(path) or os.stat(path).st_nlink > 1:
+            return None
+
+        size = os.path.getsize(path)
+        digest = None
+        if self.cache_dir:
+            digest = file_hash(path, self.tools[fmt])
+            cache_path = self._lookup(digest)
+            if cache_path is not None:
+                logger.debug("Optimized %s found in the cache", path)
+                if os.path.getsize(cache_path) != size:
+                    shutil.copyfile(cache_path, path)
+                return fmt, size, os.path.getsize(path)
+
+        output = self.run(path, fmt)
+        if output is None:
+            return None
+
+        if os.path.getsize(output) < size:
+            os.replace(output, path)
+        else:
+            os.remove(output)
+
+        if self.cache_dir:
+            # the optimized file, indexed for the hash of the file before and
+            # after the optimization
+            self._store([digest, file_hash(path, self.tools[fmt])], path)
+        return fmt, size, os.path.getsize(path)
+
+
+def optimize_media(media, processor=None):
+    """Process the media, and optimize the created files."""
+    status = processor(media)
+    if status != Status.SUCCESS:
+        return status
+
+    optimizer = Optimizer(media.settings)
+    savings = defaultdict(lambda: [0, 0])
+    for path in media.output_paths:
+        try:
+            result = optimizer.optimize(path)
+        except OSError as e:
+            logger.warning("Failed to optimize %s: %s", path, e)
+            continue
+        if result is not None:
+            fmt, before, after = result
+            savings[fmt][0] += before
+            savings[fmt][1] += after
+    media.build_info["optimized"] = dict(savings)
+    return status
+
+
+def process_file(media, processor=None):
+    if processor is not None:
+        return partial(optimize_media, processor=processor)
+
+
+def report(gallery):
+    """Log the savings for each format."""
+    savings = defaultdict(lambda: [0, 0])
+    for album in gallery.albums.values():
+        for media in album.medias:
+            for fmt, (before, after) in media.build_info.get("optimized", {}).items():
+                savings[fmt][0] += before
+                savings[fmt][1] += after
+
+    for fmt, (before, after) in sorted(savings.items()):
+        logger.info(
+            "Optimized %s files: %.1f kB saved (%.1f%%)",
+            fmt,
+            (before - after) / 1024,
+            100 * (before - after) / before if before else 0,
+        )
+
+
+def register(settings):
+    signals.process_file.connect(process_file)
+    signals.gallery_build.connect(report)
@@ -0,0 +1,181 @@
+"""Plugin which packs the thumbnails of each album in sprite sheets.
+
+Album pages with many thumbnails need as many HTTP requests. This plugin packs
+the thumbnails of an album in a few images (sprite sheets), and the themes
+display each thumbnail from its sheet, so a page needs only one request per
+sheet. The thumbnails produced during the processing are reused, the source
+images are not read again.
+
+The sheets are saved in the thumbnails directory of each album, with a
+``sprites.json`` file which contains the position of each thumbnail. When the
+gallery is built again, only the sheets for which some thumbnails have changed
+are created again.
+
+Settings:
+
+- ``sprites_format``: format of the sheets, ``"WEBP"`` (default) or
+  ``"JPEG"``.
+- ``sprites_options``: encoder options for the sheets (default:
+  ``{"quality": 85}``).
+- ``sprites_columns``: number of thumbnails on each row of a sheet (default:
+  10).
+- ``sprites_max_thumbs``: maximum number of thumbnails in a sheet (default:
+  100). Adding or removing a file in an album changes the following sheets.
+
+The position of each thumbnail is available in templates with the
+``media.sprite`` dict, which contains the ``url`` of the sheet, the ``x``,
+``y``, ``width`` and ``height`` of the thumbnail, and a ``style`` to use on an
+``<img>`` element with the sheet as ``src``.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+from os.path import join
+
+from PIL import Image as PILImage
+from pilkit.utils import save_image
+
+from sigal import signals
+from sigal.settings import IMG_EXTENSIONS
+from sigal.utils import url_from_path
+
+logger = logging.getLogger(__name__)
+
+MAP_FILENAME = "sprites.json"
+
+
+def _thumb_key(media):
+    """Identify the version of a thumbnail, with its name and mtime."""
+    return [media.thumb_name, os.stat(media.thumb_path).st_mtime_ns]
+
+
+def _layout(sizes, columns):
+    """Place the thumbnails on rows of ``columns`` thumbnails, and return the
+    positions and the size of the sheet."""
+    positions = []
+    x = y = width = row_height = 0
+    for i, (w, h) in enumerate(sizes):
+        if i and i % columns == 0:
+            x, y, row_height = 0, y + row_height, 0
+        positions.append((x, y))
+        x += w
+        width = max(width, x)
+        row_height = max(row_height, h)
+    return positions, (width, y + row_height)
+
+
+def make_sheet(medias, outname, settings):
+    """Create the sprite sheet for the medias, and return the position of each
+    thumbnail."""
+    thumbs = []
+    try:
+        for media in medias:
+            img = PILImage.open(media.thumb_path)
+            thumbs.append(img)
+
+        positions, size = _layout([img.size for img in thumbs], settings["columns"])
+        sheet = PILImage.new("RGB", size, "white")
+        for img, position in zip(thumbs, positions):
+            sheet.paste(img.convert("RGB"), position)
+    finally:
+        for img in thumbs:
+            img.close()
+
+    save_image(sheet, outname, settings["format"], options=settings["options"])
+    logger.debug("Created sprite sheet %s (%dx%d)", outname, *size)
+    return [
+        {"x": x, "y": y, "width": img.size[0], "height": img.size[1]}
+        for img, (x, y) in zip(thumbs, positions)
+    ]
+
+
+def get_sprites_settings(settings):
+    fmt = settings.get("sprites_format", "WEBP").upper()
+    return {
+        "format": fmt,
+        "options": settings.get("sprites_options", {"quality": 85}),
+        "columns": settings.get("sprites_columns", 10),
+        "max_thumbs": settings.get("sprites_max_thumbs", 100),
+        "ext": IMG_EXTENSIONS.format2ext[fmt],
+    }
+
+
+def load_map(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read the sprites map %s: %s", path, e)
+        return {}
+
+
+def build_sprites(album):
+    """Create the sprite sheets of the album, or reuse the existing ones if
+    their thumbnails did not change, and set the ``sprite`` attribute of the
+    medias."""
+    medias = [media for media in album.medias if media.thumbnail]
+    if not medias:
+        return
+
+    settings = get_sprites_settings(album.settings)
+    thumb_dir = join(album.dst_path, album.settings["thumb_dir"])
+    map_path = join(thumb_dir, MAP_FILENAME)
+    old_sheets = {
+        sheet["file"]: sheet for sheet in load_map(map_path).get("sheets", [])
+    }
+
+    sheets = []
+    n = settings["max_thumbs"]
+    for i in range(0, len(medias), n):
+        chunk = medias[i : i + n]
+        keys = [_thumb_key(media) for media in chunk]
+        params = [settings["format"], settings["options"], settings["columns"], keys]
+        digest = hashlib.md5(
+            json.dumps(params).encode(), usedforsecurity=False
+        ).hexdigest()[:10]
+        filename = f"sprite-{len(sheets)}-{digest}{settings['ext']}"
+
+        sheet = old_sheets.pop(filename, None)
+        if sheet is None or not os.path.isfile(join(thumb_dir, filename)):
+            positions = make_sheet(chunk, join(thumb_dir, filename), settings)
+            sheet = {"file": filename, "thumbs": positions}
+        else:
+            logger.debug("Sprite sheet %s is up to date", filename)
+        sheets.append(sheet)
+
+        url = url_from_path(join(album.settings["thumb_dir"], filename))
+        for media, pos in zip(chunk, sheet["thumbs"]):
+            media.sprite = {
+                "url": url,
+                **pos,
+                "style": (
+                    f"object-fit: none; object-position: -{pos['x']}px "
+                    f"-{pos['y']}px; width: {pos['width']}px; "
+                    f"height: {pos['height']}px"
+                ),
+            }
+
+    # remove the sheets which are not used anymore
+    for filename in old_sheets:
+        try:
+            os.remove(join(thumb_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    with open(map_path, "w") as f:
+        json.dump({"sheets": sheets}, f)
+
+
+def before_render(context):
+    album = context.get("album")
+    if album is not None and album.medias:
+        build_sprites(album)
+
+
+def register(settings):
+    signals.before_render.connect(before_render)
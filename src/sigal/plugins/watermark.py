@@ -42,6 +42,7 @@ import logging
 from PIL import Image, ImageEnhance
 
 from sigal import signals
+from sigal.utils import resource_cache
 
 
 def reduce_opacity(im, opacity):
@@ -57,39 +58,69 @@ def reduce_opacity(im, opacity):
     return im
 
 
-def watermark(im, mark, position, opacity=1):
-    """Adds a watermark to an image."""
-    if opacity < 1:
-        mark = reduce_opacity(mark, opacity)
-    if im.mode != "RGBA":
-        im = im.convert("RGBA")
-    # create a transparent layer the size of the image and draw the
-    # watermark in that layer.
-    layer = Image.new("RGBA", im.size, (0, 0, 0, 0))
+def watermark_layer(size, mark, position):
+    """Returns a transparent layer of the given size with the watermark drawn
+    in it."""
+    layer = Image.new("RGBA", size, (0, 0, 0, 0))
     if position == "tile":
-        for y in range(0, im.size[1], mark.size[1]):
-            for x in range(0, im.size[0], mark.size[0]):
+        for y in range(0, size[1], mark.size[1]):
+            for x in range(0, size[0], mark.size[0]):
                 layer.paste(mark, (x, y))
     elif position == "scale":
         # scale, but preserve the aspect ratio
-        ratio = min(float(im.size[0]) / mark.size[0], float(im.size[1]) / mark.size[1])
+        ratio = min(float(size[0]) / mark.size[0], float(size[1]) / mark.size[1])
         w = int(mark.size[0] * ratio)
         h = int(mark.size[1] * ratio)
         mark = mark.resize((w, h))
-        layer.paste(mark, (int((im.size[0] - w) / 2), int((im.size[1] - h) / 2)))
+        layer.paste(mark, (int((size[0] - w) / 2), int((size[1] - h) / 2)))
     else:
         layer.paste(mark, position)
+    return layer
+
+
+def watermark(im, mark, position, opacity=1):
+    """Adds a watermark to an image."""
+    if opacity < 1:
+        mark = reduce_opacity(mark, opacity)
+    if im.mode != "RGBA":
+        im = im.convert("RGBA")
+    # create a transparent layer the size of the image and draw the
+    # watermark in that layer.
+    layer = watermark_layer(im.size, mark, position)
     # composite the watermark with the layer
     return Image.composite(layer, im, layer)
 
 
+def load_mark(path, opacity=1):
+    """Returns the decoded watermark image, with the opacity applied."""
+    with Image.open(path) as mark:
+        if opacity < 1:
+            return reduce_opacity(mark, opacity)
+        mark.load()
+        return mark.copy()
+
+
 def add_watermark(img, settings=None):
     logger = logging.getLogger(__name__)
     logger.debug("Adding watermark to %r", img)
+    path = settings["watermark"]
     position = settings.get("watermark_position", "scale")
     opacity = settings.get("watermark_opacity", 1)
-    with Image.open(settings["watermark"]) as mark:
-        return watermark(img, mark, position, opacity)
+    if isinstance(position, list):
+        position = tuple(position)
+
+    # The decoded watermark and the layers are stored in the per-process
+    # cache, as most images share a few sizes.
+    mark = resource_cache.get(
+        ("watermark", path, opacity), lambda: load_mark(path, opacity)
+    )
+    layer = resource_cache.get(
+        ("watermark_layer", path, opacity, position, img.size),
+        lambda: watermark_layer(img.size, mark, position),
+    )
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    return Image.composite(layer, img, layer)
 
 
 def register(settings):
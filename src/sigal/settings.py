@@ -23,6 +23,7 @@
 
 import logging
 import os
+from importlib.util import find_spec
 from os.path import abspath, isabs, join, normpath
 from pprint import pformat
 
@@ -31,10 +32,12 @@ from PIL import Image as PILImage
 _DEFAULT_CONFIG = {
     "albums_sort_attr": "name",
     "albums_sort_reverse": False,
+    "animated_gif_format": None,
     "autorotate_images": True,
     "autoplay": False,
     "colorbox_column_size": 3,
     "copy_exif_data": False,
+    "copy_fitting_images": False,
     "datetime_format": "%c",
     "display_timestamp": False,
     "destination": "_build",
@@ -42,8 +45,10 @@ _DEFAULT_CONFIG = {
     "galleria_theme": "classic",
     "google_analytics": "",
     "google_tag_manager": "",
+    "hls_dir": "hls",
     "ignore_directories": [],
     "ignore_files": [],
+    "img_backend": "pillow",
     "img_extensions": [
         ".jpg",
         ".jpeg",
@@ -54,10 +59,18 @@ _DEFAULT_CONFIG = {
         ".tiff",
         ".webp",
     ],
+    "img_placeholder": None,
     "img_processor": "ResizeToFit",
+    "img_quality_search": None,
+    "img_profile": None,
+    "img_renditions": [],
     "img_size": (640, 480),
+    "img_tiles": None,
+    "img_variants": [],
+    "img_variant_options": {"AVIF": {"quality": 60}, "WEBP": {"quality": 80}},
     "img_format": None,
     "index_in_url": False,
+    "jpg_draft": None,
     "jpg_options": {"quality": 85, "optimize": True, "progressive": True},
     "keep_orig": False,
     "html_language": "en",
@@ -66,6 +79,7 @@ _DEFAULT_CONFIG = {
     "locale": "",
     "make_thumbs": True,
     "max_img_pixels": None,
+    "memory_budget": None,
     "map_height": "500px",
     "medias_sort_attr": "filename",
     "medias_sort_reverse": False,
@@ -74,6 +88,7 @@ _DEFAULT_CONFIG = {
     "orig_dir": "original",
     "orig_link": False,
     "rel_link": False,
+    "renditions_dir": "renditions",
     "output_filename": "index.html",
     "piwik": {"tracker_url": "", "site_id": 0},
     "plugin_paths": [],
@@ -82,7 +97,9 @@ _DEFAULT_CONFIG = {
     "show_map": False,
     "source": "",
     "theme": "colorbox",
+    "thumb_densities": [],
     "thumb_dir": "thumbnails",
+    "thumb_exif_preview": False,
     "thumb_fit": True,
     "thumb_fit_centering": (0.5, 0.5),
     "thumb_prefix": "",
@@ -92,14 +109,21 @@ _DEFAULT_CONFIG = {
     "thumb_video_black_retries": 0,
     "thumb_video_black_retry_offset": 1,
     "thumb_video_black_max_colors": 4,
+    "tiles_dir": "tiles",
     "title": "",
     "use_orig": False,
     "user_css": None,
+    "video_chunks": None,
     "video_converter": "ffmpeg",
     "video_extensions": [".3gp", ".avi", ".mkv", ".mov", ".mp4", ".ogv", ".webm"],
     "video_format": "webm",
+    "video_hls": None,
+    "video_jobs": None,
+    "video_poster": False,
+    "video_prober": "ffprobe",
     "video_always_convert": False,
     "video_size": (480, 360),
+    "video_timeout_factor": None,
     "watermark": "",
     "webm_options": ["-crf", "10", "-b:v", "1.6M", "-qmin", "4", "-qmax", "63"],
     "webm_options_second_pass": None,
@@ -128,9 +152,51 @@ class _ImgExtensions:
 
 IMG_EXTENSIONS = _ImgExtensions()
 
+#: Image processing profiles, which can be selected with the ``img_profile``
+#: setting. ``resample`` is the filter used for the thumbnails,
+#: ``reducing_gap`` enables a fast reduction by an integer factor before
+#: resizing, ``jpg_draft`` the JPEG draft decoding, and ``encoder`` gives the
+#: options for each output format.
+IMG_PROFILES = {
+    "fast": {
+        "resample": "BILINEAR",
+        "reducing_gap": 1.5,
+        "jpg_draft": 1,
+        "encoder": {
+            "JPEG": {"optimize": False, "progressive": False},
+            "PNG": {"optimize": False, "compress_level": 1},
+            "WEBP": {"method": 0},
+            "AVIF": {"speed": 10},
+        },
+    },
+    "balanced": {
+        "resample": "LANCZOS",
+        "reducing_gap": 3,
+        "jpg_draft": 2,
+        "encoder": {
+            "JPEG": {"optimize": True, "progressive": True},
+            "PNG": {"optimize": False, "compress_level": 6},
+            "WEBP": {"method": 4},
+            "AVIF": {"speed": 6},
+        },
+    },
+    "best": {
+        "resample": "LANCZOS",
+        "reducing_gap": None,
+        "jpg_draft": None,
+        "encoder": {
+            "JPEG": {"optimize": True, "progressive": True},
+            "PNG": {"optimize": True},
+            "WEBP": {"method": 6},
+            "AVIF": {"speed": 4},
+        },
+    },
+}
+
 
-def get_thumb(settings, filename):
-    """Return the path to the thumb.
+def get_thumb(settings, filename, density=1):
+    """Return the path to the thumb. With a ``density`` other than 1, return
+    the path to the HiDPI thumb, with a ``@2x`` suffix for a density of 2.
 
     examples:
     >>> default_settings = create_settings()
@@ -154,6 +220,9 @@ def get_thumb(settings, filename):
     if imgformat:
         ext = IMG_EXTENSIONS.format2ext[imgformat]
 
+    if density != 1:
+        ext = f"@{density}x{ext}"
+
     return join(
         path,
         settings["thumb_dir"],
@@ -161,6 +230,98 @@ def get_thumb(settings, filename):
     )
 
 
+def get_poster(settings, filename):
+    """Return the path to the poster image of a video.
+
+    example:
+    >>> default_settings = create_settings()
+    >>> get_poster(default_settings, "bar/foo.webm")
+    "bar/thumbnails/foo.poster.jpg"
+    """
+
+    path, filen = os.path.split(filename)
+    name = os.path.splitext(filen)[0]
+    return join(path, settings["thumb_dir"], name + ".poster.jpg")
+
+
+def get_rendition(settings, filename, size):
+    """Return the path to the rendition of the resized image for ``size``.
+
+    example:
+    >>> default_settings = create_settings()
+    >>> get_rendition(default_settings, "bar/foo.jpg", (960, 720))
+    "bar/renditions/foo_960.jpg"
+    """
+
+    path, filen = os.path.split(filename)
+    name, ext = os.path.splitext(filen)
+    return join(path, settings["renditions_dir"], f"{name}_{size[0]}{ext}")
+
+
+def get_hls(settings, filename):
+    """Return the path to the HLS master playlist of a video.
+
+    example:
+    >>> default_settings = create_settings()
+    >>> get_hls(default_settings, "bar/foo.webm")
+    "bar/hls/foo/master.m3u8"
+    """
+
+    path, filen = os.path.split(filename)
+    name = os.path.splitext(filen)[0]
+    return join(path, settings["hls_dir"], name, "master.m3u8")
+
+
+def get_tiles(settings, filename):
+    """Return the path to the DeepZoom descriptor of the tiles of an image.
+
+    example:
+    >>> default_settings = create_settings()
+    >>> get_tiles(default_settings, "bar/foo.jpg")
+    "bar/tiles/foo.dzi"
+    """
+
+    path, filen = os.path.split(filename)
+    name = os.path.splitext(filen)[0]
+    return join(path, settings["tiles_dir"], f"{name}.dzi")
+
+
+def get_variant(filename, fmt):
+    """Return the path to the variant of an image in another format.
+
+    example:
+    >>> get_variant("bar/foo.jpg", "WEBP")
+    "bar/foo.jpg.webp"
+    """
+    return filename + IMG_EXTENSIONS.format2ext[fmt.upper()]
+
+
+def get_img_variants(settings):
+    """Return a dict with the formats of ``img_variants`` and their encoder
+    options."""
+    options = settings["img_variant_options"]
+    return {
+        fmt.upper(): options.get(fmt.upper(), {}) for fmt in settings["img_variants"]
+    }
+
+
+def get_img_profile(settings):
+    """Return the image processing options for the ``img_profile`` setting.
+
+    Without profile, the ``jpg_draft`` setting is used, with the LANCZOS
+    filter and the encoder options given by the format specific settings.
+    """
+    name = settings.get("img_profile")
+    if name:
+        return IMG_PROFILES[name]
+    return {
+        "resample": "LANCZOS",
+        "reducing_gap": None,
+        "jpg_draft": settings.get("jpg_draft"),
+        "encoder": {},
+    }
+
+
 def read_settings(filename=None):
     """Read settings from a config file in the source_dir root."""
 
@@ -205,9 +366,61 @@ def read_settings(filename=None):
                     key,
                 )
 
+    if settings["img_placeholder"] not in (None, "color", "image", "blurhash"):
+        logger.error(
+            "Unknown img_placeholder %r, valid values are: color, image, blurhash",
+            settings["img_placeholder"],
+        )
+        settings["img_placeholder"] = None
+
+    if settings["img_backend"] == "vips" and find_spec("pyvips") is None:
+        logger.error("pyvips is needed for img_backend = 'vips', using Pillow")
+        settings["img_backend"] = "pillow"
+
+    if settings["animated_gif_format"] not in (None, "mp4", "webm", "webp"):
+        logger.error(
+            "Unknown animated_gif_format %r, valid values are: mp4, webm, webp",
+            settings["animated_gif_format"],
+        )
+        settings["animated_gif_format"] = None
+
+    search = settings["img_quality_search"]
+    if search:
+        if "target_size" not in search and "min_similarity" not in search:
+            logger.error(
+                "img_quality_search needs a 'target_size' or a 'min_similarity'"
+            )
+            settings["img_quality_search"] = None
+        elif "target_size" not in search and find_spec("numpy") is None:
+            logger.error("NumPy is needed for img_quality_search with min_similarity")
+            settings["img_quality_search"] = None
+
+    for fmt in settings["img_variants"]:
+        if fmt.upper() not in IMG_EXTENSIONS.format2ext:
+            logger.error("Unknown format in img_variants: %s", fmt)
+    settings["img_variants"] = [
+        fmt
+        for fmt in settings["img_variants"]
+        if fmt.upper() in IMG_EXTENSIONS.format2ext
+    ]
+
+    # sort the renditions by decreasing size, the largest is resized first
+    settings["img_renditions"] = sorted(
+        (tuple(sorted(size, reverse=True)) for size in settings["img_renditions"]),
+        reverse=True,
+    )
+
     if not settings["img_processor"]:
         logger.info("No Processor, images will not be resized")
 
+    if settings["img_profile"] and settings["img_profile"] not in IMG_PROFILES:
+        logger.error(
+            "Unknown img_profile %r, valid values are: %s",
+            settings["img_profile"],
+            ", ".join(IMG_PROFILES),
+        )
+        settings["img_profile"] = None
+
     logger.debug("Settings:\n%s", pformat(settings, width=120))
     return settings
 
@@ -6,8 +6,12 @@ album_initialized = signal("album_initialized")
 gallery_initialized = signal("gallery_initialized")
 gallery_build = signal("gallery_build")
 media_initialized = signal("media_initialized")
+media_initialized_batch = signal("media_initialized_batch")
 albums_sorted = signal("albums_sorted")
 medias_sorted = signal("medias_sorted")
 before_render = signal("before_render")
 album_file = signal("album_file")
+album_files = signal("album_files")
 process_file = signal("process_file")
+worker_initialized = signal("worker_initialized")
+worker_shutdown = signal("worker_shutdown")
@@ -54,6 +54,14 @@ img_size = (800, 600)
 # convert/resize very large images.
 # max_img_pixels = None
 
+# Memory budget in MB for the processing of the images with several
+# processes (default: None, no limit). The size of each image is read in its
+# header before the processing, and the images are processed only while their
+# estimated memory (8 bytes per pixel) stays within the budget: the small
+# images are processed while a large one waits for the memory, and an image
+# larger than the budget is processed alone.
+# memory_budget = 8000
+
 # Output format of images (default: None, i.e. use input format)
 # img_format = "JPEG"
 
@@ -85,6 +93,16 @@ img_size = (800, 600)
 # If True, EXIF data from the original image is copied to the resized image
 # copy_exif_data = False
 
+# Use the original file for the images which already fit in img_size, instead
+# of decoding and encoding them again. This is done only if the image does
+# not need to be rotated or converted to another format (img_format), if no
+# plugin modifies the resized images, if it has no EXIF data (unless
+# copy_exif_data is True), and if img_variants is not set. The value can be
+# True (or 'copy') to copy the file, 'hardlink' to create a hard link, or
+# 'reflink' to create a copy-on-write clone (Linux only, with filesystems like
+# Btrfs or XFS). Links fall back to a copy if they cannot be created.
+# copy_fitting_images = False
+
 # Python's datetime format string used for the EXIF date formatting
 # https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
 # datetime_format = '%c'
@@ -97,6 +115,92 @@ img_size = (800, 600)
 #                'optimize': True,
 #                'progressive': True}
 
+# Library used to process the images:
+# - 'pillow': the default
+# - 'vips': libvips, with pyvips, which resizes the images by streaming and
+#   decodes JPEG images at a reduced size, using much less memory and time for
+#   large images. Some features are still processed with Pillow:
+#   img_quality_search, the processors other than ResizeToFit and
+#   ResizeToFill, and thumb_fit_centering values other than (0.5, 0.5).
+# img_backend = 'pillow'
+
+# Search the quality of each JPEG or WebP resized image, instead of using the
+# same quality for all the images, with a binary search between 'min_quality'
+# and 'max_quality' (default: 40 and 95):
+# - 'target_size': the highest quality for which the image fits in this
+#   number of bytes. The budget is given for an image of img_size, and scaled
+#   with the number of pixels for smaller images and for the renditions.
+# - 'min_similarity': the lowest quality for which the structural similarity
+#   (SSIM) with the resized image is at least this value (needs NumPy).
+# The quality found for each image is stored, and reused by the next builds.
+# img_quality_search = {'target_size': 100_000, 'min_quality': 50}
+# img_quality_search = {'min_similarity': 0.95}
+
+# Decode large JPEG images directly at a reduced size (1/2, 1/4 or 1/8), using
+# the JPEG DCT scaling, before resizing them. The value is the minimum ratio
+# between the decoded size and the target size: 1 is the fastest, higher
+# values keep more details for the final resampling (2 is a good trade-off).
+# This is used for the resized images and the thumbnails. (default: None, i.e.
+# decode the full image)
+# jpg_draft = None
+
+# Image processing profile, which sets the quality/speed trade-off of the
+# resampling filter for thumbnails, the fast pre-reduction of large images,
+# the JPEG draft decoding, and the encoder effort (JPEG optimize and
+# progressive, PNG compression level, WebP method):
+# - 'fast': for quick preview builds
+# - 'balanced': good quality, several times faster than 'best'
+# - 'best': slowest, for final builds
+# - None: use the jpg_draft and jpg_options settings (default)
+# The options of the jpg_options and img_variant_options settings take
+# precedence over the encoder options of the profile, e.g. the default
+# jpg_options enable the JPEG optimize and progressive options, set
+# jpg_options = {'quality': 85} to use the ones of the profile.
+# The profile can also be set for an album with a 'Profile' key in its
+# index.md file. Images are processed again when the profile changes.
+# img_profile = None
+
+# Additional sizes of the resized images, for responsive images: the themes
+# use them in a srcset attribute so browsers can download the size that fits
+# the screen. Each size is a box like img_size, and uses the same processor.
+# All the sizes are generated from a single decoding of the original image.
+# Sizes larger than the original image are skipped.
+# img_renditions = [(480, 320), (960, 640), (1600, 1067), (2560, 1707)]
+
+# Subdirectory of the renditions
+# renditions_dir = 'renditions'
+
+# Other formats in which the resized images, their renditions and the
+# thumbnails are saved, next to the files in the main format, e.g. ['WEBP'] or
+# ['AVIF', 'WEBP'] (AVIF needs Pillow built with AVIF support). They are
+# encoded from the same image and use an additional extension (foo.jpg.webp).
+# The themes use them in <picture> elements, so browsers choose the first
+# format they support, and use the main format as fallback.
+# img_variants = []
+
+# Encoder options for each format of img_variants
+# img_variant_options = {'AVIF': {'quality': 60}, 'WEBP': {'quality': 80}}
+
+# Compute a tiny placeholder for each image, which the themes display while
+# the thumbnails are loading:
+# - 'color': the dominant color of the image
+# - 'image': a 16x16 image, inlined in the HTML pages
+# - 'blurhash': a BlurHash string (https://blurha.sh), which needs to be
+#   decoded with JavaScript in the theme
+# - None: no placeholder (default)
+# img_placeholder = None
+
+# Create DeepZoom pyramids of tiles for the very large images, which themes
+# can display with a tile viewer like OpenSeadragon to zoom in the full image.
+# The tiles are saved in tiles_dir, with a .dzi file for each image. Options,
+# with their default values:
+# - 'min_pixels': 20_000_000, the minimum size of the images
+# - 'tile_size': 254 and 'overlap': 1
+# - 'format': 'JPEG' and 'options': {'quality': 85}, format of the tiles
+# - 'threads': 4, number of threads in each worker to save the tiles
+# img_tiles = {'min_pixels': 50_000_000}
+# tiles_dir = 'tiles'
+
 # --------------------
 # Thumbnail generation
 # --------------------
@@ -116,6 +220,10 @@ img_size = (800, 600)
 # For the colorbox and photoswipe theme, use 200 px for the width
 thumb_size = (280, 210)
 
+# Additional pixel densities of the thumbnails for HiDPI screens, e.g. [2] to
+# generate thumbnails twice as large as thumb_size, with a '@2x' suffix.
+# thumb_densities = []
+
 # Crop the image to fill the box
 # thumb_fit = True
 
@@ -124,15 +232,27 @@ thumb_size = (280, 210)
 # http://pillow.readthedocs.io/en/stable/reference/ImageOps.html#PIL.ImageOps.fit
 # thumb_fit_centering = (0.5, 0.5)
 
+# Create the thumbnails from the preview embedded in the EXIF data of the
+# images, when it is at least as large as the thumbnail and has the same aspect
+# ratio. Otherwise the image is decoded as usual. With use_orig = True, the
+# images are not decoded at all, for a quick preview build.
+# thumb_exif_preview = False
+
 # Delay in seconds to avoid black thumbnails in videos with fade-in
 # thumb_video_delay = 0
-# Max retries to generate a non-black thumbnail
+# Max retries to generate a non-black thumbnail. The frames for all the retries
+# are extracted at once, with a single ffmpeg process.
 # thumb_video_black_retries = 0
 # For each retry, advance another N seconds on top of original delay
 # thumb_video_black_retry_offset = 1
 # A thumbnail with more than max_colors will not be considered "all black"
 # thumb_video_black_max_colors = 4
 
+# Save the frame used for the thumbnail of the videos with its full size, in
+# the thumbnails directory, for the poster attribute of the <video> element.
+# The frames are extracted by the ffmpeg process which converts the video.
+# video_poster = False
+
 # Keep original image (default: False)
 # keep_orig = False
 
@@ -175,6 +295,11 @@ ignore_files = []
 # Video converter binary (can be 'avconv' on certain GNU/Linux distributions)
 # video_converter = 'ffmpeg'
 
+# Video prober used to read the size, rotation, duration and creation time
+# of the videos. If it is not installed, this information is read with
+# video_converter.
+# video_prober = 'ffprobe'
+
 # File extensions that should be treated as video files
 # video_extensions = ['.mov', '.avi', '.mp4', '.webm', '.ogv', '.3gp']
 
@@ -193,6 +318,8 @@ ignore_files = []
 # Webm options for 2-pass encoding
 # Options used to encode the webm video on the second pass.
 # Set to None by default, set to an array if a second pass is desired.
+# The statistics of the first pass are written in a temporary directory for
+# each video (with -passlogfile), so several videos can be encoded in parallel.
 # webm_options_second_pass = None
 
 
@@ -212,10 +339,53 @@ ignore_files = []
 # video_size = (480, 360)
 
 # If the desired video extension and filename are the same, the video will
-# not be converted. If a transcode to different quality is required,
-# set this to True to force convert it. False by default.
+# not be converted. Likewise, if the codecs of the video can be used in the
+# desired format (e.g. H.264 and AAC for mp4), the streams are copied in the
+# new container without conversion. If a transcode to different quality is
+# required, set this to True to force convert it. False by default.
 # video_always_convert = False
 
+# Stop the ffmpeg processes which take more than 60s plus video_timeout_factor
+# times the duration of the video, e.g. for a corrupted file which blocks
+# ffmpeg. The default is to not stop them.
+# video_timeout_factor = 20
+
+# Create HLS renditions of the videos (adaptive streaming), in addition to the
+# converted video which is used as a fallback by the browsers without HLS
+# support. The renditions are encoded with H.264 and AAC, in a subdirectory of
+# hls_dir for each video, with a master playlist. Options, with their default
+# values:
+# - 'renditions': [(360, '800k', '96k'), (720, '2800k', '128k')], the height
+#   and the video and audio bit rates of the renditions. The renditions larger
+#   than the video are skipped.
+# - 'segment_duration': 6, duration of the segments in seconds
+# - 'options': ['-preset', 'veryfast'], other options for the encoder
+# video_hls = {'segment_duration': 4}
+# hls_dir = 'hls'
+
+# Encode the long videos in segments, at the same time, which are then
+# concatenated without conversion. The encoded segments are kept until the
+# video is complete, so an interrupted build resumes with the missing segments.
+# Options, with their default values:
+# - 'min_duration': 600, the minimum duration of the videos, in seconds
+# - 'segment_duration': 60, the approximative duration of the segments
+# - 'jobs': None, number of segments encoded at the same time in each worker
+#   (the default is the number of CPUs divided by the number of processes, so
+#   that the segments of several videos do not use more than all the CPUs)
+# video_chunks = {'min_duration': 300}
+
+# Process the videos in the main process, with threads which wait for ffmpeg
+# while the process pool resizes the images. At most video_jobs ffmpeg
+# processes run at the same time. The default is to process the videos with
+# the images, in the process pool.
+# video_jobs = 4
+
+# Convert the animated GIFs, which can be very large, to a video ('mp4' or
+# 'webm', with the options above) or to an animated WebP image ('webp'). The
+# converted GIFs are resized to video_size (or img_size for WebP), and the
+# themes play them in a loop. Static GIFs are still copied as images.
+# animated_gif_format = None
+
 # -------------
 # Miscellaneous
 # -------------
@@ -23,18 +23,22 @@ import logging
 import os
 import shutil
 import sys
+from collections import OrderedDict
 from fnmatch import fnmatch
 from functools import lru_cache
 from urllib.parse import quote
 
 from markdown import Markdown
 from markupsafe import Markup
+from PIL import Image as PILImage
 
 from sigal.settings import Status
 
 logger = logging.getLogger(__name__)
 MD = None
 VIDEO_MIMES = {".mp4": "video/mp4", ".webm": "video/webm", ".ogv": "video/ogg"}
+# ioctl request to clone a file on Linux (copy-on-write)
+FICLONE = 0x40049409
 
 
 class Devnull:
@@ -64,6 +68,110 @@ def copy(src, dst, symlink=False, rellink=False):
             func(src, dst)
 
 
+def _resource_size(value):
+    """Memory used by a resource, in bytes: the pixels for the images, which
+    are the largest resources."""
+    if isinstance(value, PILImage.Image):
+        return value.width * value.height * len(value.getbands())
+    return sys.getsizeof(value)
+
+
+class ResourceCache:
+    """Size-bounded cache for the resources shared by the medias processed in
+    a process (fonts, decoded overlays, ...).
+
+    The least recently used entries are evicted when more than ``maxsize``
+    resources are stored, or when the resources use more than ``maxbytes``
+    bytes (the size of the pixels for the images). The last resource is kept
+    even if it is larger than ``maxbytes``. Each worker process has its own
+    instance, which is cleared when the worker shuts down.
+
+    """
+
+    def __init__(self, maxsize=64, maxbytes=128 * 2**20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, factory):
+        """Return the resource stored for ``key``, calling ``factory()`` to
+        create it if it is not in the cache.
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            value = self._data[key] = factory()
+            self._sizes[key] = _resource_size(value)
+            self.nbytes += self._sizes[key]
+            while len(self._data) > 1 and (
+                len(self._data) > self.maxsize or self.nbytes > self.maxbytes
+            ):
+                old_key, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(old_key)
+        else:
+            self._data.move_to_end(key)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+
+#: Cache for the resources of the current process, see :class:`ResourceCache`.
+resource_cache = ResourceCache()
+
+
+def link_or_copy(src, dst, method="copy"):
+    """Copy the file, or create a hard link (``method="hardlink"``) or a
+    copy-on-write clone (``method="reflink"``, only on Linux with a supported
+    filesystem). If the link cannot be created, the file is copied.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if method == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            logger.debug("Could not create a hard link for %s: %s", dst, e)
+    elif method == "reflink":
+        try:
+            import fcntl
+
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return
+        except (ImportError, OSError) as e:
+            logger.debug("Could not create a reflink for %s: %s", dst, e)
+            if os.path.lexists(dst):
+                os.remove(dst)
+
+    shutil.copy2(src, dst)
+
+
+def remove_if_shared(path):
+    """Remove the file if it is a link to another file (symbolic or hard
+    link), to avoid modifying the source file when writing the output.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if os.path.islink(path) or st.st_nlink > 1:
+        os.remove(path)
+
+
 def check_or_create_dir(path):
     "Create the directory if it does not exist"
 
@@ -20,16 +20,26 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import asyncio
+import hashlib
+import json
 import logging
 import os
 import re
 import shutil
 import subprocess
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 from os.path import splitext
 
 from PIL import Image as PILImage
+from PIL import ImageStat
+from pilkit.utils import save_image
 
 from . import image, utils
+from .settings import get_hls
 from .utils import is_valid_html5_video
 
 
@@ -37,56 +47,336 @@ class SubprocessException(Exception):
     pass
 
 
-def check_subprocess(cmd, source, outname=None):
+#: Function called with the name of the output and the percentage of the
+#: video processed by ffmpeg, set by the gallery to display the progress
+progress_handler = None
+
+#: Number of processes which process the videos at the same time, set by the
+#: gallery, to share the CPUs between the segments of the long videos
+processes = 1
+
+# Number of lines kept from the output of ffmpeg, for the error messages
+STDERR_LINES = 100
+
+PROGRESS_LINE = re.compile(rb"^\w+=\S*$")
+PROGRESS_TIME = re.compile(rb"^out_time_us=(\d+)$")
+
+
+def get_timeout(settings, duration):
+    """Return the maximum duration of an ffmpeg process for a video, with the
+    ``video_timeout_factor`` setting, or None."""
+    factor = settings.get("video_timeout_factor")
+    if not factor or not duration:
+        return None
+    return 60 + factor * duration
+
+
+def _remove_output(outname):
+    logger = logging.getLogger(__name__)
+    if outname and os.path.isfile(outname):
+        logger.debug("Removing file %s", outname)
+        os.remove(outname)
+
+
+def get_tmp_output(outname):
+    """Return the temporary name used while ``outname`` is created, a hidden
+    file in the same directory, with the same extension."""
+    path, filename = os.path.split(outname)
+    name, ext = splitext(filename)
+    return os.path.join(path, f".{name}.tmp{ext}")
+
+
+class SubprocessRunner:
+    """Run the subprocesses with asyncio, in an event loop running in a
+    separate thread, with at most ``max_jobs`` subprocesses at the same time.
+
+    This is used to process many videos with threads of the main process,
+    which wait for ffmpeg without using a worker of the process pool.
+    """
+
+    def __init__(self, max_jobs):
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = asyncio.Semaphore(max_jobs)
+        self.closed = False
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def _limited(self, coro):
+        async with self.semaphore:
+            return await coro
+
+    def run(self, coro):
+        """Run the coroutine in the event loop, and return its result.
+
+        :raise CancelledError: if the runner is cancelled
+        """
+        with self._lock:
+            if self.closed:
+                coro.close()
+                raise CancelledError("The subprocess runner is closed")
+            future = asyncio.run_coroutine_threadsafe(self._limited(coro), self.loop)
+        return future.result()
+
+    async def _cancel_tasks(self):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def cancel(self):
+        """Stop the running subprocesses. The subprocesses which are run
+        after are cancelled."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self.loop).result()
+
+    def close(self):
+        """Stop the running subprocesses, and the event loop."""
+        self.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+#: SubprocessRunner used to run the subprocesses, set by the gallery when the
+#: videos are processed in the main process. If it is None, each subprocess
+#: runs in its own event loop.
+runner = None
+
+
+async def _run_process(cmd, name, duration=None, timeout=None, max_lines=None):
+    """Run the command, and return its return code, its output and the last
+    ``max_lines`` lines of its error output. The progress of ffmpeg is sent to
+    :data:`progress_handler` if the duration is given."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stderr = deque(maxlen=max_lines)
+    percent = None
+
+    def handle_line(line):
+        nonlocal percent
+        if not duration or not PROGRESS_LINE.match(line):
+            stderr.append(line)
+        elif (match := PROGRESS_TIME.match(line)) and progress_handler:
+            new_percent = min(int(int(match.group(1)) / duration / 1e4), 100)
+            if new_percent != percent:
+                percent = new_percent
+                progress_handler(name, percent)
+
+    async def read_stderr():
+        # the lines are read by chunks, as the statistics of ffmpeg are
+        # written on a single line which can be very long
+        buffer = b""
+        while chunk := await proc.stderr.read(1 << 16):
+            *lines, buffer = re.split(rb"[\r\n]", buffer + chunk)
+            for line in lines:
+                handle_line(line)
+        if buffer:
+            handle_line(buffer)
+
+    try:
+        async with asyncio.timeout(timeout):
+            stdout, _ = await asyncio.gather(proc.stdout.read(), read_stderr())
+            returncode = await proc.wait()
+    except BaseException:
+        # timeout, or cancelled with Ctrl-C
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    return returncode, stdout, stderr
+
+
+def run_process(cmd, name=None, duration=None, timeout=None, max_lines=None):
+    """Run the command with asyncio, with :data:`runner` if it is set, and
+    return the completed process."""
+    coro = _run_process(
+        cmd, name, duration=duration, timeout=timeout, max_lines=max_lines
+    )
+    if runner is not None:
+        returncode, stdout, stderr = runner.run(coro)
+    else:
+        returncode, stdout, stderr = asyncio.run(coro)
+    return subprocess.CompletedProcess(
+        cmd, returncode, stdout=stdout, stderr=b"\n".join(stderr)
+    )
+
+
+def check_subprocess(cmd, source, outname=None, duration=None, timeout=None):
     """Run the command to resize the video and remove the output file if the
-    processing fails.
+    processing fails, is interrupted or takes more than ``timeout`` seconds.
+    Return the completed process, with only the last lines of its error
+    output.
 
+    :param duration: duration of the video processed by ffmpeg, the progress
+        is then sent to :data:`progress_handler`
     """
     logger = logging.getLogger(__name__)
+    if duration:
+        cmd = [cmd[0], "-progress", "pipe:2", "-nostats"] + cmd[1:]
     try:
-        res = subprocess.run(cmd, capture_output=True)
-    except KeyboardInterrupt:
+        res = run_process(
+            cmd,
+            name=os.path.basename(outname or source),
+            duration=duration,
+            timeout=timeout,
+            max_lines=STDERR_LINES,
+        )
+    except TimeoutError:
+        _remove_output(outname)
+        raise SubprocessException(
+            f"Failed to process {source}: timeout after {timeout:.0f}s"
+        ) from None
+    except (KeyboardInterrupt, asyncio.CancelledError, CancelledError):
         logger.debug("Process terminated, removing file %s", outname)
-        if outname and os.path.isfile(outname):
-            os.remove(outname)
+        _remove_output(outname)
         raise
 
     if res.returncode:
-        logger.debug("STDOUT:\n %s", res.stdout.decode("utf8"))
-        logger.debug("STDERR:\n %s", res.stderr.decode("utf8"))
-        if outname and os.path.isfile(outname):
-            logger.debug("Removing file %s", outname)
-            os.remove(outname)
+        logger.debug("STDERR:\n %s", res.stderr.decode("utf8", errors="replace"))
+        _remove_output(outname)
         raise SubprocessException("Failed to process " + source)
+    return res
 
 
-def video_size(source, converter="ffmpeg"):
-    """Return the dimensions of the video."""
-    res = subprocess.run([converter, "-i", source], stderr=subprocess.PIPE)
-    stderr = res.stderr.decode("utf8", errors="ignore")
-    pattern = re.compile(r"Stream.*Video.* ([0-9]+)x([0-9]+)")
-    match = pattern.search(stderr)
-    rot_pattern = re.compile(r"rotate\s*:\s*-?(90|270)")
-    rot_match = rot_pattern.search(stderr)
-
-    if match:
-        x, y = int(match.groups()[0]), int(match.groups()[1])
+# Information returned by probe_video when the video cannot be read
+EMPTY_PROBE = {
+    "width": 0,
+    "height": 0,
+    "rotation": 0,
+    "duration": None,
+    "video_codec": None,
+    "pix_fmt": None,
+    "audio_codec": None,
+    "bit_rate": None,
+    "creation_time": None,
+}
+
+
+def _to_number(value, type_=float):
+    try:
+        return type_(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_ffprobe(data):
+    """Extract the information used by sigal from the JSON output of
+    ffprobe."""
+    streams = data.get("streams", [])
+    fmt = data.get("format", {})
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+
+    # the rotation is stored in a rotate tag with older ffmpeg versions, and
+    # in the display matrix side data with the recent ones
+    rotation = _to_number(video.get("tags", {}).get("rotate"), int)
+    if rotation is None:
+        rotation = next(
+            (
+                int(side_data["rotation"])
+                for side_data in video.get("side_data_list", [])
+                if "rotation" in side_data
+            ),
+            0,
+        )
+
+    creation_time = fmt.get("tags", {}).get("creation_time") or video.get(
+        "tags", {}
+    ).get("creation_time")
+    return {
+        "width": video.get("width", 0),
+        "height": video.get("height", 0),
+        "rotation": rotation,
+        "duration": _to_number(fmt.get("duration") or video.get("duration")),
+        "video_codec": video.get("codec_name"),
+        "pix_fmt": video.get("pix_fmt"),
+        "audio_codec": audio.get("codec_name"),
+        "bit_rate": _to_number(fmt.get("bit_rate"), int),
+        "creation_time": creation_time,
+    }
+
+
+def _parse_ffmpeg(stderr):
+    """Extract the information from the output of ``ffmpeg -i``, which is used
+    when ffprobe is not available."""
+    info = dict(EMPTY_PROBE)
+    if match := re.search(r"Stream.*Video: (\w+).* ([0-9]+)x([0-9]+)", stderr):
+        info["video_codec"] = match.group(1)
+        info["width"], info["height"] = int(match.group(2)), int(match.group(3))
+    if match := re.search(r"Stream.*Video: \w+[^,]*, (\w+)", stderr):
+        info["pix_fmt"] = match.group(1)
+    if match := re.search(r"Stream.*Audio: (\w+)", stderr):
+        info["audio_codec"] = match.group(1)
+    if match := re.search(r"rotate\s*:\s*(-?\d+)", stderr):
+        info["rotation"] = int(match.group(1))
+    elif match := re.search(r"rotation of (-?[\d.]+) degrees", stderr):
+        info["rotation"] = int(float(match.group(1)))
+    if match := re.search(r"Duration: (\d+):(\d+):([\d.]+)", stderr):
+        h, m, s = match.groups()
+        info["duration"] = int(h) * 3600 + int(m) * 60 + float(s)
+    if match := re.search(r"bitrate: (\d+) kb/s", stderr):
+        info["bit_rate"] = int(match.group(1)) * 1000
+    if match := re.search(r"creation_time\s*:\s*(\S+)", stderr):
+        info["creation_time"] = match.group(1)
+    return info
+
+
+def probe_video(source, converter="ffmpeg", prober="ffprobe"):
+    """Return the dimensions, rotation, duration (in seconds), codecs, pixel
+    format, bit rate and creation time of the video, read with ffprobe. The
+    dimensions are the displayed ones, i.e. they are swapped for videos
+    rotated by 90 degrees.
+
+    If ffprobe is not installed, the information is parsed from the output of
+    ``ffmpeg -i``.
+
+    """
+    logger = logging.getLogger(__name__)
+    cmd = [prober, "-v", "error", "-print_format", "json"]
+    cmd += ["-show_format", "-show_streams", source]
+    try:
+        res = run_process(cmd)
+    except FileNotFoundError:
+        logger.debug("%s is not installed, using %s -i", prober, converter)
+        res = run_process([converter, "-i", source])
+        info = _parse_ffmpeg(res.stderr.decode("utf8", errors="ignore"))
     else:
-        x = y = 0
-    if rot_match:
-        x, y = y, x
-    return x, y
+        try:
+            info = _parse_ffprobe(json.loads(res.stdout))
+        except ValueError:
+            info = dict(EMPTY_PROBE)
+        if res.returncode:
+            logger.debug("Failed to probe %s: %s", source, res.stderr.decode("utf8"))
 
+    if abs(info["rotation"]) % 180 == 90:
+        info["width"], info["height"] = info["height"], info["width"]
+    return info
 
-def get_resize_options(source, converter, output_size):
+
+def video_size(source, converter="ffmpeg", prober="ffprobe"):
+    """Return the dimensions of the video."""
+    info = probe_video(source, converter=converter, prober=prober)
+    return info["width"], info["height"]
+
+
+def get_resize_options(source, converter, output_size, probe=None):
     """Figure out resize options for video from src and dst sizes.
 
     :param source: path to a video
-    :param outname: path to the generated video
-    :param settings: settings dict
+    :param converter: path to ffmpeg
+    :param output_size: maximum size of the video
+    :param probe: information returned by :func:`probe_video`, the video is
+        probed if it is not given
     """
     logger = logging.getLogger(__name__)
-    w_src, h_src = video_size(source, converter=converter)
+    if probe is None:
+        probe = probe_video(source, converter=converter)
+    w_src, h_src = probe.get("width", 0), probe.get("height", 0)
     w_dst, h_dst = output_size
     logger.debug("Video size: %i, %i -> %i, %i", w_src, h_src, w_dst, h_dst)
 
@@ -106,50 +396,313 @@ def get_resize_options(source, converter, output_size):
     return resize_opt
 
 
+# Codecs which can be copied in the output formats, without conversion: video
+# codecs, pixel formats and audio codecs supported by the browsers
+REMUX_CODECS = {
+    "mp4": ({"h264"}, {"yuv420p", "yuvj420p"}, {"aac", "mp3"}),
+    "webm": ({"vp8", "vp9", "av1"}, {"yuv420p"}, {"vorbis", "opus"}),
+}
+
+
+def can_remux(probe, video_format):
+    """Return True if the streams of the video can be copied in the
+    ``video_format`` container, without conversion."""
+    if video_format not in REMUX_CODECS or not probe.get("video_codec"):
+        return False
+    video_codecs, pix_fmts, audio_codecs = REMUX_CODECS[video_format]
+    return (
+        probe["video_codec"] in video_codecs
+        and probe.get("pix_fmt") in pix_fmts
+        and probe.get("audio_codec") in audio_codecs | {None}
+    )
+
+
+def remux_video(
+    source, outname, video_format, converter="ffmpeg", duration=None, timeout=None
+):
+    """Copy the video and audio streams in a new container."""
+    logger = logging.getLogger(__name__)
+    cmd = [converter, "-i", source, "-y", "-map", "0:v:0", "-map", "0:a:0?"]
+    cmd += ["-c", "copy"]
+    if video_format == "mp4":
+        cmd += ["-movflags", "+faststart"]
+    cmd += [outname]
+    logger.debug("Remuxing video: %s", " ".join(cmd))
+    check_subprocess(cmd, source, outname=outname, duration=duration, timeout=timeout)
+
+
 def _get_empty_if_none_else_variable(variable):
     return [] if not variable else variable
 
 
-def generate_video_pass(converter, source, options, outname=None):
+def generate_video_pass(
+    converter,
+    source,
+    options,
+    outname=None,
+    passlogfile=None,
+    input_options=None,
+    duration=None,
+    timeout=None,
+    outputs=None,
+):
     """Run a single pass of encoding.
 
     :param source: source video
     :param options: options to pass to encoder
     :param outname: if multi-pass, this is None on the first pass
+    :param passlogfile: prefix of the log files of the multi-pass encoding
+    :param input_options: options for the source, e.g. to seek in the video
+    :param duration: duration of the encoded video, to show the progress
+    :param timeout: maximum duration of the encoding, in seconds
+    :param outputs: options of other outputs, after the encoded video
     """
     logger = logging.getLogger(__name__)
     outname_opt = [] if not outname else [outname]
     # Encoding options improved, thanks to
     # http://ffmpeg.org/trac/ffmpeg/wiki/vpxEncodingGuide
-    cmd = [converter, "-i", source, "-y"]  # -y to overwrite output files
-    cmd += options + outname_opt
+    cmd = [converter] + (input_options or [])
+    cmd += ["-i", source, "-y"]  # -y to overwrite output files
+    if passlogfile:
+        cmd += ["-passlogfile", passlogfile]
+    cmd += options + outname_opt + (outputs or [])
     logger.debug("Processing video: %s", " ".join(cmd))
-    check_subprocess(cmd, source, outname=outname)
+    return check_subprocess(
+        cmd, source, outname=outname, duration=duration, timeout=timeout
+    )
+
+
+def encode_video(
+    converter,
+    source,
+    outname,
+    options,
+    second_pass_options=None,
+    input_options=None,
+    duration=None,
+    timeout=None,
+    outputs=None,
+):
+    """Encode the video, with one or two passes.
+
+    :param options: encoder options for the first pass
+    :param second_pass_options: encoder options for the second pass, or None
+        to encode with a single pass
+    :param input_options: options for the source, e.g. to seek in the video
+    :param duration: duration of the encoded video, to show the progress
+    :param timeout: maximum duration of each pass, in seconds
+    :param outputs: options of other outputs written by the last pass, which
+        decodes the source only once for all the outputs
+    :return: the completed process of the last pass
+    """
+    kwargs = {"input_options": input_options, "duration": duration, "timeout": timeout}
+    if not second_pass_options:
+        return generate_video_pass(
+            converter, source, options, outname, outputs=outputs, **kwargs
+        )
+
+    # the statistics of the first pass are written in a temporary directory
+    # for each video, as several videos can be converted at the same time, and
+    # removed even if the conversion fails or is interrupted
+    with tempfile.TemporaryDirectory(prefix="sigal-2pass-") as tmpdir:
+        passlogfile = os.path.join(tmpdir, "ffmpeg2pass")
+        generate_video_pass(
+            converter, source, options, passlogfile=passlogfile, **kwargs
+        )
+        return generate_video_pass(
+            converter,
+            source,
+            second_pass_options,
+            outname,
+            passlogfile=passlogfile,
+            outputs=outputs,
+            **kwargs,
+        )
+
+
+CHUNKS_DEFAULTS = {"min_duration": 600, "segment_duration": 60, "jobs": None}
+
+# Encoder options which are used for the audio stream when the
+# segments are concatenated
+AUDIO_OPTIONS = ("-c:a", "-codec:a", "-acodec", "-b:a", "-ab", "-ar", "-ac")
+
+
+def get_chunks_jobs(chunks):
+    """Return the number of segments encoded at the same time by a process,
+    with the ``jobs`` option of ``video_chunks``, or the number of CPUs shared
+    by the processes."""
+    return chunks["jobs"] or max(1, (os.cpu_count() or 1) // max(processes, 1))
+
+
+def _segments(duration, segment_duration):
+    """Return the start and the duration of segments of about
+    ``segment_duration`` seconds. The last segment goes until the end of the
+    video, so its duration is None."""
+    count = max(1, round(duration / segment_duration))
+    step = duration / count
+    return [(i * step, step if i < count - 1 else None) for i in range(count)]
+
+
+def _audio_options(options):
+    audio_options = []
+    for opt, value in zip(options, options[1:]):
+        if opt in AUDIO_OPTIONS:
+            audio_options += [opt, value]
+    return audio_options
+
+
+def generate_video_chunks(
+    source,
+    outname,
+    settings,
+    duration,
+    options,
+    second_pass_options=None,
+    video_format=None,
+):
+    """Encode a long video in segments, at the same time, and concatenate
+    them without conversion.
+
+    The video of each segment is encoded from the source, with an accurate
+    seek (ffmpeg decodes from the previous keyframe), so the segments start
+    with a keyframe and can be concatenated. The audio is encoded once for the
+    whole video while concatenating. The segments are kept in a
+    ``.<name>.parts`` directory until the video is complete, so an
+    interrupted conversion resumes with the missing segments.
+
+    :param duration: duration of the video, in seconds
+    :param options: encoder options, with the resizing options
+    :param second_pass_options: encoder options for the second pass
+    """
+    logger = logging.getLogger(__name__)
+    chunks = {**CHUNKS_DEFAULTS, **settings["video_chunks"]}
+    converter = settings["video_converter"]
+    outdir, filename = os.path.split(outname)
+    ext = splitext(filename)[1]
+    parts_dir = os.path.join(outdir, f".{filename}.parts")
+    os.makedirs(parts_dir, exist_ok=True)
+
+    stat = os.stat(source)
+    segments = []
+    for i, (start, length) in enumerate(
+        _segments(duration, chunks["segment_duration"])
+    ):
+        key = [stat.st_size, stat.st_mtime_ns, options, second_pass_options]
+        key += [start, length]
+        digest = hashlib.md5(
+            json.dumps(key).encode(), usedforsecurity=False
+        ).hexdigest()[:10]
+        segments.append(
+            (os.path.join(parts_dir, f"{i:04d}-{digest}{ext}"), start, length)
+        )
 
+    # remove the segments of a previous version of the video
+    names = {os.path.basename(path) for path, _, _ in segments}
+    for name in os.listdir(parts_dir):
+        if name not in names:
+            os.remove(os.path.join(parts_dir, name))
 
-def generate_video(source, outname, settings):
+    def encode_segment(segment):
+        path, start, length = segment
+        if os.path.isfile(path):
+            logger.debug("Segment %s is already encoded", path)
+            return
+        segment_options = ["-an"]
+        if length is not None:
+            segment_options += ["-t", f"{length:.6f}"]
+        else:
+            length = duration - start
+        # the segment is renamed when it is complete, to not reuse a partial
+        # segment if the processing is interrupted
+        tmpname = path[: -len(ext)] + ".tmp" + ext
+        second_pass = None
+        if second_pass_options:
+            second_pass = segment_options + second_pass_options
+        encode_video(
+            converter,
+            source,
+            tmpname,
+            segment_options + options,
+            second_pass_options=second_pass,
+            input_options=["-ss", f"{start:.6f}"],
+            duration=length,
+            timeout=get_timeout(settings, length),
+        )
+        os.replace(tmpname, path)
+
+    logger.debug("Encoding %s in %d segments", source, len(segments))
+    with ThreadPoolExecutor(get_chunks_jobs(chunks)) as executor:
+        list(executor.map(encode_segment, segments))
+
+    listfile = os.path.join(parts_dir, "segments.txt")
+    with open(listfile, "w") as f:
+        for path, _, _ in segments:
+            # escape the quotes for the concat demuxer
+            name = os.path.basename(path).replace("'", "'\\''")
+            f.write(f"file '{name}'\n")
+
+    cmd = [converter, "-y", "-f", "concat", "-safe", "0", "-i", listfile]
+    cmd += ["-i", source, "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy"]
+    cmd += _audio_options(second_pass_options or options)
+    if video_format == "mp4":
+        cmd += ["-movflags", "+faststart"]
+    cmd += [outname]
+    logger.debug("Concatenating video segments: %s", " ".join(cmd))
+    check_subprocess(
+        cmd,
+        source,
+        outname=outname,
+        duration=duration,
+        timeout=get_timeout(settings, duration),
+    )
+    shutil.rmtree(parts_dir)
+
+
+def generate_video(
+    source, outname, settings, video_format=None, probe=None, frames=None
+):
     """Video processor.
 
     :param source: path to a video
     :param outname: path to the generated video
     :param settings: settings dict
-    :param options: array of options passed to ffmpeg
+    :param video_format: format of the video, the default is to use the
+        ``video_format`` setting
+    :param probe: information returned by :func:`probe_video`
+    :param frames: ``(delay, count, interval)`` to extract frames of the
+        video, see :func:`extract_frames`, with the same ffmpeg process which
+        encodes the video
+    :return: the extracted frames, or None if the video was not encoded with
+        a single ffmpeg process (i.e. copied, remuxed or encoded in segments)
 
     """
     logger = logging.getLogger(__name__)
 
-    video_format = settings.get("video_format")
+    video_format = video_format or settings.get("video_format")
     options = settings.get(video_format + "_options")
     second_pass_options = settings.get(video_format + "_options_second_pass")
     video_always_convert = settings.get("video_always_convert")
     converter = settings["video_converter"]
 
+    base, src_ext = splitext(source)
+    base, dst_ext = splitext(outname)
+    if probe is None and src_ext.lower() != ".gif":
+        probe = probe_video(source, converter=converter)
+    duration = (probe or {}).get("duration")
+
     resize_opt = []
     if settings.get("video_size"):
-        resize_opt = get_resize_options(source, converter, settings["video_size"])
+        resize_opt = get_resize_options(
+            source, converter, settings["video_size"], probe=probe
+        )
 
-    base, src_ext = splitext(source)
-    base, dst_ext = splitext(outname)
+    if src_ext.lower() == ".gif":
+        # animated GIFs have no audio, and H.264 needs even dimensions and a
+        # subsampled pixel format to be played by the browsers
+        resize_opt = resize_opt or ["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"]
+        resize_opt = resize_opt + ["-an", "-pix_fmt", "yuv420p"]
+        if video_format == "mp4":
+            resize_opt += ["-movflags", "+faststart"]
 
     if dst_ext == src_ext and not resize_opt and not video_always_convert:
         logger.debug(
@@ -162,15 +715,300 @@ def generate_video(source, outname, settings):
         shutil.copy(source, outname)
         return
 
+    if not resize_opt and not video_always_convert and can_remux(probe, video_format):
+        logger.debug(
+            "For %s, the codecs and size of the source can be used for %s, "
+            "so the streams are copied without conversion",
+            outname,
+            video_format,
+        )
+        remux_video(
+            source,
+            outname,
+            video_format,
+            converter=converter,
+            duration=duration,
+            timeout=get_timeout(settings, duration),
+        )
+        return
+
     final_pass_options = _get_empty_if_none_else_variable(options) + resize_opt
+    final_second_pass_options = None
     if second_pass_options:
-        generate_video_pass(converter, source, final_pass_options)
         final_second_pass_options = (
             _get_empty_if_none_else_variable(second_pass_options) + resize_opt
         )
-        generate_video_pass(converter, source, final_second_pass_options, outname)
+
+    chunks = settings.get("video_chunks")
+    if (
+        chunks
+        and duration
+        and duration >= chunks.get("min_duration", CHUNKS_DEFAULTS["min_duration"])
+    ):
+        generate_video_chunks(
+            source,
+            outname,
+            settings,
+            duration,
+            final_pass_options,
+            second_pass_options=final_second_pass_options,
+            video_format=video_format,
+        )
+    else:
+        outputs = None
+        if frames:
+            # the frames are written by a second output, with the full size
+            # of the source, from the decoded frames used for the encoding
+            delay, count, interval = frames
+            outputs = ["-map", "0:v:0", "-ss", str(delay)]
+            outputs += _frames_output(count=count, interval=interval)
+        res = encode_video(
+            converter,
+            source,
+            outname,
+            final_pass_options,
+            second_pass_options=final_second_pass_options,
+            duration=duration,
+            timeout=get_timeout(settings, duration),
+            outputs=outputs,
+        )
+        if frames:
+            return _read_frames(res.stdout)
+
+
+HLS_DEFAULTS = {
+    "renditions": [(360, "800k", "96k"), (720, "2800k", "128k")],
+    "segment_duration": 6,
+    "options": ["-preset", "veryfast"],
+}
+
+HLS_STATE = "hls.json"
+
+
+def _bitrate(value):
+    """Convert a bit rate like ``"800k"`` to bits per second."""
+    value = str(value)
+    units = {"k": 1_000, "M": 1_000_000}
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def _hls_renditions(renditions, width, height):
+    """Return the name, size and bit rates of the renditions for a video of
+    the given size. The renditions larger than the video are skipped, and
+    the smallest one is used at the size of the video if they are all
+    larger."""
+    renditions = sorted(renditions)
+    kept = [r for r in renditions if r[0] <= height]
+    if not kept:
+        kept = [(height, *renditions[0][1:])]
+    result = []
+    for h, video_rate, audio_rate in kept:
+        # the dimensions of H.264 videos must be even
+        w = round(width * h / height / 2) * 2
+        h = round(h / 2) * 2
+        result.append((f"{h}p", w, h, video_rate, audio_rate))
+    return result
+
+
+def generate_hls(source, outname, settings, probe):
+    """Create the HLS renditions of the video, with a master playlist.
+
+    The renditions are encoded with a single ffmpeg process, with an output
+    for each rendition. The settings used for each rendition are stored in a
+    ``hls.json`` file, so that only the renditions which changed are encoded
+    again.
+
+    :param outname: path of the master playlist, the renditions are created
+        in sub-directories of its directory
+    :param probe: information returned by :func:`probe_video`
+    :return: the names of the renditions, or None if the size of the video is
+        unknown
+    """
+    logger = logging.getLogger(__name__)
+    options = {**HLS_DEFAULTS, **settings["video_hls"]}
+    if not probe.get("height"):
+        logger.warning("Unknown size, no HLS renditions for %s", source)
+        return None
+
+    hls_dir = os.path.dirname(outname)
+    state_path = os.path.join(hls_dir, HLS_STATE)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    stat = os.stat(source)
+    seg = options["segment_duration"]
+    renditions = _hls_renditions(
+        options["renditions"], probe.get("width", 0), probe["height"]
+    )
+    keys = {
+        name: [stat.st_size, stat.st_mtime_ns, w, h, vrate, arate, seg]
+        + list(options["options"])
+        for name, w, h, vrate, arate in renditions
+    }
+    pending = [
+        r
+        for r in renditions
+        if state.get(r[0]) != keys[r[0]]
+        or not os.path.isfile(os.path.join(hls_dir, r[0], "index.m3u8"))
+    ]
+
+    # remove the renditions which are not used anymore
+    if os.path.isdir(hls_dir):
+        for name in os.listdir(hls_dir):
+            path = os.path.join(hls_dir, name)
+            if os.path.isdir(path) and name not in keys:
+                shutil.rmtree(path)
+
+    if pending:
+        labels = "".join(f"[v{i}]" for i in range(len(pending)))
+        filters = [f"[0:v]split={len(pending)}{labels}"]
+        filters += [
+            f"[v{i}]scale={w}:{h}[out{i}]" for i, (_, w, h, _, _) in enumerate(pending)
+        ]
+        cmd = [settings["video_converter"], "-y", "-i", source]
+        cmd += ["-filter_complex", ";".join(filters)]
+        for i, (name, w, h, vrate, arate) in enumerate(pending):
+            rendition_dir = os.path.join(hls_dir, name)
+            shutil.rmtree(rendition_dir, ignore_errors=True)
+            os.makedirs(rendition_dir)
+            cmd += ["-map", f"[out{i}]", "-map", "0:a:0?"]
+            cmd += ["-c:v", "libx264", "-pix_fmt", "yuv420p"] + list(options["options"])
+            cmd += ["-b:v", str(vrate), "-maxrate", str(vrate)]
+            cmd += ["-bufsize", str(2 * _bitrate(vrate))]
+            # a keyframe at the start of each segment
+            cmd += ["-force_key_frames", f"expr:gte(t,n_forced*{seg})"]
+            cmd += ["-c:a", "aac", "-b:a", str(arate), "-ac", "2"]
+            cmd += ["-f", "hls", "-hls_time", str(seg), "-hls_playlist_type", "vod"]
+            cmd += ["-hls_segment_filename", os.path.join(rendition_dir, "%03d.ts")]
+            cmd += [os.path.join(rendition_dir, "index.m3u8")]
+
+        logger.debug("Create HLS renditions: %s", " ".join(cmd))
+        try:
+            check_subprocess(
+                cmd,
+                source,
+                duration=probe.get("duration"),
+                timeout=get_timeout(settings, probe.get("duration")),
+            )
+        except BaseException:
+            for name, *_ in pending:
+                shutil.rmtree(os.path.join(hls_dir, name), ignore_errors=True)
+            raise
     else:
-        generate_video_pass(converter, source, final_pass_options, outname)
+        logger.debug("HLS renditions of %s are up to date", source)
+
+    has_audio = probe.get("audio_codec") is not None
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for name, w, h, vrate, arate in renditions:
+        bandwidth = _bitrate(vrate) + (_bitrate(arate) if has_audio else 0)
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={w}x{h}")
+        lines.append(f"{name}/index.m3u8")
+    with open(outname, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    with open(state_path, "w") as f:
+        json.dump(keys, f)
+    return [name for name, *_ in renditions]
+
+
+# Header of the frames written by ffmpeg with the ppm codec
+PPM_HEADER = re.compile(rb"P6\s+(\d+)\s+(\d+)\s+255\s")
+
+
+def _read_frames(data):
+    """Return the images in a stream of PPM frames."""
+    frames = []
+    pos = 0
+    while match := PPM_HEADER.match(data, pos):
+        width, height = int(match.group(1)), int(match.group(2))
+        pos = match.end() + width * height * 3
+        frames.append(
+            PILImage.frombytes("RGB", (width, height), data[match.end() : pos])
+        )
+    return frames
+
+
+def _frames_output(count=1, interval=1):
+    """Options of an ffmpeg output which writes ``count`` frames, every
+    ``interval`` seconds, as PPM images on the standard output."""
+    options = ["-an", "-sn"]
+    if count > 1:
+        options += ["-vf", f"fps=1/{interval}"]
+    options += ["-frames:v", str(count), "-pix_fmt", "rgb24"]
+    options += ["-c:v", "ppm", "-f", "image2pipe", "pipe:1"]
+    return options
+
+
+def extract_frames(
+    source, delay, count=1, interval=1, converter="ffmpeg", timeout=None
+):
+    """Extract ``count`` frames from the video, every ``interval`` seconds
+    starting at ``delay``, with a single ffmpeg process. The frames are read
+    from the output of ffmpeg, without temporary files.
+
+    :return: list of Pillow images, which is shorter than ``count`` if the
+        video ends before the last frame
+    """
+    logger = logging.getLogger(__name__)
+    cmd = [converter, "-ss", str(delay), "-i", source]
+    cmd += _frames_output(count=count, interval=interval)
+    logger.debug("Extract frames from video: %s", " ".join(cmd))
+    res = check_subprocess(cmd, source, timeout=timeout)
+    return _read_frames(res.stdout)
+
+
+def get_frames(source, delay, count=1, interval=1, converter="ffmpeg", timeout=None):
+    """Extract the frames with :func:`extract_frames`, or the first frame if
+    there is no frame after ``delay``.
+
+    :raise SubprocessException: if no frame can be extracted
+    """
+    logger = logging.getLogger(__name__)
+    frames = extract_frames(
+        source,
+        delay,
+        count=count,
+        interval=interval,
+        converter=converter,
+        timeout=timeout,
+    )
+    if not frames and delay:
+        # ffmpeg returns no frame if the delay is after the end of the video,
+        # which happens if the duration is not known
+        logger.debug("Thumbnail generation failed. Likely due to short video length.")
+        frames = extract_frames(source, 0, converter=converter, timeout=timeout)
+    if not frames:
+        raise SubprocessException("Failed to extract a frame from " + source)
+    return frames
+
+
+def get_frames_range(delay, black_retries=0, black_offset=1, duration=None):
+    """Return the delay, count and interval of the frames extracted to choose
+    the thumbnail, with the ``thumb_video_*`` settings.
+
+    :param duration: duration of the video, if the delay is after the end of
+        the video the first frame is used
+    """
+    delay = int(delay)
+    if duration is not None and delay >= duration:
+        logger = logging.getLogger(__name__)
+        logger.debug("The video is shorter than the thumbnail delay")
+        delay = 0
+    return delay, abs(black_retries) + 1, max(abs(black_offset), 1)
+
+
+def select_frame(frames, max_colors=4):
+    """Return the first frame which is not a solid color, i.e. with more than
+    ``max_colors`` colors, or the frame with the highest luma variance if they
+    all look solid (e.g. black frames)."""
+    for frame in frames:
+        if frame.getcolors(maxcolors=max_colors) is None:
+            return frame
+    return max(frames, key=lambda frame: ImageStat.Stat(frame.convert("L")).var[0])
 
 
 def generate_thumbnail(
@@ -184,81 +1022,147 @@ def generate_thumbnail(
     black_retries=0,
     black_offset=1,
     black_max_colors=4,
+    duration=None,
+    timeout=None,
 ):
-    """Create a thumbnail image for the video source, based on ffmpeg."""
-    logger = logging.getLogger(__name__)
-    tmpfile = outname + ".tmp.jpg"
-
-    currentTry = 0
-    iDelay = int(delay)
-    while currentTry <= abs(black_retries):
-        # dump an image of the video
-        cmd = [converter, "-i", source, "-an", "-r", "1"]
-        cmd += ["-ss", str(iDelay), "-vframes", "1", "-y", tmpfile]
-        logger.debug("Create thumbnail for video: %s", " ".join(cmd))
-        check_subprocess(cmd, source, outname)
-        if os.path.isfile(tmpfile) and black_retries > 0:
-            with PILImage.open(tmpfile) as img:
-                colors = img.getcolors(maxcolors=black_max_colors)
-            if colors is None:
-                # There were more colors than maxcolors in the image, it
-                # looks suitable for a valid thumbnail
-                break
-            else:
-                # Only found 'maxcolors' unique colors, looks like a solid
-                # color, try again with another seek delay
-                currentTry += 1
-                iDelay += abs(black_offset)
-        else:
-            break
+    """Create a thumbnail image for the video source, based on ffmpeg.
 
-    # Sometimes ffmpeg fails with returncode zero but without producing an
-    # output file Thus, we need to check if an output file was created. If
-    # not, assume ffmpeg failed
-    if not os.path.isfile(tmpfile):
-        logger.debug("Thumbnail generation failed. Likely due to short video length.")
-        cmd = [converter, "-i", source, "-an", "-r", "1"]
-        cmd += ["-ss", "0", "-vframes", "1", "-y", tmpfile]
-        logger.debug("Retry to create thumbnail for video: %s", " ".join(cmd))
-        check_subprocess(cmd, source, outname)
+    The frame at ``delay`` and, with ``black_retries``, the following ones
+    every ``black_offset`` seconds, are extracted with a single ffmpeg
+    process, and the first one which is not a solid color is used.
 
+    :param duration: duration of the video, if the delay is after the end of
+        the video the first frame is used
+    :param timeout: maximum duration of the ffmpeg process, in seconds
+    """
+    delay, count, interval = get_frames_range(
+        delay, black_retries=black_retries, black_offset=black_offset, duration=duration
+    )
+    frames = get_frames(
+        source,
+        delay,
+        count=count,
+        interval=interval,
+        converter=converter,
+        timeout=timeout,
+    )
+    frame = select_frame(frames, max_colors=black_max_colors)
     # use the generate_thumbnail function from sigal.image
-    image.generate_thumbnail(tmpfile, outname, box, fit=fit, options=options)
-    # remove the image
-    os.unlink(tmpfile)
+    image.generate_thumbnail(frame, outname, box, fit=fit, options=options)
+
+
+def save_poster(frame, outname, options=None):
+    """Save the frame used for the thumbnail, with its full size, as the
+    poster image of the video.
+
+    :return: the size of the poster
+    """
+    logger = logging.getLogger(__name__)
+    os.makedirs(os.path.dirname(outname), exist_ok=True)
+    logger.debug("Save poster image: %s, %dx%d", outname, *frame.size)
+    save_image(frame, outname, "JPEG", options=options or {})
+    return {"width": frame.width, "height": frame.height}
 
 
 def process_video(media):
-    """Process a video: resize, create thumbnail."""
+    """Process a video: resize, create thumbnail and poster.
+
+    The frames used for the thumbnail and the poster are extracted by the
+    ffmpeg process which converts the video, which decodes the video only
+    once. They are extracted from the source if the video is not converted.
+    """
     logger = logging.getLogger(__name__)
     settings = media.settings
 
+    frames_range = None
+    if not media.animated and (settings["make_thumbs"] or settings["video_poster"]):
+        frames_range = get_frames_range(
+            settings["thumb_video_delay"],
+            black_retries=settings["thumb_video_black_retries"],
+            black_offset=settings["thumb_video_black_retry_offset"],
+            duration=media.duration,
+        )
+
     with utils.raise_if_debug() as status:
+        if settings["make_thumbs"] and media.animated:
+            # the thumbnail of an animated GIF is its first frame
+            image.generate_thumbnail(
+                media.src_path,
+                media.thumb_path,
+                settings["thumb_size"],
+                fit=settings["thumb_fit"],
+                options=settings["jpg_options"],
+                thumb_fit_centering=settings["thumb_fit_centering"],
+            )
+
+        frames = None
         if settings["use_orig"] and is_valid_html5_video(media.src_ext):
             utils.copy(media.src_path, media.dst_path, symlink=settings["orig_link"])
         else:
             valid_formats = ["mp4", "webm"]
-            video_format = settings["video_format"]
+            video_format = media.video_format
 
             if video_format not in valid_formats:
                 logger.error(
-                    "Invalid video_format. Please choose one of: %s", valid_formats
+                    "Invalid video_format. Please choose one of: %s",
+                    valid_formats,
                 )
                 raise ValueError
-            generate_video(media.src_path, media.dst_path, settings)
+            # the video is renamed when it is complete, so that a partial
+            # video is not skipped by the next build if the worker is killed
+            # (e.g. when the build is interrupted)
+            tmpname = get_tmp_output(media.dst_path)
+            try:
+                frames = generate_video(
+                    media.src_path,
+                    tmpname,
+                    settings,
+                    video_format=video_format,
+                    probe=media.file_metadata,
+                    frames=frames_range,
+                )
+                os.replace(tmpname, media.dst_path)
+            finally:
+                _remove_output(tmpname)
 
-        if settings["make_thumbs"]:
-            generate_thumbnail(
-                media.dst_path,
-                media.thumb_path,
-                settings["thumb_size"],
-                settings["thumb_video_delay"],
-                fit=settings["thumb_fit"],
-                options=settings["jpg_options"],
-                converter=settings["video_converter"],
-                black_retries=settings["thumb_video_black_retries"],
-                black_offset=settings["thumb_video_black_retry_offset"],
-                black_max_colors=settings["thumb_video_black_max_colors"],
+        if frames_range:
+            if not frames:
+                # the video was copied or remuxed, or the delay is after the
+                # end of the video
+                delay, count, interval = frames_range
+                frames = get_frames(
+                    media.src_path,
+                    delay,
+                    count=count,
+                    interval=interval,
+                    converter=settings["video_converter"],
+                    timeout=get_timeout(settings, media.duration),
+                )
+            frame = select_frame(
+                frames, max_colors=settings["thumb_video_black_max_colors"]
+            )
+            if settings["make_thumbs"]:
+                image.generate_thumbnail(
+                    frame,
+                    media.thumb_path,
+                    settings["thumb_size"],
+                    fit=settings["thumb_fit"],
+                    options=settings["jpg_options"],
+                )
+            if settings["video_poster"]:
+                media.build_info["poster"] = save_poster(
+                    frame, media.poster_path, options=settings["jpg_options"]
+                )
+
+        if settings["video_hls"] and not media.animated:
+            outname = os.path.join(
+                settings["destination"],
+                media.path,
+                get_hls(settings, media.dst_filename),
+            )
+            os.makedirs(os.path.dirname(outname), exist_ok=True)
+            media.build_info["hls"] = generate_hls(
+                media.src_path, outname, settings, media.file_metadata
             )
 
     return status.value
@@ -0,0 +1,270 @@
+# Copyright (c) 2026 - Simon Conseil
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Image backend using libvips, with ``img_backend = "vips"``.
+
+libvips processes the images by streaming: only the part of the image needed
+for the output is decoded, and JPEG, WebP or HEIF images are shrunk when they
+are loaded, so large images are resized with much less memory than with
+Pillow. This module implements the same functions as :mod:`sigal.image` for
+the image backend interface (``generate_image``, ``generate_thumbnail``,
+``get_size`` and ``get_image_metadata``). The features which are not
+available with libvips (``img_quality_search``, processors other than
+``ResizeToFit`` and ``ResizeToFill``, animated GIFs) are processed with
+Pillow.
+
+"""
+
+import logging
+from os.path import splitext
+
+import pyvips
+from PIL import Image as PILImage
+from PIL import ImageFile
+
+from . import image, signals, utils
+from .settings import IMG_EXTENSIONS, get_img_profile, get_img_variants, get_variant
+
+# Pillow modes for the number of bands of an 8 bits image
+BANDS_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+
+def to_pil(img):
+    """Convert a libvips image to a Pillow image."""
+    if img.interpretation not in ("srgb", "b-w") or img.format != "uchar":
+        img = img.colourspace("srgb").cast("uchar")
+    return PILImage.frombytes(
+        BANDS_MODES[img.bands], (img.width, img.height), img.write_to_memory()
+    )
+
+
+def from_pil(img):
+    """Convert a Pillow image to a libvips image."""
+    if img.mode not in BANDS_MODES.values():
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    return pyvips.Image.new_from_memory(
+        img.tobytes(), img.width, img.height, len(img.getbands()), "uchar"
+    )
+
+
+def _orientation(img):
+    """Return the EXIF orientation of the image, 1 if there is none."""
+    if img.get_typeof("orientation"):
+        return img.get("orientation")
+    return 1
+
+
+def _oriented_size(img, autorotate=True):
+    """Return the size of the image, rotated with its EXIF orientation."""
+    if autorotate and _orientation(img) in (5, 6, 7, 8):
+        return img.height, img.width
+    return img.width, img.height
+
+
+def _save_options(fmt, options, strip=True):
+    """Convert the Pillow encoder options to the libvips ones."""
+    vips_options = {"strip": strip}
+    if "quality" in options:
+        vips_options["Q"] = options["quality"]
+    if fmt == "JPEG":
+        vips_options["optimize_coding"] = options.get("optimize", False)
+        vips_options["interlace"] = options.get("progressive", False)
+    elif fmt == "PNG":
+        if "compress_level" in options:
+            vips_options["compression"] = options["compress_level"]
+    elif fmt == "WEBP":
+        if "method" in options:
+            vips_options["effort"] = options["method"]
+        if "lossless" in options:
+            vips_options["lossless"] = options["lossless"]
+    elif fmt == "AVIF":
+        if "speed" in options:
+            # the speed of Pillow is between 0 and 10, the effort between 0
+            # (fastest) and 9
+            vips_options["effort"] = max(0, 9 - options["speed"])
+    return vips_options
+
+
+def _save(img, outname, fmt, options, settings):
+    logger = logging.getLogger(__name__)
+    logger.debug("Save image: %s, %dx%d (%s)", outname, img.width, img.height, fmt)
+    utils.remove_if_shared(outname)
+    strip = not settings.get("copy_exif_data")
+    img.write_to_file(outname, **_save_options(fmt, options, strip=strip))
+
+
+def _apply_plugins(img, settings):
+    """Call the ``img_resized`` receivers, which use Pillow images."""
+    if not signals.img_resized.receivers:
+        return img
+    pil_img = to_pil(img)
+    for receiver in signals.img_resized.receivers_for(pil_img):
+        pil_img = receiver(pil_img, settings=settings)
+    return from_pil(pil_img)
+
+
+def _save_variants(img, outname, outformat, variants, profile, settings):
+    for fmt, options in variants.items():
+        if fmt == outformat:
+            continue
+        options = {**profile["encoder"].get(fmt, {}), **options}
+        _save(img, get_variant(outname, fmt), fmt, options, settings)
+
+
+def generate_image(
+    source, outname, settings, options=None, renditions=None, qualities=None
+):
+    """Image processor, rotate and resize the image, see
+    :func:`sigal.image.generate_image`. Each size is created from the source
+    image with the libvips thumbnail operation, which uses shrink-on-load.
+
+    :return: None, the resized image is not kept in memory
+    """
+    logger = logging.getLogger(__name__)
+    processor = settings["img_processor"]
+    if (
+        settings["use_orig"]
+        or source.endswith(".gif")
+        or settings["img_quality_search"]
+        or processor not in (None, "ResizeToFit", "ResizeToFill")
+    ):
+        logger.debug("Use Pillow to process %s", source)
+        return image.generate_image(
+            source,
+            outname,
+            settings,
+            options=options,
+            renditions=renditions,
+            qualities=qualities,
+        )
+
+    autorotate = settings["autorotate_images"]
+    src = pyvips.Image.new_from_file(source)
+    img_size = _oriented_size(src, autorotate=autorotate)
+    src_format = IMG_EXTENSIONS.ext2format.get(splitext(source)[1].lower())
+    logger.debug("Read %s: %dx%d (%s)", source, *img_size, src_format)
+
+    profile = get_img_profile(settings)
+    variants = get_img_variants(settings)
+    cover = processor == "ResizeToFill"
+    targets = [(settings["img_size"], outname)] if outname else []
+    if processor:
+        targets += renditions or []
+
+    done = set()
+    for size, name in targets:
+        box = image._resize_box(img_size, size)
+        if name != outname and (
+            image._ratio(img_size, box, cover=cover) >= 1 or box in done
+        ):
+            logger.debug("Skip rendition %s", name)
+            continue
+        done.add(box)
+
+        if processor:
+            out = pyvips.Image.thumbnail(
+                source,
+                box[0],
+                height=box[1],
+                size="down",
+                crop="centre" if cover else "none",
+                no_rotate=not autorotate,
+            )
+        else:
+            # the rotations need a random access to the pixels
+            rotate = autorotate and _orientation(src) != 1
+            out = pyvips.Image.new_from_file(
+                source, access="random" if rotate else "sequential"
+            )
+            if rotate:
+                out = out.autorot()
+        out = _apply_plugins(out, settings)
+
+        outformat = (settings.get("img_format") or src_format or "JPEG").upper()
+        save_options = {**profile["encoder"].get(outformat, {}), **(options or {})}
+        _save(out, name, outformat, save_options, settings)
+        _save_variants(out, name, outformat, variants, profile, settings)
+
+
+def generate_thumbnail(
+    source,
+    outname,
+    box,
+    fit=True,
+    options=None,
+    thumb_fit_centering=(0.5, 0.5),
+    profile=None,
+    variants=None,
+):
+    """Create a thumbnail image, see :func:`sigal.image.generate_thumbnail`.
+
+    :param source: path to an image, or a Pillow image
+    """
+    if fit and tuple(thumb_fit_centering) != (0.5, 0.5):
+        # libvips crops only in the centre
+        return image.generate_thumbnail(
+            source,
+            outname,
+            box,
+            fit=fit,
+            options=options,
+            thumb_fit_centering=thumb_fit_centering,
+            profile=profile,
+            variants=variants,
+        )
+
+    profile = profile or {"encoder": {}}
+    kwargs = {"height": box[1], "crop": "centre" if fit else "none"}
+    if not fit:
+        kwargs["size"] = "down"
+    if isinstance(source, ImageFile.ImageFile) and source.filename:
+        # the image was opened from a file, which is read again with libvips
+        source = source.filename
+    if isinstance(source, PILImage.Image):
+        img = from_pil(source).thumbnail_image(box[0], **kwargs)
+    else:
+        img = pyvips.Image.thumbnail(source, box[0], **kwargs)
+
+    ext = splitext(outname)[1].lower()
+    outformat = PILImage.registered_extensions().get(ext, "JPEG")
+    options = {**profile["encoder"].get(outformat, {}), **(options or {})}
+    _save(img, outname, outformat, options, {})
+    if variants:
+        _save_variants(img, outname, outformat, variants, profile, {})
+
+
+def get_size(file_path):
+    """Return image size (width and height), read from the header."""
+    try:
+        img = pyvips.Image.new_from_file(file_path)
+    except pyvips.Error as e:
+        logger = logging.getLogger(__name__)
+        logger.error("Could not read size of %s due to %r", file_path, e)
+    else:
+        return {"width": img.width, "height": img.height}
+
+
+def get_image_metadata(filename):
+    """Return the EXIF, IPTC metadata and the size of the image. The metadata
+    are parsed with Pillow, which reads only the header of the file."""
+    metadata = image.get_image_metadata(filename)
+    if not metadata["size"]:
+        metadata["size"] = get_size(filename) or {}
+    return metadata
@@ -1,7 +1,7 @@
 import os
 import pickle
 
-from sigal.gallery import Gallery, Image
+from sigal.gallery import Gallery, Image, Video
 from sigal.plugins import extended_caching
 
 CURRENT_DIR = os.path.dirname(__file__)
@@ -138,3 +138,33 @@ def test_load_metadata_missing(settings, tmpdir):
     extended_caching.load_metadata(gal.albums["dir1/test2"])
     assert gal.albums["dir1/test2"].medias[1].exif == "Bar"
     assert gal.albums["dir1/test2"].medias[1].markdown_metadata != "Bar"
+
+
+def test_load_video_metadata(settings, tmpdir):
+    settings["destination"] = str(tmpdir)
+    gal = Gallery(settings, ncpu=1)
+    album = gal.albums["video"]
+    media = next(m for m in album.medias if isinstance(m, Video))
+    key = os.path.join(media.path, media.dst_filename)
+    size = os.path.getsize(media.src_path)
+
+    # the entries of older versions, without the size and the information
+    # read with ffprobe, are not used
+    gal.metadataCache = {key: {"file_metadata": {}, "mod_date": 100000000000}}
+    extended_caching.load_metadata(album)
+    assert media.duration > 0
+
+    # the missing keys of a cached probe are filled
+    media = Video(media.src_filename, media.path, settings)
+    album.medias = [media]
+    gal.metadataCache = {
+        key: {
+            "file_metadata": {"width": 10, "height": 20},
+            "mod_date": 100000000000,
+            "size": size,
+        }
+    }
+    extended_caching.load_metadata(album)
+    assert media.file_metadata["width"] == 10
+    assert media.duration is None
+    assert media.file_metadata["audio_codec"] is None
@@ -3,12 +3,26 @@ import logging
 import os
 import re
 import shutil
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 from os.path import join
+from types import SimpleNamespace
 
 import pytest
 from PIL import Image as PILImage
 
-from sigal.gallery import Album, Gallery, Image, Media, Video
+from sigal import video
+from sigal.gallery import (
+    Album,
+    AnimatedGif,
+    Gallery,
+    Image,
+    Media,
+    MemoryScheduler,
+    Video,
+)
+from sigal.settings import get_variant
 from sigal.video import SubprocessException
 
 try:
@@ -199,6 +213,27 @@ def test_video(settings, tmpdir):
     assert os.path.isfile(m.thumb_path)
 
 
+@pytest.mark.parametrize(
+    "fmt,cls,ext", [("mp4", AnimatedGif, ".mp4"), ("webp", Image, ".webp")]
+)
+def test_animated_gif(settings, tmp_path, fmt, cls, ext):
+    "Only the animated GIFs are converted with animated_gif_format."
+
+    shutil.copy(join(settings["source"], "dir1", "test1", "example.gif"), tmp_path)
+    PILImage.new("RGB", (10, 10)).save(tmp_path / "static.gif")
+    settings["source"] = str(tmp_path)
+    settings["animated_gif_format"] = fmt
+
+    gal = Gallery(settings, ncpu=1)
+    animated, static = gal.albums["."].medias
+    assert isinstance(animated, cls)
+    assert animated.animated
+    assert animated.dst_filename == "example" + ext
+    assert type(static) is Image
+    assert not static.animated
+    assert static.dst_filename == "static.gif"
+
+
 @pytest.mark.parametrize("path,album", REF.items())
 def test_album(path, album, settings, tmpdir):
     gal = Gallery(settings, ncpu=1)
@@ -455,3 +490,202 @@ def test_thumbnail_with_img_format(settings, tmp_path, thumbnail):
     assert (tmp_path / "build" / "test1" / "outdoor.tn.jpg").is_file()
     index = (tmp_path / "build" / "index.html").read_text()
     assert 'src="./test1/outdoor.tn.jpg" class="album_thumb"' in index
+
+
+def test_reprocess_profile_change(settings, tmp_path):
+    "Images are processed again when the processing profile changes."
+
+    src = tmp_path / "src"
+    shutil.copytree(join(settings["source"], "dir2"), src)
+    settings["source"] = str(src)
+    settings["destination"] = str(tmp_path / "build")
+    settings["write_html"] = False
+
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    assert gal.stats["image"] == 4
+
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    assert gal.stats["image"] == 0
+    assert gal.stats["image_skipped"] == 4
+
+    # the profile can be set for the album
+    (src / "index.md").write_text("Profile: fast\n")
+    gal = Gallery(settings, ncpu=1)
+    assert gal.albums["."].settings["img_profile"] == "fast"
+    gal.build()
+    assert gal.stats["image"] == 4
+
+    settings["img_profile"] = "fast"
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    assert gal.stats["image"] == 0
+
+
+def test_reprocess_without_manifest(settings, tmp_path):
+    "Without manifest, the medias are processed again if the settings changed."
+
+    settings["source"] = join(settings["source"], "dir2")
+    settings["destination"] = str(tmp_path)
+    settings["write_html"] = False
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    os.remove(tmp_path / ".build_manifest")
+
+    # the default settings are the ones of the existing files
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    assert gal.stats["image_skipped"] == 4
+    os.remove(tmp_path / ".build_manifest")
+
+    settings["img_variants"] = ["WEBP"]
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    assert gal.stats["image"] == 4
+    assert os.path.isfile(get_variant(gal.albums["."].medias[0].dst_path, "WEBP"))
+
+
+def test_gallery_renditions(settings, tmp_path):
+    "The themes use the renditions, HiDPI thumbnails and variants."
+
+    settings["source"] = join(settings["source"], "dir2")
+    settings["destination"] = str(tmp_path)
+    settings["img_renditions"] = [(320, 240)]
+    settings["thumb_densities"] = [2]
+    settings["img_variants"] = ["WEBP"]
+    settings["theme"] = "photoswipe"
+
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+
+    media = gal.albums["."].medias[0]
+    assert len(media.renditions) == 2
+    index = (tmp_path / "index.html").read_text()
+    assert f'data-pswp-srcset="{media.srcset}"' in index
+    assert f'srcset="{media.thumb_srcset}"' in index
+    variant = media.thumb_variants[0]
+    assert f'<source type="image/webp" srcset="{variant["srcset"]}" />' in index
+
+
+def test_gallery_placeholder(settings, tmp_path):
+    "The placeholders are stored in the build manifest."
+
+    settings["source"] = join(settings["source"], "dir2")
+    settings["destination"] = str(tmp_path)
+    settings["img_placeholder"] = "color"
+
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    media = gal.albums["."].medias[0]
+    assert media.placeholder.startswith("#")
+    index = (tmp_path / "index.html").read_text()
+    assert f'style="{media.placeholder_style}"' in index
+    width, height = media.thumb_size["width"], media.thumb_size["height"]
+    assert f'width="{width}" height="{height}"' in index
+
+    # the placeholder is restored for the skipped images
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+    assert gal.stats["image_skipped"] == 4
+    assert gal.albums["."].medias[0].placeholder == media.placeholder
+
+
+@pytest.mark.parametrize("ncpu", [1, 2])
+def test_gallery_video_jobs(settings, tmp_path, ncpu):
+    "The videos are processed in the main process, with asyncio."
+    shutil.copy(join(settings["source"], "video", "example video.ogv"), tmp_path)
+    shutil.copy(
+        join(settings["source"], "video", "example video.ogv"), tmp_path / "b.ogv"
+    )
+    shutil.copy(
+        join(settings["source"], "dir2", "KeckObservatory20071020.jpg"), tmp_path
+    )
+    settings["source"] = str(tmp_path)
+    settings["destination"] = str(tmp_path / "build")
+    settings["write_html"] = False
+    settings["video_jobs"] = 2
+
+    gal = Gallery(settings, ncpu=ncpu)
+    gal.build()
+    assert gal.stats == {"image": 1, "video": 2}
+    for media in gal.albums["."].medias:
+        assert os.path.isfile(media.dst_path)
+        assert os.path.isfile(media.thumb_path)
+    assert video.runner is None
+
+
+def test_image_memory(settings):
+    img = Image("11.jpg", "dir1/test1", settings)
+    assert img.memory == 600 * 800 * 8
+
+
+def test_memory_scheduler():
+    memories = [50, 10, 10, 120, 80, 10, 30, 10]
+    medias = [
+        SimpleNamespace(memory=m, cost=1, src_filename=f"{i}.jpg")
+        for i, m in enumerate(memories)
+    ]
+    lock = threading.Lock()
+    running = []
+    peaks = []
+
+    def process(media):
+        with lock:
+            running.append(media.memory)
+            peaks.append(list(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(media.memory)
+        return media.src_filename
+
+    with ThreadPool(4) as pool:
+        results = list(MemoryScheduler(pool, 4, 100).imap(process, medias))
+
+    assert sorted(result for _, result in results) == sorted(
+        m.src_filename for m in medias
+    )
+    assert all(media.src_filename == result for media, result in results)
+    for peak in peaks:
+        # the media larger than the budget is processed alone
+        assert sum(peak) <= 100 or peak == [120]
+    # the small images are processed while the large ones wait
+    assert max(len(peak) for peak in peaks) > 1
+
+
+def test_memory_scheduler_no_memory():
+    "The medias without memory, like the videos, are submitted first."
+    medias = [
+        SimpleNamespace(memory=10, cost=1, src_filename=f"{i}.jpg") for i in range(6)
+    ]
+    medias += [
+        SimpleNamespace(memory=0, cost=cost, src_filename=f"{cost}.webm")
+        for cost in (10, 600)
+    ]
+    started = []
+
+    def process(media):
+        started.append(media.src_filename)
+        return media.src_filename
+
+    with ThreadPool(1) as pool:
+        results = list(MemoryScheduler(pool, 1, 100).imap(process, medias))
+
+    assert len(results) == len(medias)
+    assert started[:2] == ["600.webm", "10.webm"]
+
+
+def test_gallery_memory_budget(settings, tmp_path):
+    settings["source"] = join(settings["source"], "dir2")
+    settings["destination"] = str(tmp_path)
+    settings["write_html"] = False
+    # the images are larger than the budget, and processed one at a time
+    settings["memory_budget"] = 1
+
+    gal = Gallery(settings, ncpu=2)
+    gal.build()
+    medias = gal.albums["."].medias
+    assert gal.stats["image"] == len(medias)
+    for media in medias:
+        assert os.path.isfile(media.dst_path)
+        assert media.build_info is not None
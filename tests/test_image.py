@@ -1,22 +1,37 @@
+import base64
+import io
+import json
 import os
+import re
 from unittest.mock import patch
 
 import pytest
 from PIL import Image as PILImage
+from PIL import features
 
+from sigal import signals
 from sigal.gallery import Image
 from sigal.image import (
+    _draft,
+    blurhash,
+    can_copy_source,
     generate_image,
     generate_thumbnail,
+    generate_tiles,
     get_exif_data,
+    get_exif_preview,
     get_exif_tags,
     get_image_metadata,
+    get_img_backend,
     get_iptc_data,
+    get_placeholder,
     get_size,
     process_image,
+    search_quality,
+    similarity,
 )
 from sigal.log import init_logging
-from sigal.settings import Status, create_settings
+from sigal.settings import Status, create_settings, get_img_profile
 
 CURRENT_DIR = os.path.dirname(__file__)
 SRCDIR = os.path.join(CURRENT_DIR, "sample", "pictures")
@@ -60,6 +75,38 @@ def test_generate_image(tmpdir):
             assert im.size == size
 
 
+@pytest.mark.parametrize(
+    ("gap", "cover", "decoded_size"),
+    [
+        (None, False, (900, 600)),
+        (1, False, (225, 150)),
+        (2, False, (450, 300)),
+        (1, True, (450, 300)),
+    ],
+)
+def test_draft(gap, cover, decoded_size):
+    "Test the JPEG draft mode."
+
+    with PILImage.open(SRCFILE) as img:
+        img = _draft(img, (200, 200), cover=cover, gap=gap)
+        img.load()
+        assert img.size == decoded_size
+
+
+def test_generate_image_draft(tmpdir):
+    "Test generate_image and generate_thumbnail with the draft mode."
+
+    dstfile = str(tmpdir.join(TEST_IMAGE))
+    settings = create_settings(img_size=(200, 150), jpg_draft=1)
+    generate_image(SRCFILE, dstfile, settings)
+    with PILImage.open(dstfile) as im:
+        assert im.size == (200, 133)
+
+    generate_thumbnail(SRCFILE, dstfile, (100, 100), profile={"jpg_draft": 1})
+    with PILImage.open(dstfile) as im:
+        assert im.size == (100, 100)
+
+
 def test_generate_image_imgformat(tmpdir):
     "Test the effects of the img_format setting on generate_image."
 
@@ -332,3 +379,442 @@ def test_get_size_with_invalid_path(tmpdir):
 
     result = get_size(src_file)
     assert result is None
+
+
+@pytest.mark.parametrize("profile", ["fast", "balanced", "best"])
+def test_generate_image_profile(tmpdir, profile):
+    "Test generate_image and generate_thumbnail with the processing profiles."
+
+    dstfile = str(tmpdir.join(TEST_IMAGE))
+    settings = create_settings(img_size=(200, 150), img_profile=profile)
+    generate_image(SRCFILE, dstfile, settings)
+    with PILImage.open(dstfile) as im:
+        assert im.size == (200, 133)
+
+    generate_thumbnail(
+        SRCFILE, dstfile, (100, 100), fit=False, profile=get_img_profile(settings)
+    )
+    with PILImage.open(dstfile) as im:
+        # the reduced image can give a rounding difference
+        assert im.size[0] == 100
+        assert abs(im.size[1] - 67) <= 1
+
+
+def test_generate_image_profile_options(tmpdir):
+    "Test that the explicit encoder options take precedence over the profile."
+
+    dstfile = str(tmpdir.join(TEST_IMAGE))
+    settings = create_settings(img_size=(200, 150), img_profile="fast")
+    generate_image(SRCFILE, dstfile, settings, options={"progressive": True})
+    with PILImage.open(dstfile) as im:
+        assert im.info.get("progressive")
+
+    generate_image(SRCFILE, dstfile, settings, options={})
+    with PILImage.open(dstfile) as im:
+        assert not im.info.get("progressive")
+
+
+@pytest.mark.parametrize("method", [True, "hardlink", "reflink"])
+def test_process_image_copy_fitting(tmpdir, method):
+    "Test that images which fit in img_size are copied or linked."
+
+    test_image = "hélicoïde.jpg"
+    settings = create_settings(
+        img_size=(640, 480),
+        copy_fitting_images=method,
+        source=os.path.join(SRCDIR, "accentué"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    image = Image(test_image, ".", settings)
+    assert process_image(image) == Status.SUCCESS
+    assert os.path.isfile(image.thumb_path)
+    with open(image.src_path, "rb") as f1, open(image.dst_path, "rb") as f2:
+        assert f1.read() == f2.read()
+    if method == "hardlink":
+        assert os.path.samefile(image.src_path, image.dst_path)
+
+    # the output must not modify the hard linked source
+    settings["copy_fitting_images"] = False
+    settings["img_size"] = (200, 150)
+    assert process_image(image) == Status.SUCCESS
+    assert not os.path.samefile(image.src_path, image.dst_path)
+    with PILImage.open(image.src_path) as im:
+        assert im.size == (407, 394)
+
+
+def test_can_copy_source():
+    settings = create_settings(img_size=(640, 480))
+    with PILImage.open(os.path.join(SRCDIR, "accentué", "hélicoïde.jpg")) as img:
+        assert can_copy_source(img, settings)
+        assert not can_copy_source(img, {**settings, "img_size": (300, 200)})
+        assert not can_copy_source(img, {**settings, "img_format": "PNG"})
+        assert not can_copy_source(img, {**settings, "img_processor": "ResizeToFill"})
+
+    # images with EXIF data
+    with PILImage.open(SRCFILE) as img:
+        settings["img_size"] = (1000, 1000)
+        assert not can_copy_source(img, settings)
+        assert can_copy_source(img, {**settings, "copy_exif_data": True})
+
+
+def test_process_image_renditions(tmpdir):
+    "Test the renditions and HiDPI thumbnails created by process_image."
+
+    settings = create_settings(
+        img_size=(640, 480),
+        img_renditions=[(1600, 1200), (320, 240)],
+        thumb_densities=[2, 4],
+        source=os.path.join(SRCDIR, "dir2"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    os.makedirs(str(tmpdir.join("renditions")))
+    image = Image(TEST_IMAGE, ".", settings)
+    assert process_image(image) == Status.SUCCESS
+
+    name = os.path.splitext(TEST_IMAGE)[0]
+    with PILImage.open(image.dst_path) as im:
+        assert im.size == (640, 427)
+    with PILImage.open(str(tmpdir.join("renditions", f"{name}_320.jpg"))) as im:
+        assert im.size == (320, 214)
+    # larger than the original image
+    assert not tmpdir.join("renditions", f"{name}_1600.jpg").exists()
+
+    with PILImage.open(image.thumb_path) as im:
+        assert im.size == (200, 150)
+    with PILImage.open(str(tmpdir.join("thumbnails", f"{name}@2x.jpg"))) as im:
+        assert im.size == (400, 300)
+    # larger than the resized image
+    assert not tmpdir.join("thumbnails", f"{name}@4x.jpg").exists()
+
+    small = f"./renditions/{name}_320.jpg"
+    assert [(r["url"], r["width"]) for r in image.renditions] == [
+        (small, 320),
+        (f"./{TEST_IMAGE}", 640),
+    ]
+    assert image.srcset == f"{small} 320w, ./{TEST_IMAGE} 640w"
+    assert image.thumb_srcset == (
+        f"./thumbnails/{name}.jpg 1x, ./thumbnails/{name}%402x.jpg 2x"
+    )
+
+
+def test_process_image_densities_rotated(tmpdir):
+    "The HiDPI thumbnails of rotated images are not larger than the image."
+
+    src = tmpdir.mkdir("src")
+    exif = PILImage.Exif()
+    exif[0x0112] = 6
+    PILImage.new("RGB", (900, 600), "red").save(str(src.join("rot.jpg")), exif=exif)
+    PILImage.new("RGB", (900, 600), "red").save(str(src.join("flat.jpg")))
+    settings = create_settings(
+        img_size=(640, 640),
+        thumb_size=(280, 210),
+        thumb_densities=[2],
+        source=str(src),
+        destination=str(tmpdir.mkdir("build")),
+    )
+    os.makedirs(str(tmpdir.join("build", "thumbnails")))
+
+    image = Image("rot.jpg", ".", settings)
+    assert process_image(image) == Status.SUCCESS
+    with PILImage.open(image.dst_path) as im:
+        assert im.size == (427, 640)
+    assert not tmpdir.join("build", "thumbnails", "rot@2x.jpg").exists()
+
+    image = Image("flat.jpg", ".", settings)
+    assert process_image(image) == Status.SUCCESS
+    assert tmpdir.join("build", "thumbnails", "flat@2x.jpg").exists()
+
+
+def test_generate_image_renditions_plugin(tmpdir):
+    "The img_resized plugins are applied once to each size."
+
+    calls = []
+
+    def receiver(img, settings=None):
+        calls.append(img.size)
+        img.putpixel((0, 0), (255, 0, 0))
+        return img
+
+    settings = create_settings(img_size=(640, 480))
+    dstfile = str(tmpdir.join(TEST_IMAGE))
+    renditions = [((320, 240), str(tmpdir.join("small.jpg")))]
+    signals.img_resized.connect(receiver)
+    try:
+        img = generate_image(SRCFILE, dstfile, settings, renditions=renditions)
+    finally:
+        signals.img_resized.disconnect(receiver)
+
+    assert calls == [(640, 427), (320, 214)]
+    assert img.size == (640, 427)
+
+
+@pytest.mark.skipif(not features.check("avif"), reason="AVIF is not supported")
+def test_process_image_variants(tmpdir):
+    "Test the variants in other formats created by process_image."
+
+    settings = create_settings(
+        img_size=(640, 480),
+        img_renditions=[(320, 240)],
+        img_variants=["WEBP", "AVIF"],
+        thumb_densities=[2],
+        source=os.path.join(SRCDIR, "dir2"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    os.makedirs(str(tmpdir.join("renditions")))
+    image = Image(TEST_IMAGE, ".", settings)
+    assert process_image(image) == Status.SUCCESS
+
+    name = os.path.splitext(TEST_IMAGE)[0]
+    for path, size in [
+        (image.dst_path, (640, 427)),
+        (str(tmpdir.join("renditions", f"{name}_320.jpg")), (320, 214)),
+        (image.thumb_path, (200, 150)),
+        (str(tmpdir.join("thumbnails", f"{name}@2x.jpg")), (400, 300)),
+    ]:
+        for fmt, ext in (("WEBP", ".webp"), ("AVIF", ".avif")):
+            with PILImage.open(path + ext) as im:
+                assert im.format == fmt
+                assert im.size == size
+
+    webp, avif = image.variants
+    assert webp["type"] == "image/webp"
+    assert webp["url"] == f"./{TEST_IMAGE}.webp"
+    assert webp["srcset"] == (
+        f"./renditions/{name}_320.jpg.webp 320w, ./{TEST_IMAGE}.webp 640w"
+    )
+    assert avif["format"] == "AVIF"
+
+    webp, avif = image.thumb_variants
+    assert webp["url"] == f"./thumbnails/{name}.jpg.webp"
+    assert webp["srcset"] == (
+        f"./thumbnails/{name}.jpg.webp 1x, ./thumbnails/{name}%402x.jpg.webp 2x"
+    )
+
+
+def test_blurhash():
+    # checked with the reference implementation
+    img = PILImage.linear_gradient("L").resize((32, 24)).convert("RGB")
+    assert blurhash(img) == "LyHV9woffQof00WBfQWBxuj[fQj["
+
+
+@pytest.mark.parametrize(
+    "kind,pattern",
+    [
+        ("color", r"^#[0-9a-f]{6}$"),
+        ("image", r"^data:image/webp;base64,[A-Za-z0-9+/=]+$"),
+        ("blurhash", r"^[0-9A-Za-z#$%*+,\-.:;=?@\[\]^_{|}~]{28}$"),
+    ],
+)
+def test_get_placeholder(kind, pattern):
+    assert re.match(pattern, get_placeholder(SRCFILE, kind))
+
+    img = PILImage.new("RGB", (300, 200), (200, 80, 40))
+    if kind == "color":
+        assert get_placeholder(img, kind) == "#c85028"
+    elif kind == "image":
+        data = get_placeholder(img, kind).split(",")[1]
+        with PILImage.open(io.BytesIO(base64.b64decode(data))) as im:
+            assert im.size == (16, 11)
+
+
+def test_process_image_placeholder(tmpdir):
+    settings = create_settings(
+        img_placeholder="color",
+        make_thumbs=False,
+        source=os.path.join(SRCDIR, "dir2"),
+        destination=str(tmpdir),
+    )
+    image = Image(TEST_IMAGE, ".", settings)
+    assert process_image(image) == Status.SUCCESS
+    assert image.placeholder.startswith("#")
+    assert image.placeholder_style == f"background-color: {image.placeholder}"
+
+
+def test_search_quality():
+    with PILImage.open(SRCFILE) as img:
+        img.thumbnail((640, 480))
+        target_size = 30_000
+        quality, data = search_quality(img, "JPEG", {}, target_size=target_size)
+        assert len(data) <= target_size
+        assert 40 < quality < 95
+        _, larger = search_quality(img, "JPEG", {}, target_size=target_size * 2)
+        assert len(data) < len(larger) <= target_size * 2
+
+        # the minimum quality is used if the image does not fit in the budget
+        quality, data = search_quality(img, "JPEG", {}, target_size=1000)
+        assert quality == 40
+
+
+def test_similarity():
+    pytest.importorskip("numpy")
+    with PILImage.open(SRCFILE) as img:
+        img.thumbnail((640, 480))
+        assert similarity(img, img) == pytest.approx(1)
+        quality, data = search_quality(img, "WEBP", {}, min_similarity=0.9)
+        with PILImage.open(io.BytesIO(data)) as encoded:
+            assert similarity(img, encoded) >= 0.9
+
+
+def test_process_image_quality_search(tmpdir):
+    settings = create_settings(
+        img_quality_search={"target_size": 30_000},
+        img_renditions=[(320, 240)],
+        make_thumbs=False,
+        source=os.path.join(SRCDIR, "dir2"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("renditions")))
+    image = Image(TEST_IMAGE, ".", settings)
+    assert process_image(image) == Status.SUCCESS
+    assert os.path.getsize(image.dst_path) <= 30_000
+    qualities = image.build_info["quality_search"]["qualities"]
+    assert sorted(qualities) == ["JPEG 320x214", "JPEG 640x427"]
+
+    # the qualities are reused when the image is processed again
+    build_info = image.build_info
+    image = Image(TEST_IMAGE, ".", settings)
+    image.build_info = build_info
+    with patch("sigal.image.search_quality") as search:
+        assert process_image(image) == Status.SUCCESS
+    search.assert_not_called()
+
+    # but not if the settings changed
+    settings["img_quality_search"] = {"target_size": 20_000}
+    image = Image(TEST_IMAGE, ".", settings)
+    image.build_info = build_info
+    assert process_image(image) == Status.SUCCESS
+    assert os.path.getsize(image.dst_path) <= 20_000
+
+
+def test_process_image_animated_webp(tmpdir):
+    settings = create_settings(
+        animated_gif_format="webp",
+        img_size=(200, 200),
+        source=os.path.join(SRCDIR, "dir1", "test1"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    image = Image(TEST_GIF_IMAGE, ".", settings)
+    assert image.dst_filename == "example.webp"
+    assert process_image(image) == Status.SUCCESS
+
+    with PILImage.open(image.dst_path) as img:
+        assert img.format == "WEBP"
+        assert img.size == (179, 200)
+        assert img.n_frames == 12
+    with PILImage.open(image.thumb_path) as img:
+        assert img.size == settings["thumb_size"]
+
+
+def test_get_exif_preview():
+    with PILImage.open(SRCFILE) as img:
+        preview = get_exif_preview(img)
+    assert preview.size == (160, 107)
+
+    with PILImage.open(os.path.join(SRCDIR, "dir1", "test1", "11.jpg")) as img:
+        assert get_exif_preview(img).size == (120, 160)
+        # the aspect ratio of the preview does not match the image
+        assert get_exif_preview(img.crop((0, 0, 600, 600))) is None
+    with PILImage.open(os.path.join(SRCDIR, "exifTest", "noexif.png")) as img:
+        assert get_exif_preview(img) is None
+
+
+def test_process_image_exif_preview(tmpdir):
+    settings = create_settings(
+        thumb_exif_preview=True,
+        thumb_size=(150, 100),
+        use_orig=True,
+        source=os.path.join(SRCDIR, "dir2"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    image = Image(TEST_IMAGE, ".", settings)
+    with patch("sigal.image.Transpose.process", side_effect=lambda img: img) as tr:
+        assert process_image(image) == Status.SUCCESS
+    # the source image is not decoded
+    assert tr.call_args.args[0].size == (160, 107)
+    with PILImage.open(image.thumb_path) as img:
+        assert img.size == (150, 100)
+
+    # the preview is too small for this size
+    settings["thumb_size"] = (200, 150)
+    image = Image(TEST_IMAGE, ".", settings)
+    with patch("sigal.image.Transpose.process", side_effect=lambda img: img) as tr:
+        assert process_image(image) == Status.SUCCESS
+    assert tr.call_args.args[0].size == (900, 600)
+
+
+def test_generate_tiles(tmpdir):
+    settings = create_settings(img_tiles={"min_pixels": 0, "tile_size": 256})
+    outname = str(tmpdir.join("tiles", "image.dzi"))
+    assert generate_tiles(SRCFILE, outname, settings) == {"width": 900, "height": 600}
+
+    with open(outname) as f:
+        dzi = f.read()
+    assert 'Format="jpg" Overlap="1" TileSize="256"' in dzi
+    assert '<Size Width="900" Height="600"/>' in dzi
+
+    files_dir = tmpdir.join("tiles", "image_files")
+    assert sorted(int(p.basename) for p in files_dir.listdir(lambda p: p.isdir())) == (
+        list(range(11))
+    )
+    assert sorted(p.basename for p in files_dir.join("10").listdir()) == [
+        f"{col}_{row}.jpg" for col in range(4) for row in range(3)
+    ]
+    with PILImage.open(str(files_dir.join("10", "1_1.jpg"))) as img:
+        assert img.size == (258, 258)
+    with PILImage.open(str(files_dir.join("10", "3_2.jpg"))) as img:
+        assert img.size == (133, 89)
+    with PILImage.open(str(files_dir.join("9", "0_0.jpg"))) as img:
+        assert img.size == (257, 257)
+    with PILImage.open(str(files_dir.join("0", "0_0.jpg"))) as img:
+        assert img.size == (1, 1)
+
+    # only the missing levels are created again
+    state_path = str(files_dir.join("levels.json"))
+    with open(state_path) as f:
+        state = json.load(f)
+    state["levels"].remove(10)
+    with open(state_path, "w") as f:
+        json.dump(state, f)
+    with patch("sigal.image._save_tiles") as save_tiles:
+        generate_tiles(SRCFILE, outname, settings)
+    assert save_tiles.call_count == 1
+    assert save_tiles.call_args.args[0].size == (900, 600)
+
+    # but all the levels if the options changed
+    settings["img_tiles"]["tile_size"] = 510
+    with patch("sigal.image._save_tiles") as save_tiles:
+        generate_tiles(SRCFILE, outname, settings)
+    assert save_tiles.call_count == 11
+
+    settings["img_tiles"]["min_pixels"] = 1_000_000
+    assert generate_tiles(SRCFILE, outname, settings) is None
+
+
+def test_process_image_tiles(tmpdir):
+    settings = create_settings(
+        img_tiles={"min_pixels": 500_000},
+        source=os.path.join(SRCDIR, "dir2"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    image = Image(TEST_IMAGE, ".", settings)
+    assert process_image(image) == Status.SUCCESS
+    name = os.path.splitext(TEST_IMAGE)[0]
+    assert image.tiles == {
+        "url": f"./tiles/{name}.dzi",
+        "width": 900,
+        "height": 600,
+    }
+    assert os.path.isfile(str(tmpdir.join("tiles", f"{name}.dzi")))
+
+
+def test_get_img_backend():
+    import sigal.image
+
+    assert get_img_backend(create_settings()) is sigal.image
+    assert get_img_backend(create_settings(img_backend="sigal.image")) is sigal.image
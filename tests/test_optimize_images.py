@@ -0,0 +1,92 @@
+import logging
+import os
+import shutil
+import sys
+
+from sigal.gallery import Gallery
+from sigal.plugins import optimize_images
+from sigal.utils import init_plugins
+
+# Fake optimizer which reencodes the image with a lower quality, and counts
+# its calls in a file
+TOOL = """
+import sys
+from PIL import Image
+
+with open(sys.argv[3], "a") as f:
+    f.write("x")
+Image.open(sys.argv[1]).save(sys.argv[2], quality=30)
+"""
+
+
+def make_gallery(settings, tmp_path, tools):
+    settings["source"] = os.path.join(settings["source"], "dir2")
+    settings["destination"] = str(tmp_path / "build")
+    settings["write_html"] = False
+    settings["plugins"] = ["sigal.plugins.optimize_images"]
+    settings["optimize_images_options"] = {"tools": tools}
+    init_plugins(settings)
+    return Gallery(settings, ncpu=1)
+
+
+def test_optimize(disconnect_signals, settings, tmp_path, caplog):
+    tool = tmp_path / "tool.py"
+    tool.write_text(TOOL)
+    calls = tmp_path / "calls"
+    tools = {"JPEG": [sys.executable, str(tool), "{input}", "{output}", str(calls)]}
+
+    gal = make_gallery(settings, tmp_path, tools)
+    with caplog.at_level(logging.INFO):
+        gal.build()
+    assert "Optimized JPEG files" in caplog.text
+
+    media = gal.albums["."].medias[0]
+    before, after = media.build_info["optimized"]["JPEG"]
+    assert after < before
+    assert os.path.getsize(media.dst_path) + os.path.getsize(media.thumb_path) == after
+    # 4 images and 4 thumbnails
+    assert len(calls.read_text()) == 8
+
+    # the cache is outside of the destination, with a single copy of each
+    # optimized file
+    assert not os.path.exists(tmp_path / "build" / ".optimize_cache")
+    cache_dir = tmp_path / optimize_images.CACHE_DIR
+    assert len(list((cache_dir / "files").glob("*/*"))) == 8
+    assert len(list((cache_dir / "index").glob("*/*"))) == 16
+
+    # the files created again are found in the cache
+    settings["destination"] = str(tmp_path / "build")
+    gal = Gallery(settings, ncpu=1)
+    gal.build(force=True)
+    assert len(calls.read_text()) == 8
+    assert gal.albums["."].medias[0].build_info["optimized"]["JPEG"] == [
+        before,
+        after,
+    ]
+
+    # the optimized files are not optimized again
+    optimizer = optimize_images.Optimizer(settings)
+    assert (
+        optimizer.optimize(media.dst_path)[1:] == (os.path.getsize(media.dst_path),) * 2
+    )
+    assert len(calls.read_text()) == 8
+
+
+def test_optimize_missing_tool(disconnect_signals, settings, tmp_path, caplog):
+    tools = {"JPEG": ["sigal-missing-optimizer", "{input}", "{output}"]}
+    gal = make_gallery(settings, tmp_path, tools)
+    gal.build()
+    assert "sigal-missing-optimizer is not installed" in caplog.text
+    assert gal.albums["."].medias[0].build_info["optimized"] == {}
+
+
+def test_optimize_skip_links(settings, tmp_path):
+    src = tmp_path / "src.jpg"
+    shutil.copy(
+        os.path.join(settings["source"], "dir2", "KeckObservatory20071020.jpg"), src
+    )
+    os.link(src, tmp_path / "link.jpg")
+    settings["destination"] = str(tmp_path)
+    settings["optimize_images_options"] = {"tools": {"JPEG": ["cp"]}}
+    optimizer = optimize_images.Optimizer(settings)
+    assert optimizer.optimize(str(tmp_path / "link.jpg")) is None
@@ -1,6 +1,7 @@
 import os
 
-from sigal.gallery import Gallery
+from sigal import signals, utils
+from sigal.gallery import Album, Gallery, Media
 from sigal.utils import init_plugins
 
 CURRENT_DIR = os.path.dirname(__file__)
@@ -63,3 +64,47 @@ def test_titleregexp(settings, tmp_path, disconnect_signals):
         settings, "dir1", tmp_path, "sigal.plugins.titleregexp", titleregexp=conf
     )
     assert gal.albums["test2"].title == "titleregexp 02"
+
+
+def test_batch_signals(settings, disconnect_signals):
+    calls = []
+
+    def album_files(album, files):
+        calls.append(("album_files", sorted(files)))
+        # replace the media for one file, and register a non-media file
+        return {"fake.txt": Media("fake.txt", album.path, album.settings)}
+
+    def media_initialized_batch(album, medias):
+        calls.append(("batch", [m.src_filename for m in medias]))
+
+    signals.album_files.connect(album_files)
+    signals.media_initialized_batch.connect(media_initialized_batch)
+
+    gal = Gallery(settings, ncpu=1)
+    calls.clear()
+    album = Album("empty", settings, [], ["fake.txt"], gal)
+
+    assert calls == [("album_files", ["fake.txt"]), ("batch", ["fake.txt"])]
+    assert [m.src_filename for m in album.medias] == ["fake.txt"]
+
+
+def test_worker_signals(settings, tmp_path, disconnect_signals):
+    calls = []
+
+    def worker_initialized(settings):
+        calls.append("init")
+
+    def worker_shutdown(settings):
+        calls.append("shutdown")
+
+    signals.worker_initialized.connect(worker_initialized)
+    signals.worker_shutdown.connect(worker_shutdown)
+    utils.resource_cache.get("foo", lambda: "bar")
+
+    settings["source"] = os.path.join(settings["source"], "dir2")
+    settings["destination"] = str(tmp_path)
+    gal = Gallery(settings, ncpu=1)
+    gal.build()
+
+    assert calls == ["init", "shutdown"]
+    assert "foo" not in utils.resource_cache
@@ -1,6 +1,16 @@
 import os
+from importlib.util import find_spec
 
-from sigal.settings import get_thumb, read_settings
+import pytest
+
+from sigal.settings import (
+    get_hls,
+    get_poster,
+    get_rendition,
+    get_thumb,
+    get_tiles,
+    read_settings,
+)
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -32,6 +42,37 @@ def test_get_thumb(settings):
         assert get_thumb(settings, src) == ref
 
 
+def test_get_thumb_density(settings):
+    assert get_thumb(settings, "test/example.jpg", 2) == (
+        "test/thumbnails/example.tn@2x.jpg"
+    )
+    assert get_thumb(settings, "example.webm", 2) == "thumbnails/example.tn@2x.jpg"
+
+
+def test_get_rendition(settings):
+    assert get_rendition(settings, "example.jpg", (960, 720)) == (
+        "renditions/example_960.jpg"
+    )
+    assert get_rendition(settings, "test/example.png", (480, 360)) == (
+        "test/renditions/example_480.png"
+    )
+
+
+def test_get_hls(settings):
+    assert get_hls(settings, "test/example.webm") == "test/hls/example/master.m3u8"
+
+
+def test_get_poster(settings):
+    assert (
+        get_poster(settings, "test/example.webm")
+        == "test/thumbnails/example.poster.jpg"
+    )
+
+
+def test_get_tiles(settings):
+    assert get_tiles(settings, "test/example.jpg") == "test/tiles/example.dzi"
+
+
 def test_img_sizes(tmpdir):
     """Test that image size is swaped if needed."""
 
@@ -42,6 +83,10 @@ def test_img_sizes(tmpdir):
     assert settings["img_size"] == (800, 600)
     assert settings["thumb_size"] == (150, 200)
 
+    conf.write("img_renditions = [(480, 320), [1067, 1600]]")
+    settings = read_settings(str(conf))
+    assert settings["img_renditions"] == [(1600, 1067), (480, 320)]
+
 
 def test_theme_path(tmpdir):
     """Test that image size is swaped if needed."""
@@ -53,3 +98,13 @@ def test_theme_path(tmpdir):
 
     settings = read_settings(str(conf))
     assert settings["theme"] == tmpdir.join("theme")
+
+
+def test_img_backend_without_pyvips(tmpdir, caplog):
+    if find_spec("pyvips") is not None:
+        pytest.skip("pyvips is installed")
+    conf = tmpdir.join("sigal.conf.py")
+    conf.write("img_backend = 'vips'")
+    settings = read_settings(str(conf))
+    assert settings["img_backend"] == "pillow"
+    assert "pyvips is needed" in caplog.text
@@ -0,0 +1,61 @@
+import json
+import os
+
+from PIL import Image as PILImage
+
+from sigal.gallery import Gallery
+from sigal.plugins.thumbnail_sprites import _layout
+from sigal.settings import read_settings
+from sigal.utils import init_plugins
+
+CURRENT_DIR = os.path.dirname(__file__)
+SAMPLE_DIR = os.path.join(CURRENT_DIR, "sample")
+SAMPLE_SOURCE = os.path.join(SAMPLE_DIR, "pictures")
+
+
+def make_gallery(source_dir="dir2", **kwargs):
+    default_conf = os.path.join(SAMPLE_DIR, "sigal.conf.py")
+    settings = read_settings(default_conf)
+    settings["source"] = os.path.join(SAMPLE_SOURCE, source_dir)
+    settings["plugins"] = ["sigal.plugins.thumbnail_sprites"]
+    settings.update(kwargs)
+    init_plugins(settings)
+    return Gallery(settings, ncpu=1)
+
+
+def test_layout():
+    positions, size = _layout([(200, 150), (200, 150), (100, 150), (200, 100)], 2)
+    assert positions == [(0, 0), (200, 0), (0, 150), (100, 150)]
+    assert size == (400, 300)
+
+
+def test_sprites(disconnect_signals, tmpdir):
+    outpath = str(tmpdir)
+    gallery = make_gallery(destination=outpath, sprites_max_thumbs=3)
+    gallery.build()
+
+    thumb_dir = os.path.join(outpath, "thumbnails")
+    with open(os.path.join(thumb_dir, "sprites.json")) as f:
+        sheets = json.load(f)["sheets"]
+    assert [len(sheet["thumbs"]) for sheet in sheets] == [3, 1]
+
+    medias = gallery.albums["."].medias
+    with PILImage.open(os.path.join(thumb_dir, sheets[0]["file"])) as im:
+        assert im.format == "WEBP"
+        assert im.size == (sum(m.thumb_size["width"] for m in medias[:3]), 150)
+
+    sprite = medias[1].sprite
+    assert sprite["x"] == medias[0].thumb_size["width"]
+    assert sprite["url"] == f"./thumbnails/{sheets[0]['file']}"
+    with open(os.path.join(outpath, "index.html")) as f:
+        assert f'style="{sprite["style"]}"' in f.read()
+
+    # only the sheet with a modified thumbnail is created again
+    os.utime(medias[-1].thumb_path, ns=(0, 0))
+    gallery = make_gallery(destination=outpath, sprites_max_thumbs=3)
+    gallery.build()
+    with open(os.path.join(thumb_dir, "sprites.json")) as f:
+        new_sheets = json.load(f)["sheets"]
+    assert new_sheets[0]["file"] == sheets[0]["file"]
+    assert new_sheets[1]["file"] != sheets[1]["file"]
+    assert not os.path.exists(os.path.join(thumb_dir, sheets[1]["file"]))
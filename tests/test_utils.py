@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from PIL import Image as PILImage
+
 from sigal import utils
 
 CURRENT_DIR = os.path.dirname(__file__)
@@ -129,3 +131,41 @@ def test_read_markdown_empty_file(tmpdir):
 def test_is_valid_html5_video():
     assert utils.is_valid_html5_video(".webm") is True
     assert utils.is_valid_html5_video(".mpeg") is False
+
+
+def test_resource_cache():
+    cache = utils.ResourceCache(maxsize=2)
+    calls = []
+
+    def factory(value):
+        calls.append(value)
+        return value
+
+    assert cache.get("a", lambda: factory(1)) == 1
+    assert cache.get("a", lambda: factory(2)) == 1
+    assert cache.get("b", lambda: factory(3)) == 3
+    # "a" is the most recently used, so "b" is evicted
+    cache.get("a", lambda: factory(4))
+    cache.get("c", lambda: factory(5))
+    assert calls == [1, 3, 5]
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_resource_cache_bytes():
+    cache = utils.ResourceCache(maxbytes=3 * 100 * 100 * 4)
+    for size in (100, 101, 102):
+        cache.get(size, lambda: PILImage.new("RGBA", (size, 100)))
+    assert len(cache) == 2 and 100 not in cache
+    assert cache.nbytes == (101 + 102) * 100 * 4
+
+    # the last image is kept even if it is larger than the limit
+    cache.get("large", lambda: PILImage.new("RGBA", (1000, 100)))
+    assert len(cache) == 1 and "large" in cache
+    assert cache.nbytes == 1000 * 100 * 4
+
+    cache.clear()
+    assert cache.nbytes == 0
@@ -1,17 +1,41 @@
+import json
 import os
+import sys
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 from datetime import datetime
 from unittest.mock import patch
 
 import pytest
+from PIL import Image as PILImage
 
-from sigal.gallery import Video
+from sigal.gallery import AnimatedGif, Video
 from sigal.settings import Status, create_settings
-from sigal.video import generate_thumbnail, generate_video, process_video, video_size
+from sigal.video import (
+    SubprocessException,
+    SubprocessRunner,
+    _parse_ffprobe,
+    _segments,
+    can_remux,
+    check_subprocess,
+    encode_video,
+    extract_frames,
+    generate_hls,
+    generate_thumbnail,
+    generate_video,
+    get_chunks_jobs,
+    probe_video,
+    process_video,
+    run_process,
+    select_frame,
+    video_size,
+)
 
 CURRENT_DIR = os.path.dirname(__file__)
 SRCDIR = os.path.join(CURRENT_DIR, "sample", "pictures")
 TEST_VIDEO = "example video.ogv"
 SRCFILE = os.path.join(SRCDIR, "video", TEST_VIDEO)
+TEST_GIF = "example.gif"
 
 
 def test_video_size():
@@ -21,12 +45,158 @@ def test_video_size():
     assert size_src == (0, 0)
 
 
+def test_check_subprocess(tmpdir):
+    outname = str(tmpdir.join("out.txt"))
+    # the process is stopped after the timeout, and its output removed
+    cmd = [sys.executable, "-c", f"open({outname!r}, 'w'); import time; time.sleep(5)"]
+    with pytest.raises(SubprocessException, match="timeout"):
+        check_subprocess(cmd, "source", outname=outname, timeout=1)
+    assert not os.path.exists(outname)
+
+    # only the last lines of the output are kept
+    script = "import sys; [print(i, file=sys.stderr) for i in range(1000)]"
+    cmd = [sys.executable, "-c", script]
+    res = check_subprocess(cmd, "source")
+    assert res.stderr.splitlines() == [str(i).encode() for i in range(900, 1000)]
+
+
+def test_subprocess_runner(tmpdir, monkeypatch):
+    runner = SubprocessRunner(2)
+    monkeypatch.setattr("sigal.video.runner", runner)
+    # each process writes its start time, and waits
+    script = "import sys, time; print(time.time(), file=sys.stderr); time.sleep(0.5)"
+    cmd = [sys.executable, "-c", script]
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: run_process(cmd), range(4)))
+    finally:
+        runner.close()
+    assert all(res.returncode == 0 for res in results)
+    # at most 2 processes at the same time
+    starts = sorted(float(res.stderr) for res in results)
+    assert starts[2] - starts[0] >= 0.4
+    assert starts[3] - starts[1] >= 0.4
+    assert runner.loop.is_closed()
+
+
+def test_subprocess_runner_closed(monkeypatch):
+    runner = SubprocessRunner(1)
+    monkeypatch.setattr("sigal.video.runner", runner)
+    cmd = [sys.executable, "-c", "import time; time.sleep(10)"]
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(run_process, cmd)
+        time.sleep(0.5)
+        runner.cancel()
+        with pytest.raises(CancelledError):
+            future.result(timeout=5)
+    # the processes which are run after are cancelled without waiting
+    with pytest.raises(CancelledError):
+        run_process(cmd)
+    runner.close()
+    assert runner.loop.is_closed()
+
+
+def test_check_subprocess_progress(tmpdir):
+    outname = str(tmpdir.join("video.webm"))
+    cmd = ["ffmpeg", "-i", SRCFILE, "-t", "3", "-c:v", "libvpx", "-an", outname]
+    progress = []
+    with patch("sigal.video.progress_handler", lambda *args: progress.append(args)):
+        check_subprocess(cmd, SRCFILE, outname=outname, duration=3)
+    assert progress[-1] == ("video.webm", 100)
+    assert [percent for _, percent in progress] == sorted(
+        {percent for _, percent in progress}
+    )
+
+
+def test_parse_ffprobe():
+    data = {
+        "streams": [
+            {
+                "codec_type": "video",
+                "codec_name": "h264",
+                "pix_fmt": "yuv420p",
+                "width": 1920,
+                "height": 1080,
+                "side_data_list": [
+                    {"side_data_type": "Display Matrix", "rotation": -90}
+                ],
+            },
+            {"codec_type": "audio", "codec_name": "aac"},
+        ],
+        "format": {
+            "duration": "12.500000",
+            "bit_rate": "8000000",
+            "tags": {"creation_time": "2021-06-01T10:00:00.000000Z"},
+        },
+    }
+    assert _parse_ffprobe(data) == {
+        "width": 1920,
+        "height": 1080,
+        "rotation": -90,
+        "duration": 12.5,
+        "video_codec": "h264",
+        "pix_fmt": "yuv420p",
+        "audio_codec": "aac",
+        "bit_rate": 8000000,
+        "creation_time": "2021-06-01T10:00:00.000000Z",
+    }
+
+    with patch("sigal.video.run_process") as run:
+        run.return_value.stdout = json.dumps(data).encode()
+        run.return_value.returncode = 0
+        info = probe_video("video.mp4")
+    assert run.call_args[0][0][0] == "ffprobe"
+    # the size of the rotated video
+    assert (info["width"], info["height"]) == (1080, 1920)
+
+
+def test_probe_video_without_ffprobe():
+    info = probe_video(SRCFILE, prober="sigal-missing-ffprobe")
+    assert (info["width"], info["height"]) == (240, 98)
+    assert info["duration"] == pytest.approx(10.01)
+    assert info["video_codec"] == "theora"
+    assert info["pix_fmt"] == "yuv420p"
+    assert info["audio_codec"] == "vorbis"
+    assert info["bit_rate"] == 309000
+    assert info["creation_time"] is None
+
+
 def test_generate_thumbnail(tmpdir):
     outname = str(tmpdir.join("test.jpg"))
     generate_thumbnail(SRCFILE, outname, (50, 50), 5)
     assert os.path.isfile(outname)
 
 
+def test_extract_frames():
+    frames = extract_frames(SRCFILE, 1, count=3, interval=2)
+    assert [frame.size for frame in frames] == [(240, 98)] * 3
+    # the frames after the end of the video are missing
+    assert len(extract_frames(SRCFILE, 9, count=3, interval=2)) == 1
+
+
+def test_select_frame():
+    black = PILImage.new("RGB", (20, 20))
+    gray = PILImage.new("RGB", (20, 20), (50, 50, 50))
+    gray.paste((60, 60, 60), (0, 0, 10, 20))
+    frame = PILImage.effect_noise((20, 20), 50).convert("RGB")
+    assert select_frame([black, frame, gray]) is frame
+    assert select_frame([black, gray, black]) is gray
+
+
+@patch("sigal.video.check_subprocess", wraps=check_subprocess)
+def test_generate_thumbnail_single_process(mock_check_subprocess, tmpdir):
+    outname = str(tmpdir.join("test.jpg"))
+    generate_thumbnail(SRCFILE, outname, (50, 50), 2, black_retries=3)
+    assert mock_check_subprocess.call_count == 1
+    assert os.path.isfile(outname)
+    assert not os.path.exists(outname + ".tmp.jpg")
+
+    # the delay is after the end of the video
+    mock_check_subprocess.reset_mock()
+    generate_thumbnail(SRCFILE, outname, (50, 50), 20, duration=10.01)
+    assert mock_check_subprocess.call_count == 1
+
+
 def test_process_video(tmpdir):
     base, ext = os.path.splitext(TEST_VIDEO)
 
@@ -49,6 +219,30 @@ def test_process_video(tmpdir):
     assert process_video(video) == Status.FAILURE
 
 
+def test_process_video_partial_output(tmpdir):
+    settings = create_settings(
+        video_format="webm",
+        make_thumbs=False,
+        source=os.path.join(SRCDIR, "video"),
+        destination=str(tmpdir),
+    )
+    video = Video(TEST_VIDEO, ".", settings)
+
+    def fail(source, outname, *args, **kwargs):
+        # the output is written with a temporary name
+        assert os.path.basename(outname) == ".example video.tmp.webm"
+        with open(outname, "w") as f:
+            f.write("partial")
+        raise SubprocessException("Failed to process " + source)
+
+    with patch("sigal.video.generate_video", side_effect=fail):
+        assert process_video(video) == Status.FAILURE
+    assert os.listdir(tmpdir) == []
+
+    assert process_video(video) == Status.SUCCESS
+    assert os.listdir(tmpdir) == ["example video.webm"]
+
+
 def test_metadata(tmpdir):
     base, ext = os.path.splitext(TEST_VIDEO)
 
@@ -63,6 +257,12 @@ def test_metadata(tmpdir):
     assert video.meta == {"date": ["2020-01-01T09:00:00"]}
     assert video.date == datetime(2020, 1, 1, 9, 0)
 
+    # without date metadata, the creation time of the video is used
+    video = Video(TEST_VIDEO, ".", settings)
+    video.meta = {}
+    video.file_metadata = {"creation_time": "2021-06-01T10:00:00"}
+    assert video.date == datetime(2021, 6, 1, 10, 0)
+
 
 @pytest.mark.parametrize("fmt", ["webm", "mp4"])
 def test_generate_video_fit(tmpdir, fmt):
@@ -121,3 +321,248 @@ def test_second_pass_video(mock_generate_video_pass, fmt, tmpdir):
     # The second call to the method should have 4 args, with the outname
     args, kwargs = call_args_list[1]
     assert len(args) == 4
+    # Both passes use the same log file, in a temporary directory which is
+    # removed after the encoding
+    passlogfile = kwargs["passlogfile"]
+    assert call_args_list[0][1]["passlogfile"] == passlogfile
+    assert not os.path.exists(os.path.dirname(passlogfile))
+
+    # The temporary directory is also removed if the encoding fails
+    mock_generate_video_pass.reset_mock()
+    mock_generate_video_pass.side_effect = [None, SubprocessException("fail")]
+    with pytest.raises(SubprocessException):
+        generate_video(SRCFILE, dstfile, settings)
+    passlogfile = mock_generate_video_pass.call_args[1]["passlogfile"]
+    assert not os.path.exists(os.path.dirname(passlogfile))
+
+
+def test_can_remux():
+    probe = {"video_codec": "h264", "pix_fmt": "yuv420p", "audio_codec": "aac"}
+    assert can_remux(probe, "mp4")
+    assert not can_remux(probe, "webm")
+    assert can_remux({**probe, "audio_codec": None}, "mp4")
+    assert not can_remux({**probe, "pix_fmt": "yuv444p"}, "mp4")
+    assert not can_remux({**probe, "video_codec": "hevc"}, "mp4")
+    assert not can_remux({"video_codec": None}, "mp4")
+
+
+def test_generate_video_remux(tmpdir):
+    source = str(tmpdir.join("source.mkv"))
+    check_subprocess(
+        ["ffmpeg", "-i", SRCFILE, "-c:v", "libx264", "-pix_fmt", "yuv420p"]
+        + ["-c:a", "aac", "-t", "2", source],
+        SRCFILE,
+    )
+    outname = str(tmpdir.join("video.mp4"))
+    settings = create_settings(video_format="mp4")
+    with patch("sigal.video.generate_video_pass") as mock_generate_video_pass:
+        generate_video(source, outname, settings)
+    assert not mock_generate_video_pass.called
+    info = probe_video(outname)
+    assert (info["video_codec"], info["audio_codec"]) == ("h264", "aac")
+    assert (info["width"], info["height"]) == (240, 98)
+
+    # the video is converted if it must be resized
+    settings = create_settings(video_format="mp4", video_size=(100, 50))
+    with patch("sigal.video.generate_video_pass") as mock_generate_video_pass:
+        generate_video(source, outname, settings)
+    assert mock_generate_video_pass.called
+
+
+def test_segments():
+    assert _segments(10, 3) == [(0, 10 / 3), (10 / 3, 10 / 3), (20 / 3, None)]
+    assert _segments(2, 3) == [(0, None)]
+
+
+def test_generate_video_chunks(tmpdir):
+    outname = str(tmpdir.join("video.webm"))
+    settings = create_settings(
+        video_format="webm",
+        video_chunks={"min_duration": 5, "segment_duration": 3, "jobs": 2},
+        webm_options=["-c:v", "libvpx", "-b:v", "200k", "-c:a", "libvorbis"],
+    )
+    probe = probe_video(SRCFILE)
+    parts_dir = str(tmpdir.join(".video.webm.parts"))
+
+    # the processing is interrupted after encoding the segments
+    with (
+        patch("sigal.video.encode_video", wraps=encode_video) as mock_encode,
+        patch("sigal.video.shutil.rmtree", side_effect=KeyboardInterrupt),
+        pytest.raises(KeyboardInterrupt),
+    ):
+        generate_video(SRCFILE, outname, settings, probe=probe)
+    assert mock_encode.call_count == 3
+    assert len([f for f in os.listdir(parts_dir) if f.endswith(".webm")]) == 3
+
+    # the segments are reused
+    with patch("sigal.video.encode_video", wraps=encode_video) as mock_encode:
+        generate_video(SRCFILE, outname, settings, probe=probe)
+    assert mock_encode.call_count == 0
+    assert not os.path.exists(parts_dir)
+
+    info = probe_video(outname)
+    assert info["duration"] == pytest.approx(probe["duration"], abs=0.1)
+    assert (info["video_codec"], info["audio_codec"]) == ("vp8", "vorbis")
+    assert (info["width"], info["height"]) == (240, 98)
+
+
+def test_generate_hls(tmpdir):
+    outname = str(tmpdir.join("master.m3u8"))
+    renditions = [(60, "200k", "64k"), (90, "300k", "64k"), (360, "800k", "96k")]
+    settings = create_settings(
+        video_hls={"renditions": renditions, "segment_duration": 4}
+    )
+    probe = probe_video(SRCFILE)
+    with patch("sigal.video.check_subprocess", wraps=check_subprocess) as mock:
+        assert generate_hls(SRCFILE, outname, settings, probe) == ["60p", "90p"]
+    # a single ffmpeg process for all the renditions
+    assert mock.call_count == 1
+    with open(outname) as f:
+        assert f.read().splitlines()[2:] == [
+            "#EXT-X-STREAM-INF:BANDWIDTH=264000,RESOLUTION=146x60",
+            "60p/index.m3u8",
+            "#EXT-X-STREAM-INF:BANDWIDTH=364000,RESOLUTION=220x90",
+            "90p/index.m3u8",
+        ]
+    with open(tmpdir.join("90p", "index.m3u8")) as f:
+        playlist = f.read()
+    assert "#EXT-X-PLAYLIST-TYPE:VOD" in playlist
+    assert playlist.count(".ts") == 3
+
+    # only the modified rendition is encoded again
+    settings["video_hls"]["renditions"] = [(60, "200k", "64k"), (80, "300k", "64k")]
+    with patch("sigal.video.check_subprocess", wraps=check_subprocess) as mock:
+        assert generate_hls(SRCFILE, outname, settings, probe) == ["60p", "80p"]
+    assert mock.call_count == 1
+    assert mock.call_args[0][0].count("hls") == 1
+    assert sorted(os.listdir(tmpdir)) == ["60p", "80p", "hls.json", "master.m3u8"]
+
+    with patch("sigal.video.check_subprocess", wraps=check_subprocess) as mock:
+        generate_hls(SRCFILE, outname, settings, probe)
+    assert mock.call_count == 0
+
+
+def test_generate_hls_int_bitrates(tmpdir):
+    outname = str(tmpdir.join("master.m3u8"))
+    settings = create_settings(video_hls={"renditions": [(60, 200000, 64000)]})
+    probe = probe_video(SRCFILE)
+    assert generate_hls(SRCFILE, outname, settings, probe) == ["60p"]
+    with open(outname) as f:
+        assert "BANDWIDTH=264000" in f.read()
+
+
+def test_process_video_hls(tmpdir):
+    settings = create_settings(
+        video_format="webm",
+        video_hls={"renditions": [(60, "200k", "64k")]},
+        make_thumbs=False,
+        source=os.path.join(SRCDIR, "video"),
+        destination=str(tmpdir),
+    )
+    video = Video(TEST_VIDEO, ".", settings)
+    assert video.hls is None
+    assert process_video(video) == Status.SUCCESS
+    assert video.build_info["hls"] == ["60p"]
+    assert video.hls == {
+        "url": "./hls/example%20video/master.m3u8",
+        "renditions": ["60p"],
+    }
+    assert os.path.isfile(tmpdir.join("hls", "example video", "60p", "index.m3u8"))
+    assert video.fingerprint == {"video_hls": settings["video_hls"]}
+
+
+def test_process_video_poster(tmpdir):
+    settings = create_settings(
+        video_format="webm",
+        video_poster=True,
+        thumb_video_delay=2,
+        thumb_video_black_retries=2,
+        source=os.path.join(SRCDIR, "video"),
+        destination=str(tmpdir),
+    )
+    tmpdir.mkdir("thumbnails")
+    video = Video(TEST_VIDEO, ".", settings)
+    assert video.poster is None
+    # the frames are extracted while the video is converted
+    with patch("sigal.video.extract_frames") as extract:
+        assert process_video(video) == Status.SUCCESS
+    extract.assert_not_called()
+    assert video.poster == {
+        "url": "./thumbnails/example%20video.poster.jpg",
+        "width": 240,
+        "height": 98,
+    }
+    assert video.fingerprint == {"video_poster": True}
+    with PILImage.open(video.poster_path) as img:
+        assert img.size == (240, 98)
+    with PILImage.open(video.thumb_path) as img:
+        assert img.size == settings["thumb_size"]
+    assert video.poster_path in video.output_paths
+
+    # the frames are extracted from the source if the video is not converted
+    settings["use_orig"] = True
+    settings["video_format"] = "ogv"
+    video = Video(TEST_VIDEO, ".", settings)
+    os.remove(video.thumb_path)
+    assert process_video(video) == Status.SUCCESS
+    assert os.path.isfile(video.thumb_path)
+    assert video.poster["width"] == 240
+
+
+def test_video_cost():
+    settings = create_settings(video_format="webm")
+    video = Video(TEST_VIDEO, "video", settings)
+    video.file_metadata = {"duration": 600}
+    assert video.cost == 600
+    settings["video_chunks"] = {"jobs": 4}
+    assert video.cost == 150
+
+
+def test_get_chunks_jobs(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 16)
+    monkeypatch.setattr("sigal.video.processes", 4)
+    # the CPUs are shared by the processes
+    assert get_chunks_jobs({"jobs": None}) == 4
+    assert get_chunks_jobs({"jobs": 2}) == 2
+    monkeypatch.setattr("sigal.video.processes", 32)
+    assert get_chunks_jobs({"jobs": None}) == 1
+
+
+def test_second_pass_video_parallel(tmpdir):
+    """Two videos can be encoded with two passes at the same time."""
+    settings = create_settings(
+        video_size=(100, 50),
+        video_format="webm",
+        webm_options="-c:v libvpx -b:v 200k -pass 1 -an -f null".split() + ["-"],
+        webm_options_second_pass="-c:v libvpx -b:v 200k -pass 2 -an".split(),
+    )
+    outnames = [str(tmpdir.join(f"test{i}.webm")) for i in range(2)]
+    with ThreadPoolExecutor(2) as executor:
+        list(
+            executor.map(
+                lambda outname: generate_video(SRCFILE, outname, settings), outnames
+            )
+        )
+    for outname in outnames:
+        assert video_size(outname) == (100, 40)
+    assert not os.path.exists("ffmpeg2pass-0.log")
+
+
+def test_process_animated_gif(tmpdir):
+    settings = create_settings(
+        animated_gif_format="mp4",
+        source=os.path.join(SRCDIR, "dir1", "test1"),
+        destination=str(tmpdir),
+    )
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    video = AnimatedGif(TEST_GIF, ".", settings)
+    assert video.type == "video"
+    assert video.dst_filename == "example.mp4"
+    assert video.mime == "video/mp4"
+    assert video.thumb_name == "thumbnails/example.jpg"
+    assert process_video(video) == Status.SUCCESS
+
+    # resized to video_size, with even dimensions
+    assert video_size(video.dst_path) == (320, 360)
+    with PILImage.open(video.thumb_path) as img:
+        assert img.size == settings["thumb_size"]
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+from PIL import Image as PILImage
+
+if os.environ.get("SIGAL_REQUIRE_VIPS"):
+    # the tests must not be skipped in the CI job with libvips
+    import pyvips  # noqa: F401
+else:
+    pytest.importorskip("pyvips")
+
+from sigal import signals, vips  # noqa: E402
+from sigal.gallery import Image  # noqa: E402
+from sigal.image import get_img_backend, process_image  # noqa: E402
+from sigal.settings import Status, create_settings  # noqa: E402
+
+CURRENT_DIR = os.path.dirname(__file__)
+SRCDIR = os.path.join(CURRENT_DIR, "sample", "pictures")
+TEST_IMAGE = "KeckObservatory20071020.jpg"
+SRCFILE = os.path.join(SRCDIR, "dir2", TEST_IMAGE)
+
+
+def make_settings(tmpdir, **kwargs):
+    return create_settings(
+        img_backend="vips",
+        source=os.path.join(SRCDIR, "dir2"),
+        destination=str(tmpdir),
+        **kwargs,
+    )
+
+
+def test_get_img_backend(tmpdir):
+    assert get_img_backend(make_settings(tmpdir)) is vips
+
+
+def test_process_image(tmpdir):
+    settings = make_settings(tmpdir, img_renditions=[(320, 240)], img_variants=["WEBP"])
+    os.makedirs(str(tmpdir.join("thumbnails")))
+    os.makedirs(str(tmpdir.join("renditions")))
+    image = Image(TEST_IMAGE, ".", settings)
+    assert process_image(image) == Status.SUCCESS
+
+    with PILImage.open(image.dst_path) as img:
+        assert img.size == (640, 427)
+    assert os.path.isfile(image.dst_path + ".webp")
+    with PILImage.open(image.thumb_path) as img:
+        assert img.size == settings["thumb_size"]
+    assert [r["width"] for r in image.renditions] == [320, 640]
+
+
+def test_plugin_shim(disconnect_signals, tmpdir):
+    calls = []
+
+    def receiver(img, settings=None):
+        calls.append(img)
+        return img.convert("L")
+
+    signals.img_resized.connect(receiver)
+    settings = make_settings(tmpdir)
+    outname = str(tmpdir.join("out.jpg"))
+    vips.generate_image(SRCFILE, outname, settings)
+    assert isinstance(calls[0], PILImage.Image)
+    with PILImage.open(outname) as img:
+        assert img.mode == "L"
+
+
+def test_get_size_and_metadata():
+    assert vips.get_size(SRCFILE) == {"width": 900, "height": 600}
+    metadata = vips.get_image_metadata(SRCFILE)
+    assert metadata["size"] == {"width": 900, "height": 600}
+    assert metadata["exif"]
+
+
+@pytest.mark.parametrize("processor", [None, "ResizeToFit"])
+def test_generate_image_rotated(tmpdir, processor):
+    "The images are rotated with their EXIF orientation."
+    source = str(tmpdir.join("rot.jpg"))
+    exif = PILImage.Exif()
+    exif[0x0112] = 6
+    PILImage.new("RGB", (900, 600), "red").save(source, exif=exif)
+    settings = make_settings(tmpdir, img_processor=processor, img_size=(640, 640))
+    outname = str(tmpdir.join("out.jpg"))
+    vips.generate_image(source, outname, settings)
+    with PILImage.open(outname) as img:
+        assert img.size == ((600, 900) if processor is None else (427, 640))